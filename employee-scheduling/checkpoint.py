@@ -0,0 +1,135 @@
+"""
+Checkpoints of the schedule, so a restarted service resumes solving where it stopped instead of from scratch.
+
+A checkpoint is gzipped JSON, with the availabilities and shifts stored column by column and employees referred to
+by their index in the employee list.
+"""
+import atexit
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from domain import Employee, Availability, AvailabilityType, ScheduleState, Shift, EmployeeSchedule
+
+
+class CheckpointWriter:
+    """
+    Writes a checkpoint of the schedule to path at most once every interval_seconds after it changes, on a background
+    thread, so neither the solver nor the requests wait for the disk. snapshot() returns the checkpoint to write.
+    """
+    def __init__(self, path: str, snapshot, interval_seconds: float):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval_seconds = interval_seconds
+        self.is_changed = False
+        self.changed = threading.Condition()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        threading.Thread(target=self.run, name='checkpoint-writer', daemon=True).start()
+        # The thread is a daemon, so the last changes are written on exit
+        atexit.register(self.flush)
+
+    def mark_changed(self):
+        with self.changed:
+            self.is_changed = True
+            self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.is_changed)
+            # New best solutions found meanwhile only replace the one to write
+            time.sleep(self.interval_seconds)
+            self.flush()
+
+    def flush(self):
+        with self.changed:
+            is_changed = self.is_changed
+            self.is_changed = False
+        if not is_changed:
+            return
+        try:
+            self.write(self.snapshot())
+        except Exception:
+            # Logged, so a failed write does not end the writer thread; the schedule is written again with its next
+            # change
+            print('writing the schedule checkpoint failed:')
+            traceback.print_exc()
+
+    def write(self, checkpoint: dict):
+        # Written next to the checkpoint and renamed over it, so a crash never leaves a truncated checkpoint behind
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as raw_file, gzip.open(raw_file, 'wt') as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file, separators=(',', ':'))
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def load(self):
+        try:
+            with gzip.open(self.path, 'rt') as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            # A corrupt checkpoint is skipped, so the service starts from the demo data instead
+            print('reading the schedule checkpoint failed:')
+            traceback.print_exc()
+            return None
+
+
+def schedule_to_checkpoint(schedule: EmployeeSchedule):
+    # Employees have unique names, while the solver may hand over shifts referring to copies of them
+    employee_index_map = {employee.name: index for index, employee in enumerate(schedule.employee_list)}
+    return {
+        'scheduleState': schedule.schedule_state.to_dict(),
+        'employeeList': {
+            'name': [employee.name for employee in schedule.employee_list],
+            'skillSet': [list(employee.skill_set) for employee in schedule.employee_list],
+        },
+        'availabilityList': {
+            'employee': [employee_index_map[availability.employee.name]
+                         for availability in schedule.availability_list],
+            'date': [availability.date.isoformat() for availability in schedule.availability_list],
+            'availabilityType': [availability.availability_type.value
+                                 for availability in schedule.availability_list],
+        },
+        'shiftList': {
+            'id': [shift.id for shift in schedule.shift_list],
+            'start': [shift.start.isoformat() for shift in schedule.shift_list],
+            'end': [shift.end.isoformat() for shift in schedule.shift_list],
+            'location': [shift.location for shift in schedule.shift_list],
+            'requiredSkill': [shift.required_skill for shift in schedule.shift_list],
+            'employee': [employee_index_map[shift.employee.name] if shift.employee is not None else None
+                         for shift in schedule.shift_list],
+        },
+    }
+
+
+def schedule_from_checkpoint(checkpoint: dict):
+    schedule_state_dict = checkpoint['scheduleState']
+    schedule_state = ScheduleState(schedule_state_dict['publish_length'], schedule_state_dict['draft_length'],
+                                   datetime.date.fromisoformat(schedule_state_dict['first_draft_date']),
+                                   datetime.date.fromisoformat(schedule_state_dict['last_historic_date']))
+    employee_columns = checkpoint['employeeList']
+    employee_list = [Employee(name, skill_set)
+                     for name, skill_set in zip(employee_columns['name'], employee_columns['skillSet'])]
+    availability_columns = checkpoint['availabilityList']
+    availability_list = [Availability(employee_list[employee_index], datetime.date.fromisoformat(date),
+                                      AvailabilityType(availability_type))
+                         for employee_index, date, availability_type
+                         in zip(availability_columns['employee'], availability_columns['date'],
+                                availability_columns['availabilityType'])]
+    shift_columns = checkpoint['shiftList']
+    shift_list = [Shift(shift_id, datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end),
+                        location, required_skill,
+                        employee_list[employee_index] if employee_index is not None else None)
+                  for shift_id, start, end, location, required_skill, employee_index
+                  in zip(shift_columns['id'], shift_columns['start'], shift_columns['end'],
+                         shift_columns['location'], shift_columns['requiredSkill'], shift_columns['employee'])]
+    return EmployeeSchedule(schedule_state, availability_list, employee_list, shift_list, None)
@@ -3,7 +3,7 @@ from optapy.score import HardSoftScore
 from optapy.constraint import Joiners, ConstraintFactory
 
 from domain import Shift, Availability, AvailabilityType
-from datetime import timedelta, datetime
+from datetime import datetime
 
 
 def get_start_of_availability(availability: Availability):
@@ -15,31 +15,33 @@ def get_end_of_availability(availability: Availability):
 
 
 def get_minute_overlap(shift1: Shift, shift2: Shift) -> int:
-    duration_of_overlap: timedelta = min(shift1.end, shift2.end) - max(shift1.start, shift2.start)
-    return int(duration_of_overlap.total_seconds() // 60)
+    return min(shift1.end_minute, shift2.end_minute) - max(shift1.start_minute, shift2.start_minute)
 
 
 def get_shift_duration_in_minutes(shift: Shift) -> int:
-    return int((shift.end - shift.start).total_seconds() // 60)
+    return shift.duration_minutes
 
 
 @constraint_provider
 def employee_scheduling_constraints(constraint_factory: ConstraintFactory):
+    # The availability constraints build on the same join, so the solver joins every shift to its availability once
+    # and only their type filters differ
+    shift_availabilities = get_shift_availabilities(constraint_factory)
     return [
         required_skill(constraint_factory),
         no_overlapping_shifts(constraint_factory),
         at_least_10_hours_between_two_shifts(constraint_factory),
         one_shift_per_day(constraint_factory),
-        unavailable_employee(constraint_factory),
-        desired_day_for_employee(constraint_factory),
-        undesired_day_for_employee(constraint_factory),
+        unavailable_employee(constraint_factory, shift_availabilities),
+        desired_day_for_employee(constraint_factory, shift_availabilities),
+        undesired_day_for_employee(constraint_factory, shift_availabilities),
     ]
 
 
 def required_skill(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each(Shift) \
-        .filter(lambda shift: shift.required_skill not in shift.employee.skill_set) \
+        .filter(lambda shift: (shift.required_skill_mask & shift.employee.skill_mask) == 0) \
         .penalize("Missing required skill", HardSoftScore.ONE_HARD)
 
 
@@ -47,73 +49,73 @@ def no_overlapping_shifts(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each_unique_pair(Shift,
                               Joiners.equal(lambda shift: shift.employee),
-                              Joiners.overlapping(lambda shift: shift.start,
-                                                  lambda shift: shift.end)
+                              Joiners.overlapping(lambda shift: shift.start_minute,
+                                                  lambda shift: shift.end_minute)
                               ) \
         .penalize("Overlapping shift", HardSoftScore.ONE_HARD, get_minute_overlap)
 
 
 def at_least_10_hours_between_two_shifts(constraint_factory: ConstraintFactory):
-    TEN_HOURS_IN_SECONDS = 60 * 60 * 10
+    TEN_HOURS_IN_MINUTES = 60 * 10
     return constraint_factory \
         .for_each_unique_pair(Shift,
                               Joiners.equal(lambda shift: shift.employee),
-                              Joiners.less_than_or_equal(lambda shift: shift.end,
-                                                         lambda shift: shift.start)
+                              Joiners.less_than_or_equal(lambda shift: shift.end_minute,
+                                                         lambda shift: shift.start_minute)
                               ) \
         .filter(lambda first_shift, second_shift:
-                (second_shift.start - first_shift.end).total_seconds() < TEN_HOURS_IN_SECONDS) \
+                second_shift.start_minute - first_shift.end_minute < TEN_HOURS_IN_MINUTES) \
         .penalize("At least 10 hours between 2 shifts", HardSoftScore.ONE_HARD,
                   lambda first_shift, second_shift:
-                  (TEN_HOURS_IN_SECONDS - (second_shift.start - first_shift.end).total_seconds()) // 60)
+                  TEN_HOURS_IN_MINUTES - (second_shift.start_minute - first_shift.end_minute))
 
 
 def one_shift_per_day(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each_unique_pair(Shift,
                               Joiners.equal(lambda shift: shift.employee),
-                              Joiners.equal(lambda shift: shift.start.date())
+                              Joiners.equal(lambda shift: shift.day)
                               ) \
         .penalize("Max one shift per day", HardSoftScore.ONE_HARD)
 
 
-def unavailable_employee(constraint_factory: ConstraintFactory):
+def get_shift_availabilities(constraint_factory: ConstraintFactory):
+    """Every assigned shift with the availability of its employee on the day it starts."""
     return constraint_factory \
         .for_each(Shift) \
         .join(Availability,
               Joiners.equal(lambda shift: shift.employee,
                             lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
+              Joiners.equal(lambda shift: shift.day,
+                            lambda availability: availability.date.toordinal())
+              )
+
+
+# The constraints below take the join from employee_scheduling_constraints, and build their own when they are
+# verified on their own
+
+def unavailable_employee(constraint_factory: ConstraintFactory, shift_availabilities=None):
+    if shift_availabilities is None:
+        shift_availabilities = get_shift_availabilities(constraint_factory)
+    return shift_availabilities \
         .filter(lambda shift, availability: availability.availability_type == AvailabilityType.UNAVAILABLE) \
         .penalize('Unavailable employee', HardSoftScore.ONE_HARD,
                   lambda shift, availability: get_shift_duration_in_minutes(shift))
 
 
-def desired_day_for_employee(constraint_factory: ConstraintFactory):
-    return constraint_factory \
-        .for_each(Shift) \
-        .join(Availability,
-              Joiners.equal(lambda shift: shift.employee,
-                            lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
+def desired_day_for_employee(constraint_factory: ConstraintFactory, shift_availabilities=None):
+    if shift_availabilities is None:
+        shift_availabilities = get_shift_availabilities(constraint_factory)
+    return shift_availabilities \
         .filter(lambda shift, availability: availability.availability_type == AvailabilityType.DESIRED) \
         .reward('Desired day for employee', HardSoftScore.ONE_SOFT,
                 lambda shift, availability: get_shift_duration_in_minutes(shift))
 
 
-def undesired_day_for_employee(constraint_factory: ConstraintFactory):
-    return constraint_factory \
-        .for_each(Shift) \
-        .join(Availability,
-              Joiners.equal(lambda shift: shift.employee,
-                            lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
+def undesired_day_for_employee(constraint_factory: ConstraintFactory, shift_availabilities=None):
+    if shift_availabilities is None:
+        shift_availabilities = get_shift_availabilities(constraint_factory)
+    return shift_availabilities \
         .filter(lambda shift, availability: availability.availability_type == AvailabilityType.UNDESIRED) \
         .penalize('Undesired day for employee', HardSoftScore.ONE_SOFT,
                   lambda shift, availability: get_shift_duration_in_minutes(shift))
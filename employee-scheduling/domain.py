@@ -3,16 +3,54 @@ import optapy.types
 import optapy.score
 import datetime
 import enum
+import threading
+
+# Shift times are also kept as whole minutes since this (naive) instant, so constraints compare integers
+EPOCH = datetime.datetime(1970, 1, 1)
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def get_epoch_minute(date_time: datetime.datetime) -> int:
+    return (date_time - EPOCH) // MINUTE
+
+
+class SkillRegistry:
+    """Interns skill names, giving every skill a bit of its own, so a set of skills is an int bitmask."""
+    def __init__(self):
+        self.skill_bit_map = dict()
+        self.lock = threading.Lock()
+
+    def get_bit(self, skill: str) -> int:
+        bit = self.skill_bit_map.get(skill)
+        if bit is None:
+            with self.lock:
+                bit = self.skill_bit_map.setdefault(skill, 1 << len(self.skill_bit_map))
+        return bit
+
+    def get_mask(self, skill_iterable) -> int:
+        mask = 0
+        for skill in skill_iterable:
+            mask |= self.get_bit(skill)
+        return mask
+
+
+skill_registry = SkillRegistry()
 
 
 @optapy.problem_fact
 class Employee:
     name: str
     skill_set: list[str]
+    # The skill_set bits of the skill registry, kept in sync by set_skill_set
+    skill_mask: int
 
     def __init__(self, name: str = None, skill_set: list[str] = None):
         self.name = name
+        self.set_skill_set(skill_set)
+
+    def set_skill_set(self, skill_set: list[str]):
         self.skill_set = skill_set
+        self.skill_mask = skill_registry.get_mask(skill_set) if skill_set is not None else 0
 
     def __str__(self):
         return f'Employee(name={self.name})'
@@ -39,12 +77,19 @@ class Availability:
     employee: Employee
     date: datetime.date
     availability_type: AvailabilityType
+    # An employee has at most one availability per date, which identifies it
+    id: str
 
     def __init__(self, employee: Employee = None, date: datetime.date = None,
                  availability_type: AvailabilityType = None):
         self.employee = employee
         self.date = date
         self.availability_type = availability_type
+        self.id = f'{employee.name}/{date.isoformat()}' if employee is not None and date is not None else None
+
+    @optapy.planning_id
+    def get_id(self):
+        return self.id
 
     def __str__(self):
         return f'Availability(employee={self.employee}, date={self.date}, availability_type={self.availability_type})'
@@ -71,7 +116,8 @@ class ScheduleState:
         self.last_historic_date = last_historic_date
 
     def is_draft(self, shift):
-        return shift.start >= datetime.datetime.combine(self.first_draft_date, datetime.time.min)
+        # Drafts start at midnight, so comparing the day the shift starts is enough
+        return shift.day >= self.first_draft_date.toordinal()
 
     def to_dict(self):
         return {
@@ -93,28 +139,56 @@ class Shift:
     end: datetime.datetime
     location: str
     required_skill: str
+    # The bit of required_skill in the skill registry
+    required_skill_mask: int
     employee: Employee
+    # Derived from start and end: the epoch minutes they fall on, the ordinal of the day it starts and its length
+    start_minute: int
+    end_minute: int
+    day: int
+    duration_minutes: int
+    # The employees the solver tries on the shift, see EmployeeSchedule.update_employee_ranges
+    employee_range: list[Employee]
 
     def __init__(self, id: int = None, start: datetime.datetime = None, end: datetime.datetime = None,
                  location: str = None, required_skill: str = None, employee: Employee = None):
         self.id = id
-        self.start = start
-        self.end = end
         self.location = location
         self.required_skill = required_skill
+        self.required_skill_mask = skill_registry.get_bit(required_skill) if required_skill is not None else 0
         self.employee = employee
+        self.employee_range = None
+        self.set_times(start, end)
+
+    def set_times(self, start: datetime.datetime, end: datetime.datetime):
+        self.start = start
+        self.end = end
+        if start is None or end is None:
+            self.start_minute = self.end_minute = self.day = self.duration_minutes = None
+        else:
+            self.start_minute = get_epoch_minute(start)
+            self.end_minute = get_epoch_minute(end)
+            self.day = start.toordinal()
+            self.duration_minutes = self.end_minute - self.start_minute
 
     @optapy.planning_id
     def get_id(self):
         return self.id
 
-    @optapy.planning_variable(Employee, value_range_provider_refs=['employee_range'])
+    @optapy.planning_variable(Employee, value_range_provider_refs=['shift_employee_range'])
     def get_employee(self):
         return self.employee
 
     def set_employee(self, employee):
         self.employee = employee
 
+    @optapy.value_range_provider('shift_employee_range', value_range_type=Employee)
+    def get_employee_range(self):
+        return self.employee_range
+
+    def set_employee_range(self, employee_range):
+        self.employee_range = employee_range
+
     def __str__(self):
         return f'Shift(id={self.id}, start={self.start}, end={self.end}, location={self.location}, ' \
                f'required_skill={self.required_skill}, employee={self.employee})'
@@ -147,7 +221,6 @@ class EmployeeSchedule:
         self.score = score
 
     @optapy.problem_fact_collection_property(Employee)
-    @optapy.value_range_provider('employee_range')
     def get_employee_list(self):
         return self.employee_list
 
@@ -166,12 +239,42 @@ class EmployeeSchedule:
     def set_score(self, score):
         self.score = score
 
+    def update_employee_ranges(self, shift_list=None, get_employee=None):
+        """
+        Restricts the employees the solver tries on every shift (of shift_list, all shifts by default) to those with
+        its required skill who are not unavailable on its day, or to all employees if that leaves none. A shift can
+        always keep the employee it has, or the one get_employee(shift) returns if given.
+        """
+        # Employees are told apart by name, since the solver may hand over shifts referring to copies of them
+        unavailable_names_by_day = dict()
+        for availability in self.availability_list:
+            if availability.availability_type == AvailabilityType.UNAVAILABLE:
+                unavailable_names_by_day.setdefault(availability.date.toordinal(), set()) \
+                    .add(availability.employee.name)
+        # Shifts needing the same skill on the same day share their candidates
+        candidates_by_skill_and_day = dict()
+        for shift in shift_list if shift_list is not None else self.shift_list:
+            key = (shift.required_skill_mask, shift.day)
+            if key not in candidates_by_skill_and_day:
+                unavailable_names = unavailable_names_by_day.get(shift.day, ())
+                candidate_list = [employee for employee in self.employee_list
+                                  if employee.skill_mask & shift.required_skill_mask
+                                  and employee.name not in unavailable_names] or self.employee_list
+                candidates_by_skill_and_day[key] = candidate_list, {employee.name for employee in candidate_list}
+            candidate_list, candidate_names = candidates_by_skill_and_day[key]
+            # Every shift gets a list of its own, which problem changes update in place
+            employee_range = list(candidate_list)
+            employee = get_employee(shift) if get_employee is not None else shift.employee
+            if employee is not None and employee.name not in candidate_names:
+                employee_range.append(employee)
+            shift.set_employee_range(employee_range)
+
     def to_dict(self):
         return {
             'employee_list': list(map(lambda employee: employee.to_dict(), self.employee_list)),
             'availability_list': list(map(lambda availability: availability.to_dict(), self.availability_list)),
             'schedule_state': self.schedule_state.to_dict(),
             'shift_list': list(map(lambda shift: shift.to_dict(), self.shift_list)),
-            'solver_status': self.solver_status.toString(),
+            'solver_status': self.solver_status.toString() if self.solver_status is not None else None,
             'score': self.score.toString(),
         }
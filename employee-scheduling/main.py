@@ -1,5 +1,6 @@
-from services import app, generate_demo_data
+from services import app, generate_demo_data, restore_checkpoint
 
 if __name__ == "__main__":
-    generate_demo_data()
+    if not restore_checkpoint():
+        generate_demo_data()
     app.run()
@@ -0,0 +1,238 @@
+"""
+Live edits to the employee schedule: adding an employee, setting or clearing an availability, calling in sick and
+publishing the next days of the draft.
+
+During a solve the service hands each edit to the solver job, which applies it between two steps, so the assignments
+found so far survive it. Without a solve the edit goes straight onto the schedule. That is why the functions below
+take a director: each employee, availability or shift they touch goes through it, and they finish by updating the
+candidate employees of the draft shifts concerned.
+"""
+import datetime
+from domain import Availability, AvailabilityType
+from optapy import problem_change
+
+
+class ImmediateProblemChangeDirector:
+    """
+    The director for a schedule nothing is solving. There is no solver copy of the employees, availabilities or
+    shifts, so each consumer is called with the object it was handed.
+    """
+    def addEntity(self, entity, consumer):
+        consumer(entity)
+
+    def removeEntity(self, entity, consumer):
+        consumer(entity)
+
+    def changeVariable(self, entity, variable_name, consumer):
+        consumer(entity)
+
+    def addProblemFact(self, problem_fact, consumer):
+        consumer(problem_fact)
+
+    def removeProblemFact(self, problem_fact, consumer):
+        consumer(problem_fact)
+
+    def changeProblemProperty(self, problem_fact_or_entity, consumer):
+        consumer(problem_fact_or_entity)
+
+    def lookUpWorkingObjectOrFail(self, external_object):
+        return external_object
+
+    def updateShadowVariables(self):
+        pass
+
+
+def read_working_object(working_object):
+    """
+    Copies the fields of a Python employee, availability or schedule into the solver's Java object for it. An
+    availability added mid-solve starts out empty, and an edited one keeps its old type, which the availability
+    constraints would go on reading. The Python objects handed out without a solver need no copy.
+    """
+    if hasattr(working_object, 'readFromPythonObject'):
+        from java.util import HashSet
+        working_object.readFromPythonObject(HashSet(), getattr(working_object, '__optaplannerReferenceMap'))
+
+
+def find_employee(schedule, employee_name):
+    return next((employee for employee in schedule.employee_list if employee.name == employee_name), None)
+
+
+def find_availability(schedule, employee_name, date):
+    return next((availability for availability in schedule.availability_list
+                 if availability.employee.name == employee_name and availability.date == date), None)
+
+
+def get_working_employee(shift, director):
+    """The employee on the shift. While solving, only the solver's copy of the shift follows its moves."""
+    working_shift = director.lookUpWorkingObjectOrFail(shift)
+    return shift.employee if working_shift is shift else working_shift.getEmployee()
+
+
+def update_shift_employee_ranges(schedule, shift_list, director):
+    """Updates the candidate employees of the draft shifts among shift_list, for those whose candidates changed."""
+    draft_shift_list = [shift for shift in shift_list if schedule.schedule_state.is_draft(shift)]
+    # The candidates include the employee each shift has, which only the solver knows while solving
+    employee_by_name = {employee.name: employee for employee in schedule.employee_list}
+
+    def get_employee(shift):
+        employee = get_working_employee(shift, director)
+        return employee_by_name[employee.name] if employee is not None else None
+    old_employee_range_list = [shift.employee_range for shift in draft_shift_list]
+    # Worked out for all the shifts at once, so the solver is only told about the changed ones
+    schedule.update_employee_ranges(draft_shift_list, get_employee)
+    for shift, old_employee_range in zip(draft_shift_list, old_employee_range_list):
+        employee_range = shift.employee_range
+        if old_employee_range is None or employee_range == old_employee_range:
+            continue
+        # The solver's copy of the shift reads the list it was given, so that list is the one to update
+        shift.set_employee_range(old_employee_range)
+
+        def change(_, employee_range=employee_range, old_employee_range=old_employee_range):
+            old_employee_range[:] = employee_range
+        director.changeProblemProperty(shift, change)
+
+
+def add_employee(schedule, employee, director):
+    """Adds an employee, who becomes a candidate for the draft shifts needing one of their skills."""
+    def add(working_employee):
+        schedule.employee_list.append(employee)
+        read_working_object(working_employee)
+    director.addProblemFact(employee, add)
+    update_shift_employee_ranges(schedule, schedule.shift_list, director)
+
+
+def set_availability(schedule, employee_name, date, availability_type, director):
+    """
+    Sets the availability of the employee on the date, or removes it if availability_type is None, and updates the
+    candidate employees of the shifts of that day.
+    """
+    availability = find_availability(schedule, employee_name, date)
+    if availability is None:
+        if availability_type is None:
+            return
+        availability = Availability(find_employee(schedule, employee_name), date, availability_type)
+
+        def add(working_availability):
+            schedule.availability_list.append(availability)
+            read_working_object(working_availability)
+        director.addProblemFact(availability, add)
+    elif availability_type is None:
+        director.removeProblemFact(availability, lambda _: schedule.availability_list.remove(availability))
+    else:
+        def change(working_availability):
+            availability.availability_type = availability_type
+            read_working_object(working_availability)
+        director.changeProblemProperty(availability, change)
+    day = date.toordinal()
+    update_shift_employee_ranges(schedule, [shift for shift in schedule.shift_list if shift.day == day], director)
+
+
+def call_in_sick(schedule, employee_name, date, director):
+    """
+    Makes the employee unavailable on the date and takes them off its draft shifts, for the solver to reassign.
+    Published shifts keep them, so the hard constraint shows which ones still need a replacement.
+    """
+    day = date.toordinal()
+    for shift in schedule.shift_list:
+        if shift.day != day or not schedule.schedule_state.is_draft(shift):
+            continue
+        employee = get_working_employee(shift, director)
+        if employee is not None and employee.name == employee_name:
+            def unassign(working_shift, shift=shift):
+                shift.set_employee(None)
+                # The solver reads its planning variables through the accessors of its copy
+                if working_shift is not shift:
+                    working_shift.setEmployee(None)
+            director.changeVariable(shift, 'employee', unassign)
+    # Off their shifts first, so the candidates of those shifts no longer include them
+    set_availability(schedule, employee_name, date, AvailabilityType.UNAVAILABLE, director)
+
+
+def publish(schedule, first_draft_date, availability_list, shift_list, director):
+    """
+    Publishes the first publish_length days of the draft, which pins their shifts, and appends the availabilities and
+    shifts of the days that follow the draft, for the solver to assign. The availabilities may refer to copies of the
+    employees of the schedule. Returns False, without changing anything, if the draft no longer starts on
+    first_draft_date, because it was published in the meantime.
+    """
+    schedule_state = schedule.schedule_state
+    if schedule_state.first_draft_date != first_draft_date:
+        return False
+    # Not a problem fact, so PublishProblemChange reads it into the solver's copy; the pinning filter reads it whenever
+    # the solver selects a shift
+    schedule_state.last_historic_date = first_draft_date
+    schedule_state.first_draft_date = first_draft_date + datetime.timedelta(days=schedule_state.publish_length)
+
+    employee_by_name = {employee.name: employee for employee in schedule.employee_list}
+    for availability in availability_list:
+        availability.employee = employee_by_name[availability.employee.name]
+
+        def add(working_availability, availability=availability):
+            schedule.availability_list.append(availability)
+            read_working_object(working_availability)
+        director.addProblemFact(availability, add)
+    # The availabilities of the new days are in, so the ranges of their shifts account for them
+    schedule.update_employee_ranges(shift_list)
+    for shift in shift_list:
+        director.addEntity(shift, lambda _, shift=shift: schedule.shift_list.append(shift))
+    return True
+
+
+# Each change class wraps one of the functions above. The solver calls doChange with its working solution, and the
+# function edits the Python schedule inside it through the solver's director. With nothing solving, the service calls
+# apply itself, with an ImmediateProblemChangeDirector.
+
+@problem_change
+class PublishProblemChange:
+    def __init__(self, first_draft_date, availability_list, shift_list):
+        self.first_draft_date = first_draft_date
+        self.availability_list = availability_list
+        self.shift_list = shift_list
+
+    def apply(self, schedule, director):
+        publish(schedule, self.first_draft_date, self.availability_list, self.shift_list, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+        # The schedule state is no problem fact, so the solver's copy of it, taken when solving started, only gets the
+        # new draft dates by reading the working solution in
+        read_working_object(working_solution)
+
+
+@problem_change
+class AddEmployeeProblemChange:
+    def __init__(self, employee):
+        self.employee = employee
+
+    def apply(self, schedule, director):
+        add_employee(schedule, self.employee, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+
+
+@problem_change
+class SetAvailabilityProblemChange:
+    def __init__(self, employee_name, date, availability_type):
+        self.employee_name = employee_name
+        self.date = date
+        self.availability_type = availability_type
+
+    def apply(self, schedule, director):
+        set_availability(schedule, self.employee_name, self.date, self.availability_type, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+
+
+@problem_change
+class CallInSickProblemChange:
+    def __init__(self, employee_name, date):
+        self.employee_name = employee_name
+        self.date = date
+
+    def apply(self, schedule, director):
+        call_in_sick(schedule, self.employee_name, self.date, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
@@ -1,13 +1,21 @@
 from domain import Employee, Shift, Availability, AvailabilityType, ScheduleState, EmployeeSchedule
 import datetime
+import json
+import os
+import tempfile
+import threading
 from random import Random
 from optapy import solver_manager_create, score_manager_create
 import optapy.config
 from optapy.types import Duration, SolverStatus
 from optapy.score import HardSoftScore
 from constraints import employee_scheduling_constraints
+from checkpoint import CheckpointWriter, schedule_to_checkpoint, schedule_from_checkpoint
+from problem_changes import ImmediateProblemChangeDirector, PublishProblemChange, AddEmployeeProblemChange, \
+    SetAvailabilityProblemChange, CallInSickProblemChange, find_employee
 from typing import Optional
-from flask import Flask, jsonify
+from flask import Flask, Response, request
+from java.lang import IllegalStateException
 
 app = Flask(__name__)
 
@@ -39,6 +47,27 @@ SHIFT_START_TIME_COMBOS = (
 location_to_shift_start_time_list_dict = dict()
 id_generator = 0
 schedule: Optional[EmployeeSchedule] = None
+# Bumped whenever the schedule changes; together with is_solving it tells event streams what to push
+schedule_version = 0
+is_solving = False
+# The job solving the schedule, which gets the changes to it; None while it is not being solved
+solver_job = None
+schedule_changed = threading.Condition()
+# Version of the schedule its score was calculated for: best solutions come scored by the solver, edits do not
+schedule_score_version = None
+# Serialized schedule, with the (schedule_version, is_solving) key it was built for; rebuilt on every change, so
+# requests and event streams only ever read it
+schedule_snapshot = (None, None)
+# Seconds a schedule stream waits for a change before it sends a keep-alive comment instead,
+# so proxies do not close it as idle between two edits of the schedule
+SCHEDULE_KEEP_ALIVE_SECONDS = 15
+# The schedule is checkpointed there at most this often, and a restarted service resumes solving from the checkpoint
+CHECKPOINT_DIRECTORY = os.environ.get('SCHEDULE_CHECKPOINT_DIRECTORY',
+                                      os.path.join(tempfile.gettempdir(), 'optapy-employee-scheduling-checkpoints'))
+CHECKPOINT_SECONDS = int(os.environ.get('SCHEDULE_CHECKPOINT_SECONDS', 10))
+# Written on a background thread, so saving a best solution never waits for the disk
+checkpoint_writer = CheckpointWriter(os.path.join(CHECKPOINT_DIRECTORY, 'schedule.json.gz'),
+                                     lambda: get_checkpoint(), CHECKPOINT_SECONDS)
 
 
 def generate_demo_data():
@@ -54,10 +83,7 @@ def generate_demo_data():
 
     random = Random(0)
 
-    shift_template_index = 0
-    for location in LOCATIONS:
-        location_to_shift_start_time_list_dict[location] = SHIFT_START_TIME_COMBOS[shift_template_index]
-        shift_template_index = (shift_template_index + 1) % len(SHIFT_START_TIME_COMBOS)
+    assign_shift_start_times()
 
     name_permutations = join_all_combinations(FIRST_NAMES, LAST_NAMES)
     random.shuffle(name_permutations)
@@ -66,10 +92,7 @@ def generate_demo_data():
     for i in range(16):
         skills = pick_subset(OPTIONAL_SKILLS, random, 1, 3)
         skills.append(pick_random(REQUIRED_SKILLS, random))
-        employee = Employee()
-        employee.name = name_permutations[i]
-        employee.skill_set = skills
-        employee_list.append(employee)
+        employee_list.append(Employee(name_permutations[i], skills))
 
     shift_list = []
     availability_list = []
@@ -78,11 +101,7 @@ def generate_demo_data():
         date = START_DATE + datetime.timedelta(days=i)
         for employee in employees_with_availabilities_on_day:
             availability_type = pick_random(AvailabilityType.list(), random)
-            availability = Availability()
-            availability.date = date
-            availability.employee = employee
-            availability.availability_type = availability_type
-            availability_list.append(availability)
+            availability_list.append(Availability(employee, date, availability_type))
         shift_list.extend(generate_shifts_for_day(date, random))
     schedule = EmployeeSchedule(
         schedule_state,
@@ -93,6 +112,38 @@ def generate_demo_data():
     )
 
 
+def assign_shift_start_times():
+    shift_template_index = 0
+    for location in LOCATIONS:
+        location_to_shift_start_time_list_dict[location] = SHIFT_START_TIME_COMBOS[shift_template_index]
+        shift_template_index = (shift_template_index + 1) % len(SHIFT_START_TIME_COMBOS)
+
+
+def restore_checkpoint():
+    """
+    Restores the schedule of the last checkpoint, and resumes solving it if it was being solved when the service
+    stopped. Returns whether there was a checkpoint to restore.
+    """
+    global schedule, id_generator
+    checkpoint = checkpoint_writer.load()
+    if checkpoint is None:
+        return False
+    assign_shift_start_times()
+    schedule = schedule_from_checkpoint(checkpoint['schedule'])
+    id_generator = max((shift.id for shift in schedule.shift_list), default=-1) + 1
+    if checkpoint['solving']:
+        solve()
+    return True
+
+
+def get_checkpoint():
+    with schedule_changed:
+        return {
+            'solving': is_solving,
+            'schedule': schedule_to_checkpoint(find_by_id(SINGLETON_ID)),
+        }
+
+
 def generate_shifts_for_day(date: datetime.date, random: Random):
     out = []
     for location in LOCATIONS:
@@ -117,31 +168,24 @@ def generate_shift_for_timeslot(timeslot_start: datetime.datetime, timeslot_end:
         else:
             required_skill = pick_random(OPTIONAL_SKILLS, random)
 
-        shift = Shift()
-        shift.id = id_generator
-        shift.start = timeslot_start
-        shift.end = timeslot_end
-        shift.required_skill = required_skill
-        shift.location = location
-        shift.employee = None
+        shift = Shift(id_generator, timeslot_start, timeslot_end, location, required_skill)
         id_generator += 1
         return shift
 
 
-def generate_draft_shifts():
-    global schedule
+def generate_draft_shifts(first_draft_date: datetime.date, publish_length: int, employee_list: list[Employee]):
+    """The availabilities and shifts of the publish_length days from publish_length days after first_draft_date."""
     random = Random(0)
-    for i in range(schedule.schedule_state.publish_length):
-        employees_with_availabilities_on_day = pick_subset(schedule.employee_list, random, 4, 3, 2, 1)
-        date = schedule.schedule_state.first_draft_date + datetime.timedelta(days=(schedule.schedule_state.publish_length + i))
+    availability_list = []
+    shift_list = []
+    for i in range(publish_length):
+        employees_with_availabilities_on_day = pick_subset(employee_list, random, 4, 3, 2, 1)
+        date = first_draft_date + datetime.timedelta(days=(publish_length + i))
         for employee in employees_with_availabilities_on_day:
             availability_type = pick_random(AvailabilityType.list(), random)
-            availability = Availability()
-            availability.date = date
-            availability.employee = employee
-            availability.availability_type = availability_type
-            schedule.availability_list.append(availability)
-        schedule.shift_list.extend(generate_shifts_for_day(date, random))
+            availability_list.append(Availability(employee, date, availability_type))
+        shift_list.extend(generate_shifts_for_day(date, random))
+    return availability_list, shift_list
 
 
 def pick_random(source: list, random: Random):
@@ -180,43 +224,151 @@ last_score = HardSoftScore.ZERO
 
 @app.route('/schedule')
 def get_schedule():
-    global schedule
-    solver_status = get_solver_status()
-    solution = schedule
-    score = score_manager.updateScore(solution)
-    solution.solver_status = solver_status
-    solution.score = score
-    return jsonify(solution.to_dict())
+    payload = get_schedule_payload()[1]
+    return Response(payload, mimetype='application/json')
+
+
+@app.route('/schedule/events')
+def stream_schedule():
+    def generate_events():
+        last_schedule_key = None
+        while True:
+            with schedule_changed:
+                schedule_changed.wait_for(lambda: get_schedule_key() != last_schedule_key,
+                                          SCHEDULE_KEEP_ALIVE_SECONDS)
+            schedule_key, payload = get_schedule_payload()
+            if schedule_key == last_schedule_key:
+                yield ': keep-alive\n\n'
+            else:
+                last_schedule_key = schedule_key
+                yield f'data: {payload}\n\n'
 
+    return Response(generate_events(), mimetype='text/event-stream')
 
-def get_solver_status():
-    return solver_manager.getSolverStatus(SINGLETON_ID)
+
+def get_schedule_key():
+    return schedule_version, is_solving
+
+
+def get_schedule_payload():
+    with schedule_changed:
+        if schedule_snapshot[0] != get_schedule_key():
+            # Only before the first change, for the schedule the service started with
+            update_schedule_snapshot()
+        return schedule_snapshot
+
+
+def update_schedule_snapshot():
+    # Called with the schedule_changed lock held, once per change, however many viewers poll or stream the schedule
+    global schedule_snapshot, schedule_score_version
+    if schedule_score_version != schedule_version:
+        schedule.score = score_manager.updateScore(schedule)
+        schedule_score_version = schedule_version
+    # The status is the service's, so it goes into the payload rather than onto the solution
+    schedule_dict = schedule.to_dict()
+    solver_status = SolverStatus.SOLVING_ACTIVE if is_solving else SolverStatus.NOT_SOLVING
+    schedule_dict['solver_status'] = solver_status.toString()
+    schedule_snapshot = (get_schedule_key(), json.dumps(schedule_dict))
 
 
 def error_handler(problem_id, exception):
     print(f'an exception occurred solving {problem_id}: {exception.getMessage()}')
     exception.printStackTrace()
+    set_solving(None)
+
+
+def set_solving(job):
+    global solver_job, is_solving
+    with schedule_changed:
+        solver_job = job
+        is_solving = job is not None
+        checkpoint_writer.mark_changed()
+        update_schedule_snapshot()
+        schedule_changed.notify_all()
 
 
 @app.route('/solve', methods=['POST'])
 def solve():
-    solver_manager.solveAndListen(SINGLETON_ID, find_by_id, save, error_handler)
+    with schedule_changed:
+        if solver_job is not None:
+            return dict()
+        schedule.update_employee_ranges()
+        # Under the lock, so every change is either made before the solver reads the schedule or given to its job
+        set_solving(solver_manager.solveAndListen(SINGLETON_ID, find_by_id, save,
+                                                  final_best_solution_consumer=save_final,
+                                                  exception_handler=error_handler))
     return dict()
 
 
 @app.route('/publish', methods=['POST'])
 def publish():
-    global schedule
-    if get_solver_status() != SolverStatus.NOT_SOLVING:
-        raise RuntimeError('Cannot publish a schedule while solving in progress.')
-    schedule_state = schedule.schedule_state
-    new_historic_date = schedule_state.first_draft_date
-    new_draft_date = schedule_state.first_draft_date + datetime.timedelta(days=schedule_state.publish_length)
+    # While solving, the solver pins the published days and assigns the new ones, carrying on from its assignments
+    with schedule_changed:
+        schedule_state = schedule.schedule_state
+        new_draft_date = schedule_state.first_draft_date + datetime.timedelta(days=schedule_state.publish_length)
+        availability_list, shift_list = generate_draft_shifts(new_draft_date, schedule_state.publish_length,
+                                                              schedule.employee_list)
+        first_draft_date = schedule_state.first_draft_date
+    submit_problem_change(PublishProblemChange(first_draft_date, availability_list, shift_list))
+    return dict()
+
+
+def bad_request(message):
+    return {'message': message}, 400
 
-    schedule_state.last_historic_date = new_historic_date
-    schedule_state.first_draft_date = new_draft_date
 
-    generate_draft_shifts()
+def get_request_date(request_json):
+    # None unless the request has a date in ISO format
+    try:
+        return datetime.date.fromisoformat(request_json['date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@app.route('/schedule/employees', methods=['POST'])
+def add_employee():
+    employee_json = request.get_json()
+    if not isinstance(employee_json, dict) or not isinstance(employee_json.get('name'), str) \
+            or not employee_json['name'] or not isinstance(employee_json.get('skill_set'), list) \
+            or not all(isinstance(skill, str) for skill in employee_json['skill_set']):
+        return bad_request('An employee needs a name and a skill_set list of skill names.')
+    with schedule_changed:
+        if find_employee(schedule, employee_json['name']) is not None:
+            return {'message': f'There is already an employee named {employee_json["name"]}.'}, 409
+    submit_problem_change(AddEmployeeProblemChange(Employee(employee_json['name'], employee_json['skill_set'])))
+    return dict()
+
+
+@app.route('/schedule/availabilities', methods=['POST'])
+def set_availability():
+    # A null availability_type removes the availability of the employee on that date
+    availability_json = request.get_json()
+    if not isinstance(availability_json, dict) or not isinstance(availability_json.get('employee'), str):
+        return bad_request('An availability needs the name of its employee.')
+    date = get_request_date(availability_json)
+    if date is None:
+        return bad_request('An availability needs a date in ISO format.')
+    availability_type = availability_json.get('availability_type')
+    if availability_type is not None and availability_type not in AvailabilityType.__members__:
+        return bad_request(f'The availability_type must be one of {", ".join(AvailabilityType.__members__)} or null.')
+    with schedule_changed:
+        if find_employee(schedule, availability_json['employee']) is None:
+            return {'message': f'No employee named {availability_json["employee"]}.'}, 404
+    submit_problem_change(SetAvailabilityProblemChange(
+        availability_json['employee'], date,
+        AvailabilityType(availability_type) if availability_type is not None else None))
+    return dict()
+
+
+@app.route('/schedule/employees/<employee_name>/sick', methods=['POST'])
+def call_in_sick(employee_name):
+    date = get_request_date(request.get_json())
+    if date is None:
+        return bad_request('A sick call needs a date in ISO format.')
+    with schedule_changed:
+        if find_employee(schedule, employee_name) is None:
+            return {'message': f'No employee named {employee_name}.'}, 404
+    submit_problem_change(CallInSickProblemChange(employee_name, date))
     return dict()
 
 
@@ -226,8 +378,29 @@ def stop_solving():
     return dict()
 
 
+def submit_problem_change(change):
+    """
+    Edits the schedule: through the solver job while one runs, so the solve carries on with the edit in place, or
+    directly when nothing is solving. Blocks until the saved schedule has the edit.
+    """
+    with schedule_changed:
+        job = solver_job
+        if job is None:
+            change.apply(schedule, ImmediateProblemChangeDirector())
+            mark_schedule_changed()
+            return
+    try:
+        # Waited for outside schedule_changed: the solver thread takes it to save the best schedule with the edit
+        job.addProblemChange(change).get()
+    except IllegalStateException:
+        # A finished job refuses the edit. Once set_solving has replaced that job, the edit is submitted again, to the
+        # new job or straight onto the final schedule
+        with schedule_changed:
+            schedule_changed.wait_for(lambda: solver_job is not job)
+        submit_problem_change(change)
+
+
 def find_by_id(schedule_id):
-    global schedule
     if schedule_id != SINGLETON_ID:
         raise ValueError(f'There is no schedule with id ({schedule_id})')
     return schedule
@@ -235,4 +408,23 @@ def find_by_id(schedule_id):
 
 def save(solution):
     global schedule
-    schedule = solution
+    with schedule_changed:
+        schedule = solution
+        mark_schedule_changed(is_scored=True)
+
+
+def save_final(solution):
+    with schedule_changed:
+        save(solution)
+        set_solving(None)
+
+
+def mark_schedule_changed(is_scored=False):
+    global schedule_version, schedule_score_version
+    with schedule_changed:
+        schedule_version += 1
+        if is_scored:
+            schedule_score_version = schedule_version
+        checkpoint_writer.mark_changed()
+        update_schedule_snapshot()
+        schedule_changed.notify_all()
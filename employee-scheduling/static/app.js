@@ -1,4 +1,4 @@
-let autoRefreshIntervalId = null;
+let scheduleEventSource = null;
 const zoomMin = 2 * 1000 * 60 * 60 * 24 // 2 day in milliseconds
 const zoomMax = 4 * 7 * 1000 * 60 * 60 * 24 // 4 weeks in milliseconds
 
@@ -92,7 +92,7 @@ $(document).ready(function () {
         byLocationTimeline.redraw();
     })
 
-    refreshSchedule();
+    listenToSchedule();
 });
 
 
@@ -125,124 +125,135 @@ function getShiftColor(shift, availabilityMap) {
 }
 
 function refreshSchedule() {
-    $.getJSON("/schedule", function (schedule) {
-        refreshSolvingButtons(schedule.solver_status != null && schedule.solver_status !== "NOT_SOLVING");
-        $("#score").text("Score: " + (schedule.score == null ? "?" : schedule.score));
-
-        const unassignedShifts = $("#unassignedShifts");
-        const groups = [];
-        const availabilityMap = new Map();
-
-        // Show only first 7 days of draft
-        const scheduleStart = schedule.schedule_state.first_draft_date;
-        const scheduleEnd = JSJoda.LocalDate.parse(scheduleStart).plusDays(7).toString();
-
-        windowStart = scheduleStart;
-        windowEnd = scheduleEnd;
-
-        unassignedShifts.children().remove();
-        let unassignedShiftsCount = 0;
-        byEmployeeGroupDataSet.clear();
-        byLocationGroupDataSet.clear();
-
-        byEmployeeItemDataSet.clear();
-        byLocationItemDataSet.clear();
-
-        byEmployeeTimeline.setCustomTime(schedule.schedule_state.last_historic_date, 'published');
-        byEmployeeTimeline.setCustomTime(schedule.schedule_state.first_draft_date, 'draft');
-
-        byLocationTimeline.setCustomTime(schedule.schedule_state.last_historic_date, 'published');
-        byLocationTimeline.setCustomTime(schedule.schedule_state.first_draft_date, 'draft');
-
-        schedule.availability_list.forEach((availability, index) => {
-            const availabilityDate = JSJoda.LocalDate.parse(availability.date);
-            const start = availabilityDate.atStartOfDay().toString();
-            const end = availabilityDate.plusDays(1).atStartOfDay().toString();
-            const byEmployeeShiftElement = $(`<div/>`)
-                    .append($(`<h5 class="card-title mb-1"/>`).text(availability.availability_type));
-            const mapKey = availability.employee.name + '-' + availabilityDate.toString();
-            availabilityMap.set(mapKey, availability.availability_type);
-            byEmployeeItemDataSet.add({
-                id : 'availability-' + index, group: availability.employee.name,
-                content: byEmployeeShiftElement.html(),
-                start: start, end: end,
-                type: "background",
-                style: "opacity: 0.5; background-color: " + getAvailabilityColor(availability.availability_type),
-            });
-        });
+    $.getJSON("/schedule", showSchedule);
+}
 
+// The server pushes the schedule whenever a new best solution arrives or solving starts or stops
+function listenToSchedule() {
+    if (scheduleEventSource != null) {
+        return;
+    }
+    scheduleEventSource = new EventSource("/schedule/events");
+    scheduleEventSource.onmessage = (event) => showSchedule(JSON.parse(event.data));
+}
 
-        schedule.employee_list.forEach((employee, index) => {
-            const employeeGroupElement = $('<div class="card-body p-2"/>')
-                    .append($(`<h5 class="card-title mb-2"/>)`)
-                            .append(employee.name))
-                    .append($('<div/>')
-                            .append($(employee.skill_set.map(skill => `<span class="badge mr-1 mt-1" style="background-color:#d3d7cf">${skill}</span>`).join(''))));
-            byEmployeeGroupDataSet.add({id : employee.name, content: employeeGroupElement.html()});
+function showSchedule(schedule) {
+    refreshSolvingButtons(schedule.solver_status != null && schedule.solver_status !== "NOT_SOLVING");
+    $("#score").text("Score: " + (schedule.score == null ? "?" : schedule.score));
+
+    const unassignedShifts = $("#unassignedShifts");
+    const groups = [];
+    const availabilityMap = new Map();
+
+    // Show only first 7 days of draft
+    const scheduleStart = schedule.schedule_state.first_draft_date;
+    const scheduleEnd = JSJoda.LocalDate.parse(scheduleStart).plusDays(7).toString();
+
+    windowStart = scheduleStart;
+    windowEnd = scheduleEnd;
+
+    unassignedShifts.children().remove();
+    let unassignedShiftsCount = 0;
+    byEmployeeGroupDataSet.clear();
+    byLocationGroupDataSet.clear();
+
+    byEmployeeItemDataSet.clear();
+    byLocationItemDataSet.clear();
+
+    byEmployeeTimeline.setCustomTime(schedule.schedule_state.last_historic_date, 'published');
+    byEmployeeTimeline.setCustomTime(schedule.schedule_state.first_draft_date, 'draft');
+
+    byLocationTimeline.setCustomTime(schedule.schedule_state.last_historic_date, 'published');
+    byLocationTimeline.setCustomTime(schedule.schedule_state.first_draft_date, 'draft');
+
+    schedule.availability_list.forEach((availability, index) => {
+        const availabilityDate = JSJoda.LocalDate.parse(availability.date);
+        const start = availabilityDate.atStartOfDay().toString();
+        const end = availabilityDate.plusDays(1).atStartOfDay().toString();
+        const byEmployeeShiftElement = $(`<div/>`)
+                .append($(`<h5 class="card-title mb-1"/>`).text(availability.availability_type));
+        const mapKey = availability.employee.name + '-' + availabilityDate.toString();
+        availabilityMap.set(mapKey, availability.availability_type);
+        byEmployeeItemDataSet.add({
+            id : 'availability-' + index, group: availability.employee.name,
+            content: byEmployeeShiftElement.html(),
+            start: start, end: end,
+            type: "background",
+            style: "opacity: 0.5; background-color: " + getAvailabilityColor(availability.availability_type),
         });
+    });
 
-        schedule.shift_list.forEach((shift, index) => {
-            if (groups.indexOf(shift.location) === -1) {
-                groups.push(shift.location);
-                byLocationGroupDataSet.add({
-                    id : shift.location,
-                    content: shift.location,
-                });
-            }
 
-            if (shift.employee == null) {
-                unassignedShiftsCount++;
-
-                const byLocationShiftElement = $('<div class="card-body p-2"/>')
-                        .append($(`<h5 class="card-title mb-2"/>)`)
-                                .append("Unassigned"))
-                        .append($('<div/>')
-                                .append($(`<span class="badge mr-1 mt-1" style="background-color:#d3d7cf">${shift.required_skill}</span>`)));
-
-                byLocationItemDataSet.add({
-                    id : 'shift-' + index, group: shift.location,
-                    content: byLocationShiftElement.html(),
-                    start: shift.start, end: shift.end,
-                    style: "background-color: #EF292999"
-                });
-            } else {
-                const skillColor = (shift.employee.skill_set.indexOf(shift.required_skill) === -1? '#ef2929' : '#8ae234');
-                const byEmployeeShiftElement = $('<div class="card-body p-2"/>')
-                        .append($(`<h5 class="card-title mb-2"/>)`)
-                                .append(shift.location))
-                        .append($('<div/>')
-                                .append($(`<span class="badge mr-1 mt-1" style="background-color:${skillColor}">${shift.required_skill}</span>`)));
-                const byLocationShiftElement = $('<div class="card-body p-2"/>')
-                        .append($(`<h5 class="card-title mb-2"/>)`)
-                                .append(shift.employee.name))
-                        .append($('<div/>')
-                                .append($(`<span class="badge mr-1 mt-1" style="background-color:${skillColor}">${shift.required_skill}</span>`)));
-
-                const shiftColor =  getShiftColor(shift, availabilityMap);
-                byEmployeeItemDataSet.add({
-                    id : 'shift-' + index, group: shift.employee.name,
-                    content: byEmployeeShiftElement.html(),
-                    start: shift.start, end: shift.end,
-                    style: "background-color: " + shiftColor
-                });
-                byLocationItemDataSet.add({
-                    id : 'shift-' + index, group: shift.location,
-                    content: byLocationShiftElement.html(),
-                    start: shift.start, end: shift.end,
-                    style: "background-color: " + shiftColor
-                });
-            }
-        });
+    schedule.employee_list.forEach((employee, index) => {
+        const employeeGroupElement = $('<div class="card-body p-2"/>')
+                .append($(`<h5 class="card-title mb-2"/>)`)
+                        .append(employee.name))
+                .append($('<div/>')
+                        .append($(employee.skill_set.map(skill => `<span class="badge mr-1 mt-1" style="background-color:#d3d7cf">${skill}</span>`).join(''))));
+        byEmployeeGroupDataSet.add({id : employee.name, content: employeeGroupElement.html()});
+    });
 
+    schedule.shift_list.forEach((shift, index) => {
+        if (groups.indexOf(shift.location) === -1) {
+            groups.push(shift.location);
+            byLocationGroupDataSet.add({
+                id : shift.location,
+                content: shift.location,
+            });
+        }
+
+        if (shift.employee == null) {
+            unassignedShiftsCount++;
 
-        if (unassignedShiftsCount === 0) {
-            unassignedShifts.append($(`<p/>`).text(`There are no unassigned shifts.`));
+            const byLocationShiftElement = $('<div class="card-body p-2"/>')
+                    .append($(`<h5 class="card-title mb-2"/>)`)
+                            .append("Unassigned"))
+                    .append($('<div/>')
+                            .append($(`<span class="badge mr-1 mt-1" style="background-color:#d3d7cf">${shift.required_skill}</span>`)));
+
+            byLocationItemDataSet.add({
+                id : 'shift-' + index, group: shift.location,
+                content: byLocationShiftElement.html(),
+                start: shift.start, end: shift.end,
+                style: "background-color: #EF292999"
+            });
         } else {
-            unassignedShifts.append($(`<p/>`).text(`There are ${unassignedShiftsCount} unassigned shifts.`));
+            const skillColor = (shift.employee.skill_set.indexOf(shift.required_skill) === -1? '#ef2929' : '#8ae234');
+            const byEmployeeShiftElement = $('<div class="card-body p-2"/>')
+                    .append($(`<h5 class="card-title mb-2"/>)`)
+                            .append(shift.location))
+                    .append($('<div/>')
+                            .append($(`<span class="badge mr-1 mt-1" style="background-color:${skillColor}">${shift.required_skill}</span>`)));
+            const byLocationShiftElement = $('<div class="card-body p-2"/>')
+                    .append($(`<h5 class="card-title mb-2"/>)`)
+                            .append(shift.employee.name))
+                    .append($('<div/>')
+                            .append($(`<span class="badge mr-1 mt-1" style="background-color:${skillColor}">${shift.required_skill}</span>`)));
+
+            const shiftColor =  getShiftColor(shift, availabilityMap);
+            byEmployeeItemDataSet.add({
+                id : 'shift-' + index, group: shift.employee.name,
+                content: byEmployeeShiftElement.html(),
+                start: shift.start, end: shift.end,
+                style: "background-color: " + shiftColor
+            });
+            byLocationItemDataSet.add({
+                id : 'shift-' + index, group: shift.location,
+                content: byLocationShiftElement.html(),
+                start: shift.start, end: shift.end,
+                style: "background-color: " + shiftColor
+            });
         }
-        byEmployeeTimeline.setWindow(scheduleStart, scheduleEnd);
-        byLocationTimeline.setWindow(scheduleStart, scheduleEnd);
     });
+
+
+    if (unassignedShiftsCount === 0) {
+        unassignedShifts.append($(`<p/>`).text(`There are no unassigned shifts.`));
+    } else {
+        unassignedShifts.append($(`<p/>`).text(`There are ${unassignedShiftsCount} unassigned shifts.`));
+    }
+    byEmployeeTimeline.setWindow(scheduleStart, scheduleEnd);
+    byLocationTimeline.setWindow(scheduleStart, scheduleEnd);
 }
 
 function solve() {
@@ -265,23 +276,15 @@ function refreshSolvingButtons(solving) {
     if (solving) {
         $("#solveButton").hide();
         $("#stopSolvingButton").show();
-        if (autoRefreshIntervalId == null) {
-            autoRefreshIntervalId = setInterval(refreshSchedule, 2000);
-        }
     } else {
         $("#solveButton").show();
         $("#stopSolvingButton").hide();
-        if (autoRefreshIntervalId != null) {
-            clearInterval(autoRefreshIntervalId);
-            autoRefreshIntervalId = null;
-        }
     }
 }
 
 function stopSolving() {
     $.post("/stopSolving", function () {
         refreshSolvingButtons(false);
-        refreshSchedule();
     }).fail(function (xhr, ajaxOptions, thrownError) {
         showError("Stop solving failed.", xhr);
     });
@@ -1,7 +1,14 @@
-from domain import AvailabilityType, Availability, Employee, Shift, EmployeeSchedule
+from domain import AvailabilityType, Availability, Employee, Shift, EmployeeSchedule, ScheduleState
 from constraints import employee_scheduling_constraints, required_skill, no_overlapping_shifts, \
     at_least_10_hours_between_two_shifts, desired_day_for_employee, undesired_day_for_employee, unavailable_employee
-
+from checkpoint import CheckpointWriter, schedule_to_checkpoint, schedule_from_checkpoint
+from problem_changes import ImmediateProblemChangeDirector, PublishProblemChange, AddEmployeeProblemChange, \
+    SetAvailabilityProblemChange, CallInSickProblemChange
+
+import threading
+import optapy.config
+from optapy import solver_manager_create, score_manager_create
+from optapy.types import Duration
 from optapy.test import ConstraintVerifier, constraint_verifier_build
 from datetime import date, time, datetime, timedelta
 
@@ -18,6 +25,38 @@ constraint_verifier: ConstraintVerifier = constraint_verifier_build(employee_sch
                                                                     Shift)
 
 
+def solve_with_problem_changes(schedule, problem_change_list):
+    """
+    Solves the schedule for a few seconds, giving the solver the problem changes one after the other. Returns the final
+    best solution, and the solver's score of every best solution with the score calculated from scratch.
+    """
+    solver_config = optapy.config.solver.SolverConfig() \
+        .withSolutionClass(EmployeeSchedule) \
+        .withEntityClasses(Shift) \
+        .withConstraintProviderClass(employee_scheduling_constraints) \
+        .withTerminationSpentLimit(Duration.ofSeconds(5))
+    schedule.update_employee_ranges()
+    # Closed at the end, so its threads do not keep the test process alive
+    with solver_manager_create(solver_config) as solver_manager:
+        score_manager = score_manager_create(solver_manager)
+        score_pair_list = []
+        final_best_solution_list = []
+        solving_ended = threading.Event()
+
+        def final_best_solution_consumer(best_solution):
+            final_best_solution_list.append(best_solution)
+            solving_ended.set()
+        solver_job = solver_manager.solveAndListen(
+            1, lambda _: schedule,
+            lambda best_solution: score_pair_list.append((best_solution.get_score().toString(),
+                                                          score_manager.updateScore(best_solution).toString())),
+            final_best_solution_consumer=final_best_solution_consumer)
+        for problem_change in problem_change_list:
+            solver_job.addProblemChange(problem_change).get()
+        assert solving_ended.wait(60)
+    return final_best_solution_list[0], score_pair_list
+
+
 def test_required_skill():
     employee = Employee("Amy", [])
     constraint_verifier.verify_that(required_skill) \
@@ -31,6 +70,13 @@ def test_required_skill():
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee)) \
         .penalizes(0)
 
+    employee = Employee("Chad", ["Other skill", "Skill", "Third skill"])
+    constraint_verifier.verify_that(required_skill) \
+        .given(employee,
+               Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee),
+               Shift(2, AFTERNOON_END_TIME, DAY_START_TIME + timedelta(days=1), "Location", "Fourth skill", employee)) \
+        .penalizes(1)
+
 
 def test_overlapping_shifts():
     employee1 = Employee("Amy", ["Skill"])
@@ -211,3 +257,191 @@ def test_undesired_day_for_employee():
                unavailability,
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .penalizes(0)
+
+
+def test_overnight_shift():
+    employee1 = Employee("Amy", ["Skill"])
+    night_shift = Shift(1, datetime.combine(DAY_1, time(22, 0)), datetime.combine(DAY_2, time(6, 0)),
+                        "Location", "Skill", employee1)
+    assert night_shift.duration_minutes == 8 * 60
+    assert ScheduleState(7, 14, DAY_1, DAY_1).is_draft(night_shift)
+    assert not ScheduleState(7, 14, DAY_2, DAY_1).is_draft(night_shift)
+
+    # The shift belongs to the day it starts
+    constraint_verifier.verify_that(unavailable_employee) \
+        .given(employee1,
+               Availability(employee1, DAY_1, AvailabilityType.UNAVAILABLE),
+               night_shift) \
+        .penalizes_by(8 * 60)
+    constraint_verifier.verify_that(unavailable_employee) \
+        .given(employee1,
+               Availability(employee1, DAY_2, AvailabilityType.UNAVAILABLE),
+               night_shift) \
+        .penalizes(0)
+
+    constraint_verifier.verify_that(at_least_10_hours_between_two_shifts) \
+        .given(employee1,
+               night_shift,
+               Shift(2, datetime.combine(DAY_2, time(9, 0)), datetime.combine(DAY_2, time(17, 0)), "Location 2",
+                     "Skill", employee1)) \
+        .penalizes_by(7 * 60)
+
+
+def test_update_employee_ranges():
+    doctor = Employee("Amy", ["Doctor"])
+    nurse = Employee("Beth", ["Nurse"])
+    unavailable_nurse = Employee("Chad", ["Nurse", "Anaesthetics"])
+    doctor_shift = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Doctor")
+    nurse_shift = Shift(2, DAY_START_TIME, DAY_END_TIME, "Location", "Nurse", doctor)
+    next_day_nurse_shift = Shift(3, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location",
+                                 "Nurse")
+    surgeon_shift = Shift(4, DAY_START_TIME, DAY_END_TIME, "Location", "Surgeon")
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_1, DAY_1),
+                                [Availability(unavailable_nurse, DAY_1, AvailabilityType.UNAVAILABLE)],
+                                [doctor, nurse, unavailable_nurse],
+                                [doctor_shift, nurse_shift, next_day_nurse_shift, surgeon_shift],
+                                None)
+    schedule.update_employee_ranges()
+    assert doctor_shift.employee_range == [doctor]
+    # Keeps the employee it has
+    assert nurse_shift.employee_range == [nurse, doctor]
+    assert next_day_nurse_shift.employee_range == [nurse, unavailable_nurse]
+    # Nobody has the skill, so the hard constraint is left to tell
+    assert surgeon_shift.employee_range == [doctor, nurse, unavailable_nurse]
+
+
+def test_publish():
+    employee1 = Employee("Amy", ["Skill"])
+    published_shift = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)
+    draft_shift = Shift(2, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location", "Skill")
+    schedule = EmployeeSchedule(ScheduleState(1, 2, DAY_1, DAY_1), [], [employee1], [published_shift, draft_shift],
+                                None)
+    # The availabilities may refer to copies of the employees
+    new_availability = Availability(Employee("Amy", ["Skill"]), DAY_3, AvailabilityType.DESIRED)
+    new_shift = Shift(3, DAY_START_TIME + timedelta(days=2), DAY_END_TIME + timedelta(days=2), "Location", "Skill")
+    PublishProblemChange(DAY_1, [new_availability], [new_shift]).apply(schedule, ImmediateProblemChangeDirector())
+    assert schedule.schedule_state.last_historic_date == DAY_1
+    assert schedule.schedule_state.first_draft_date == DAY_2
+    assert not schedule.schedule_state.is_draft(published_shift)
+    assert schedule.schedule_state.is_draft(draft_shift)
+    assert schedule.availability_list == [new_availability]
+    assert new_availability.employee is employee1
+    assert schedule.shift_list == [published_shift, draft_shift, new_shift]
+    assert new_shift.employee_range == [employee1]
+
+    # Published already: the same change again does nothing
+    PublishProblemChange(DAY_1, [], [Shift(4, DAY_START_TIME, DAY_END_TIME, "Location", "Skill")]) \
+        .apply(schedule, ImmediateProblemChangeDirector())
+    assert schedule.schedule_state.first_draft_date == DAY_2
+    assert len(schedule.shift_list) == 3
+
+
+def test_publish_to_a_running_solver():
+    employee1 = Employee("Amy", ["Skill", "Night skill"])
+    employee2 = Employee("Beth", ["Skill"])
+    published_shift = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)
+    schedule = EmployeeSchedule(ScheduleState(1, 2, DAY_1, DAY_1),
+                                [Availability(employee2, DAY_1, AvailabilityType.UNDESIRED)],
+                                [employee1, employee2], [published_shift], None)
+    # Only Amy can take it, less than 10 hours after the published shift: the solver would give that one to Beth if
+    # it were not pinned
+    night_shift = Shift(2, DAY_END_TIME + timedelta(hours=8), DAY_END_TIME + timedelta(hours=12), "Location",
+                        "Night skill")
+    final_schedule, score_pair_list = solve_with_problem_changes(schedule,
+                                                                 [PublishProblemChange(DAY_1, [], [night_shift])])
+
+    assert all(score == calculated_score for score, calculated_score in score_pair_list)
+    assert final_schedule.schedule_state.first_draft_date == DAY_2
+    assert [(shift.id, shift.employee.name) for shift in final_schedule.shift_list] == [(1, "Amy"), (2, "Amy")]
+    assert final_schedule.get_score().hardScore() < 0
+
+
+def test_live_problem_changes():
+    employee1 = Employee("Amy", ["Skill"])
+    published_shift = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)
+    draft_shift = Shift(2, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location", "Skill",
+                        employee1)
+    schedule = EmployeeSchedule(ScheduleState(1, 2, DAY_2, DAY_1), [], [employee1], [published_shift, draft_shift],
+                                None)
+    schedule.update_employee_ranges()
+    draft_employee_range = draft_shift.employee_range
+    director = ImmediateProblemChangeDirector()
+
+    employee2 = Employee("Beth", ["Skill"])
+    AddEmployeeProblemChange(employee2).apply(schedule, director)
+    assert schedule.employee_list == [employee1, employee2]
+    # Updated in place, since the solver's copy of the shift keeps the list
+    assert draft_shift.employee_range is draft_employee_range
+    assert draft_shift.employee_range == [employee1, employee2]
+
+    CallInSickProblemChange("Amy", DAY_2).apply(schedule, director)
+    assert draft_shift.employee is None
+    assert draft_shift.employee_range == [employee2]
+    assert [(availability.employee, availability.date, availability.availability_type)
+            for availability in schedule.availability_list] == [(employee1, DAY_2, AvailabilityType.UNAVAILABLE)]
+
+    # Published shifts keep the employee
+    CallInSickProblemChange("Amy", DAY_1).apply(schedule, director)
+    assert published_shift.employee is employee1
+    assert len(schedule.availability_list) == 2
+
+    SetAvailabilityProblemChange("Amy", DAY_2, AvailabilityType.DESIRED).apply(schedule, director)
+    assert schedule.availability_list[0].availability_type == AvailabilityType.DESIRED
+    assert draft_shift.employee_range == [employee1, employee2]
+
+    SetAvailabilityProblemChange("Amy", DAY_2, None).apply(schedule, director)
+    assert [availability.date for availability in schedule.availability_list] == [DAY_1]
+
+
+def test_edits_reach_a_running_solver():
+    employee1 = Employee("Amy", ["Skill"])
+    employee2 = Employee("Beth", ["Skill"])
+    draft_shift = Shift(1, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location", "Skill",
+                        employee1)
+    schedule = EmployeeSchedule(ScheduleState(1, 2, DAY_2, DAY_1),
+                                [Availability(employee2, DAY_2, AvailabilityType.UNDESIRED)],
+                                [employee1, employee2], [draft_shift], None)
+    final_schedule, score_pair_list = solve_with_problem_changes(schedule, [
+        AddEmployeeProblemChange(Employee("Chad", ["Skill"])),
+        CallInSickProblemChange("Amy", DAY_2),
+    ])
+
+    assert all(score == calculated_score for score, calculated_score in score_pair_list)
+    assert [employee.name for employee in final_schedule.employee_list] == ["Amy", "Beth", "Chad"]
+    final_shift = final_schedule.shift_list[0]
+    assert [employee.name for employee in final_shift.employee_range] == ["Beth", "Chad"]
+    # Beth would rather not work that day
+    assert final_shift.employee.name == "Chad"
+    assert final_schedule.get_score().toString() == "0hard/0soft"
+
+
+def test_checkpoint_round_trip(tmp_path):
+    employee1 = Employee("Amy", ["Skill"])
+    employee2 = Employee("Beth", ["Skill", "Other skill"])
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_2, DAY_1),
+                                [Availability(employee2, DAY_1, AvailabilityType.UNDESIRED)],
+                                [employee1, employee2],
+                                [Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee2),
+                                 Shift(2, AFTERNOON_START_TIME, AFTERNOON_END_TIME, "Location 2", "Skill", None)],
+                                None)
+    checkpoint = {'solving': True, 'schedule': schedule_to_checkpoint(schedule)}
+    checkpoint_writer = CheckpointWriter(str(tmp_path / 'schedule.json.gz'), lambda: checkpoint, 60)
+    assert checkpoint_writer.load() is None
+    checkpoint_writer.mark_changed()
+    checkpoint_writer.flush()
+    restored_checkpoint = checkpoint_writer.load()
+    assert restored_checkpoint['solving']
+    (tmp_path / 'schedule.json.gz').write_bytes(b'not gzip')
+    assert checkpoint_writer.load() is None
+    # A failed write is logged, not raised
+    checkpoint_writer.snapshot = lambda: {'schedule': object()}
+    checkpoint_writer.mark_changed()
+    checkpoint_writer.flush()
+
+    restored = schedule_from_checkpoint(restored_checkpoint['schedule'])
+    assert schedule_to_checkpoint(restored) == checkpoint['schedule']
+    assert restored.schedule_state.first_draft_date == DAY_2
+    assert restored.shift_list[1].start == AFTERNOON_START_TIME
+    assert restored.shift_list[1].employee is None
+    assert restored.shift_list[0].employee is restored.employee_list[1]
+    assert restored.availability_list[0].employee is restored.employee_list[1]
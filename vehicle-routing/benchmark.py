@@ -0,0 +1,222 @@
+"""
+Scaling benchmark of the vehicle routing quickstart.
+
+Solves generated instances for every combination of customer count and vehicle count, and measures every phase
+separately: building the distance matrix (and the nearby maps), building the sweep routes, solving (time, score
+calculation speed and best score of each solver phase, and the best score over time) and the peak RSS of the process.
+
+Every instance runs in a fresh process, so the peak RSS and the JVM warm-up of one size do not leak into the next.
+The measurements of a run are written to a JSON file and summarized in a CSV file, both named after the start time:
+
+    python benchmark.py --customer-counts 1000 5000 20000 --seconds 60
+"""
+import argparse
+import csv
+import datetime
+import importlib.metadata
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from domain import DemoDataBuilder
+from construction import build_sweep_routes
+from instance_sampling import DISTRIBUTIONS, UNIFORM_DISTRIBUTION
+from solver_config import create_solver_config
+from optapy import solver_factory_create
+from optapy.types import Duration
+from jpype import JImplements, JOverride
+
+
+@JImplements('org.optaplanner.core.impl.phase.event.PhaseLifecycleListener')
+class PhaseStatisticListener:
+    """Records the time spent, the score calculation count and the best score of every solver phase."""
+    def __init__(self):
+        self.phase_list = []
+        self.phase_start = None
+
+    @JOverride
+    def solvingStarted(self, solver_scope):
+        pass
+
+    @JOverride
+    def phaseStarted(self, phase_scope):
+        self.phase_start = (time.perf_counter(), phase_scope.getScoreDirector().getCalculationCount())
+
+    @JOverride
+    def stepStarted(self, step_scope):
+        pass
+
+    @JOverride
+    def stepEnded(self, step_scope):
+        pass
+
+    @JOverride
+    def phaseEnded(self, phase_scope):
+        # The phase scope only sets its end time and count after the listeners ran, so the phase is measured here
+        start_time, start_score_calculation_count = self.phase_start
+        seconds = time.perf_counter() - start_time
+        score_calculation_count = phase_scope.getScoreDirector().getCalculationCount() - \
+            start_score_calculation_count
+        self.phase_list.append({
+            'phase': str(phase_scope.getClass().getSimpleName()).removesuffix('PhaseScope'),
+            'seconds': seconds,
+            'scoreCalculationCount': score_calculation_count,
+            'scoreCalculationSpeed': score_calculation_count / seconds if seconds > 0 else 0,
+            'bestScore': str(phase_scope.getBestScore()),
+        })
+
+    @JOverride
+    def solvingEnded(self, solver_scope):
+        pass
+
+    @JOverride
+    def solvingError(self, solver_scope, exception):
+        pass
+
+
+def get_peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def run_case(customer_count, vehicle_count, distribution, seed, seconds):
+    builder = DemoDataBuilder.scaled(customer_count, distribution, seed)
+    if vehicle_count is not None:
+        builder.set_vehicle_count(vehicle_count)
+
+    # The builder computes the distances itself, so its calculator is timed from the inside
+    timing_map = {'initDistanceMaps': 0, 'initNearbyMaps': 0}
+    distance_calculator = builder.distance_calculator
+
+    def timed(name, function):
+        def timed_function(*args):
+            start = time.perf_counter()
+            result = function(*args)
+            timing_map[name] += time.perf_counter() - start
+            return result
+        return timed_function
+
+    distance_calculator.init_distance_maps = timed('initDistanceMaps', distance_calculator.init_distance_maps)
+    distance_calculator.init_nearby_maps = timed('initNearbyMaps', distance_calculator.init_nearby_maps)
+    start = time.perf_counter()
+    solution = builder.build()
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assigned_count = build_sweep_routes(solution)
+    construction_seconds = time.perf_counter() - start
+
+    solver = solver_factory_create(create_solver_config(Duration.ofSeconds(seconds))).buildSolver()
+    best_score_list = []
+    solver.addEventListener(lambda event: best_score_list.append({
+        'millis': event.getTimeMillisSpent(),
+        'score': str(event.getNewBestScore()),
+    }))
+    phase_statistic_listener = PhaseStatisticListener()
+    solver.addPhaseLifecycleListener(phase_statistic_listener)
+    start = time.perf_counter()
+    best_solution = solver.solve(solution)
+    solve_seconds = time.perf_counter() - start
+
+    return {
+        'customerCount': customer_count,
+        'vehicleCount': len(solution.vehicle_list),
+        'depotCount': len(solution.depot_list),
+        'distribution': distribution,
+        'seed': seed,
+        'buildSeconds': build_seconds,
+        'distanceMatrixSeconds': timing_map['initDistanceMaps'],
+        'nearbyMapSeconds': timing_map['initNearbyMaps'],
+        'constructionSeconds': construction_seconds,
+        'constructionAssignedCount': assigned_count,
+        'solveSeconds': solve_seconds,
+        'phaseList': phase_statistic_listener.phase_list,
+        'bestScoreList': best_score_list,
+        'bestScore': str(best_solution.get_score()),
+        'distanceMeters': best_solution.get_distance_meters(),
+        'peakRssBytes': get_peak_rss_bytes(),
+    }
+
+
+def run_case_process(case, seconds):
+    with tempfile.TemporaryDirectory(prefix='optapy-vehicle-routing-benchmark-') as directory:
+        output_path = os.path.join(directory, 'result.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case),
+                        '--seconds', str(seconds), '--case-output', output_path], check=True)
+        with open(output_path) as output_file:
+            return json.load(output_file)
+
+
+def write_summary(path, result_list):
+    field_list = ['customerCount', 'vehicleCount', 'depotCount', 'distribution', 'seed', 'distanceMatrixSeconds',
+                  'nearbyMapSeconds', 'constructionSeconds', 'solveSeconds', 'scoreCalculationSpeed', 'bestScore',
+                  'distanceMeters', 'peakRssBytes']
+    with open(path, 'w', newline='') as summary_file:
+        writer = csv.DictWriter(summary_file, field_list, extrasaction='ignore')
+        writer.writeheader()
+        for result in result_list:
+            score_calculation_count = sum(phase['scoreCalculationCount'] for phase in result['phaseList'])
+            phase_seconds = sum(phase['seconds'] for phase in result['phaseList'])
+            writer.writerow({
+                **result,
+                'scoreCalculationSpeed': round(score_calculation_count / phase_seconds) if phase_seconds > 0 else 0,
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the vehicle routing quickstart.')
+    parser.add_argument('--customer-counts', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--vehicle-counts', type=int, nargs='+',
+                        help='vehicle counts to try for every customer count (default: scaled with the customers)')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=UNIFORM_DISTRIBUTION)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seconds', type=int, default=30, help='solving time of every instance')
+    parser.add_argument('--output-directory', default='benchmark-results')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--case-output', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.case is not None:
+        case = json.loads(arguments.case)
+        result = run_case(case['customerCount'], case['vehicleCount'], case['distribution'], case['seed'],
+                          arguments.seconds)
+        with open(arguments.case_output, 'w') as case_output_file:
+            json.dump(result, case_output_file)
+        return
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    result_list = []
+    for customer_count in arguments.customer_counts:
+        for vehicle_count in arguments.vehicle_counts or [None]:
+            result_list.append(run_case_process({
+                'customerCount': customer_count,
+                'vehicleCount': vehicle_count,
+                'distribution': arguments.distribution,
+                'seed': arguments.seed,
+            }, arguments.seconds))
+
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    name = 'benchmark-' + started.strftime('%Y%m%dT%H%M%SZ')
+    with open(os.path.join(arguments.output_directory, name + '.json'), 'w') as result_file:
+        json.dump({
+            'started': started.isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'optapy': importlib.metadata.version('optapy'),
+                'platform': platform.platform(),
+                'cpuCount': os.cpu_count(),
+            },
+            'seconds': arguments.seconds,
+            'resultList': result_list,
+        }, result_file, indent=2)
+    write_summary(os.path.join(arguments.output_directory, name + '.csv'), result_list)
+    print(f'Results written to {os.path.join(arguments.output_directory, name)}.json and .csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Checkpoints of the best solutions, so a restarted service resumes solving where it stopped instead of from scratch.
+
+A checkpoint is gzipped JSON. Customers and locations are stored column by column, like the wire format of
+VehicleRoutingSolution.to_dict, but at full precision. Distances are not stored: they are recalculated on restore,
+or loaded from the distance matrix cache.
+"""
+import atexit
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from domain import Location, Depot, Customer, Vehicle, VehicleRoutingSolution, EuclideanDistanceCalculator, \
+    DemoDataBuilder, NEARBY_COUNT
+from optapy.score import HardSoftScore
+
+CHECKPOINT_SUFFIX = '.json.gz'
+
+
+class CheckpointWriter:
+    """
+    Writes a checkpoint of every changed problem at most once every interval_seconds, on a background thread, so
+    neither the solver nor the requests wait for the disk. snapshot(problem_id) returns the checkpoint to write.
+    """
+    def __init__(self, directory, snapshot, interval_seconds):
+        self.directory = directory
+        self.snapshot = snapshot
+        self.interval_seconds = interval_seconds
+        self.changed_problem_id_set = set()
+        self.changed = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self.run, name='checkpoint-writer', daemon=True).start()
+        # The thread is a daemon, so the last changes are written on exit
+        atexit.register(self.flush)
+
+    def get_path(self, problem_id):
+        return os.path.join(self.directory, f'{problem_id}{CHECKPOINT_SUFFIX}')
+
+    def mark_changed(self, problem_id):
+        with self.changed:
+            self.changed_problem_id_set.add(problem_id)
+            self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.changed_problem_id_set)
+            # New best solutions found meanwhile only replace the one to write
+            time.sleep(self.interval_seconds)
+            self.flush()
+
+    def flush(self):
+        with self.changed:
+            problem_id_set = self.changed_problem_id_set
+            self.changed_problem_id_set = set()
+        for problem_id in problem_id_set:
+            try:
+                self.write(problem_id, self.snapshot(problem_id))
+            except Exception:
+                # Logged, so a failed write neither ends the writer thread nor skips the other problems; the problem
+                # is written again with its next change
+                print(f'writing the checkpoint of problem {problem_id} failed:')
+                traceback.print_exc()
+
+    def write(self, problem_id, checkpoint):
+        # Written next to the checkpoint and renamed over it, so a crash never leaves a truncated checkpoint behind
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as raw_file, gzip.open(raw_file, 'wt') as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file, separators=(',', ':'))
+            os.replace(temporary_path, self.get_path(problem_id))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def load(self, problem_id):
+        try:
+            with gzip.open(self.get_path(problem_id), 'rt') as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            # A corrupt checkpoint is skipped, so the problem is treated as never checkpointed
+            print(f'reading the checkpoint of problem {problem_id} failed:')
+            traceback.print_exc()
+            return None
+
+    def get_problem_id_list(self):
+        return [int(file_name.removesuffix(CHECKPOINT_SUFFIX)) for file_name in os.listdir(self.directory)
+                if file_name.endswith(CHECKPOINT_SUFFIX) and file_name.removesuffix(CHECKPOINT_SUFFIX).isdigit()]
+
+
+def solution_to_checkpoint(solution):
+    location_index_map = {location.id: index for index, location in enumerate(solution.location_list)}
+    depot_index_map = {depot.id: index for index, depot in enumerate(solution.depot_list)}
+    customer_index_map = {customer.id: index for index, customer in enumerate(solution.customer_list)}
+    return {
+        'name': solution.name,
+        'bounds': [[location.latitude, location.longitude] for location in solution.get_bounds()],
+        'locationList': {
+            'id': [location.id for location in solution.location_list],
+            'latitude': [location.latitude for location in solution.location_list],
+            'longitude': [location.longitude for location in solution.location_list],
+        },
+        'depotList': {
+            'id': [depot.id for depot in solution.depot_list],
+            'location': [location_index_map[depot.location.id] for depot in solution.depot_list],
+        },
+        'customerList': {
+            'id': [customer.id for customer in solution.customer_list],
+            'location': [location_index_map[customer.location.id] for customer in solution.customer_list],
+            'demand': [customer.demand for customer in solution.customer_list],
+            'readyTime': [customer.ready_time for customer in solution.customer_list],
+            'dueTime': [customer.due_time for customer in solution.customer_list],
+            'serviceDuration': [customer.service_duration for customer in solution.customer_list],
+        },
+        'vehicleList': [{
+            'id': vehicle.id,
+            'capacity': vehicle.capacity,
+            'depot': depot_index_map[vehicle.depot.id],
+            'customerList': [customer_index_map[customer.id] for customer in vehicle.customer_list],
+            'pinnedCount': vehicle.pinned_count,
+        } for vehicle in solution.vehicle_list],
+        'score': str(solution.score) if solution.score is not None else None,
+    }
+
+
+def solution_from_checkpoint(checkpoint, distance_matrix_cache=None):
+    location_columns = checkpoint['locationList']
+    location_list = [Location(_id, latitude, longitude) for _id, latitude, longitude
+                     in zip(location_columns['id'], location_columns['latitude'], location_columns['longitude'])]
+    depot_columns = checkpoint['depotList']
+    depot_list = [Depot(_id, location_list[location_index])
+                  for _id, location_index in zip(depot_columns['id'], depot_columns['location'])]
+    customer_columns = checkpoint['customerList']
+    customer_list = [Customer(_id, location_list[location_index], demand, ready_time, due_time, service_duration)
+                     for _id, location_index, demand, ready_time, due_time, service_duration
+                     in zip(customer_columns['id'], customer_columns['location'], customer_columns['demand'],
+                            customer_columns['readyTime'], customer_columns['dueTime'],
+                            customer_columns['serviceDuration'])]
+    vehicle_list = []
+    for vehicle_dict in checkpoint['vehicleList']:
+        vehicle = Vehicle(vehicle_dict['id'], vehicle_dict['capacity'], depot_list[vehicle_dict['depot']],
+                          [customer_list[customer_index] for customer_index in vehicle_dict['customerList']])
+        vehicle.set_pinned_count(vehicle_dict['pinnedCount'])
+        vehicle_list.append(vehicle)
+
+    # Sized like the demo data: only the nearest distances of large problems are kept
+    sparse_neighbour_count = 2 * NEARBY_COUNT \
+        if len(customer_list) > DemoDataBuilder.DENSE_MAX_CUSTOMER_COUNT else None
+    distance_calculator = EuclideanDistanceCalculator(distance_matrix_cache,
+                                                      sparse_neighbour_count=sparse_neighbour_count)
+    distance_calculator.init_distance_maps(location_list, [depot.location for depot in depot_list])
+    distance_calculator.init_nearby_maps(location_list, NEARBY_COUNT)
+
+    south_west_corner, north_east_corner = [Location(0, latitude, longitude)
+                                            for latitude, longitude in checkpoint['bounds']]
+    score = HardSoftScore.parseScore(checkpoint['score']) if checkpoint['score'] is not None else None
+    return VehicleRoutingSolution(checkpoint['name'], location_list, depot_list, vehicle_list, customer_list,
+                                  south_west_corner, north_east_corner, score)
@@ -8,15 +8,25 @@ from domain import Vehicle
 def vehicle_routing_constraints(constraint_factory: ConstraintFactory):
     return [
         vehicle_capacity(constraint_factory),
+        customer_lateness(constraint_factory),
         total_distance(constraint_factory)
     ]
 
 
+# The route totals walk the route (see Vehicle), so each one is mapped once per vehicle and then filtered and weighed
+
 def vehicle_capacity(constraint_factory: ConstraintFactory):
     return constraint_factory.for_each(Vehicle) \
-               .filter(lambda vehicle: vehicle.get_total_demand() > vehicle.capacity) \
-               .penalize("vehicle_capacity", HardSoftScore.ONE_HARD,
-                         lambda vehicle: vehicle.get_total_demand() - vehicle.capacity)
+               .map(lambda vehicle: vehicle.get_total_demand() - vehicle.capacity) \
+               .filter(lambda excess_demand: excess_demand > 0) \
+               .penalize("vehicle_capacity", HardSoftScore.ONE_HARD, lambda excess_demand: excess_demand)
+
+
+def customer_lateness(constraint_factory: ConstraintFactory):
+    return constraint_factory.for_each(Vehicle) \
+               .map(lambda vehicle: vehicle.get_total_lateness()) \
+               .filter(lambda total_lateness: total_lateness > 0) \
+               .penalize("customer_lateness", HardSoftScore.ONE_HARD, lambda total_lateness: total_lateness)
 
 
 def total_distance(constraint_factory: ConstraintFactory):
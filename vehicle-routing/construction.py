@@ -0,0 +1,78 @@
+def order_by_nearest_neighbour(depot, customer_list):
+    """Orders the customers of a route by repeatedly visiting the closest remaining one, starting at the depot."""
+    route = []
+    remaining_customer_list = list(customer_list)
+    location = depot.location
+    while remaining_customer_list:
+        nearest_index = min(range(len(remaining_customer_list)),
+                            key=lambda index: location.get_distance_to(remaining_customer_list[index].location))
+        customer = remaining_customer_list.pop(nearest_index)
+        route.append(customer)
+        location = customer.location
+    return route
+
+
+def group_vehicles_by_depot(solution):
+    vehicle_list_by_depot = dict()
+    for vehicle in solution.vehicle_list:
+        vehicle_list_by_depot.setdefault(vehicle.depot.id, []).append(vehicle)
+    return vehicle_list_by_depot
+
+
+def group_customers_by_nearest_depot(customer_list, depot_list):
+    customer_list_by_depot = {depot.id: [] for depot in depot_list}
+    for customer in customer_list:
+        nearest_depot = min(depot_list, key=lambda depot: depot.location.get_distance_to(customer.location))
+        customer_list_by_depot[nearest_depot.id].append(customer)
+    return customer_list_by_depot
+
+
+def build_sweep_routes(solution):
+    """
+    Sweep construction heuristic: every customer goes to its nearest depot, then the customers of each depot are
+    swept by angle around it and cut into consecutive sectors, one per vehicle of that depot, each filled up to the
+    vehicle capacity. Each sector is then visited in nearest neighbour order.
+    Customers that fit nowhere are left unassigned for the solver's construction heuristic.
+    Returns the number of customers assigned.
+    """
+    vehicle_list_by_depot = group_vehicles_by_depot(solution)
+    depot_list = [depot for depot in solution.depot_list if depot.id in vehicle_list_by_depot]
+    if not depot_list:
+        return 0
+    customer_list_by_depot = group_customers_by_nearest_depot(solution.customer_list, depot_list)
+
+    assigned_count = 0
+    overflow_customer_list = []
+    for depot in depot_list:
+        customer_list = sorted(customer_list_by_depot[depot.id],
+                               key=lambda customer: depot.location.get_angle(customer.location))
+        vehicle_iterator = iter(vehicle_list_by_depot[depot.id])
+        vehicle = next(vehicle_iterator)
+        demand = 0
+        for customer in customer_list:
+            while vehicle is not None and demand + customer.demand > vehicle.capacity:
+                vehicle = next(vehicle_iterator, None)
+                demand = 0
+            if vehicle is None:
+                overflow_customer_list.append(customer)
+                continue
+            vehicle.customer_list.append(customer)
+            demand += customer.demand
+            assigned_count += 1
+
+    for vehicle in solution.vehicle_list:
+        vehicle.customer_list[:] = order_by_nearest_neighbour(vehicle.depot, vehicle.customer_list)
+
+    # Customers swept past the last vehicle of their depot go to whichever vehicle still has room for them
+    remaining_capacity_by_vehicle = {
+        vehicle: vehicle.capacity - sum(customer.demand for customer in vehicle.customer_list)
+        for vehicle in solution.vehicle_list
+    }
+    for customer in overflow_customer_list:
+        vehicle = max(remaining_capacity_by_vehicle, key=remaining_capacity_by_vehicle.get)
+        if remaining_capacity_by_vehicle[vehicle] < customer.demand:
+            continue
+        vehicle.customer_list.append(customer)
+        remaining_capacity_by_vehicle[vehicle] -= customer.demand
+        assigned_count += 1
+    return assigned_count
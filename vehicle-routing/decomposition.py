@@ -0,0 +1,189 @@
+"""
+Decomposition of a large vehicle routing problem into independent sub-problems.
+
+The customers are split either by nearest depot or into angular sectors around each depot, every sub-problem gets its
+share of the vehicles and is solved in a separate worker process (this module, run as a script), so solving scales
+across cores instead of being bound to a single solver thread. The sub-routes are then merged back into the original
+solution, which is meant to be given a short global solve to polish the routes along the partition borders.
+"""
+import bisect
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from domain import Location, Depot, Vehicle, Customer, VehicleRoutingSolution, EuclideanDistanceCalculator, \
+    NEARBY_COUNT
+from construction import build_sweep_routes, group_vehicles_by_depot, group_customers_by_nearest_depot
+from solver_config import create_solver_config
+from optapy import solver_factory_create
+from optapy.types import Duration
+from optapy.score import HardSoftScore
+
+DEPOT_MODE = 'depot'
+SECTOR_MODE = 'sector'
+
+
+class Partition:
+    def __init__(self, depot, vehicle_list, customer_list):
+        self.depot = depot
+        self.vehicle_list = vehicle_list
+        self.customer_list = customer_list
+
+    def to_dict(self):
+        return {
+            'depot': [self.depot.id, self.depot.location.latitude, self.depot.location.longitude],
+            'vehicleList': [[vehicle.id, vehicle.capacity] for vehicle in self.vehicle_list],
+            'customerList': [[customer.id, customer.location.latitude, customer.location.longitude, customer.demand,
+                              customer.ready_time, customer.due_time, customer.service_duration]
+                             for customer in self.customer_list],
+        }
+
+    def __str__(self):
+        return f'Partition of {self.depot} ({len(self.vehicle_list)} vehicles, {len(self.customer_list)} customers)'
+
+
+def partition_by_depot(solution):
+    """One partition per depot: the customers closest to it, served by the vehicles based there."""
+    vehicle_list_by_depot = group_vehicles_by_depot(solution)
+    depot_list = [depot for depot in solution.depot_list if depot.id in vehicle_list_by_depot]
+    customer_list_by_depot = group_customers_by_nearest_depot(solution.customer_list, depot_list)
+    return [Partition(depot, vehicle_list_by_depot[depot.id], customer_list_by_depot[depot.id])
+            for depot in depot_list]
+
+
+def partition_by_sector(solution, sector_count):
+    """
+    Splits the customers of each depot into consecutive angular sectors around it, about sector_count sectors in
+    total, shared out between the depots by their number of vehicles. The vehicles of a depot are dealt out over its
+    sectors and each sector gets a share of the customer demand in proportion to the capacity of its vehicles.
+    """
+    partition_list = []
+    for depot_partition in partition_by_depot(solution):
+        depot = depot_partition.depot
+        vehicle_list = depot_partition.vehicle_list
+        depot_sector_count = min(len(vehicle_list),
+                                 max(1, round(sector_count * len(vehicle_list) / len(solution.vehicle_list))))
+        customer_list = sorted(depot_partition.customer_list,
+                               key=lambda customer: depot.location.get_angle(customer.location))
+        cumulative_demand_list = list(itertools.accumulate(customer.demand for customer in customer_list))
+        total_demand = cumulative_demand_list[-1] if cumulative_demand_list else 0
+        total_capacity = sum(vehicle.capacity for vehicle in vehicle_list)
+
+        start = 0
+        cumulative_capacity = 0
+        for sector_index in range(depot_sector_count):
+            sector_vehicle_list = vehicle_list[sector_index::depot_sector_count]
+            cumulative_capacity += sum(vehicle.capacity for vehicle in sector_vehicle_list)
+            if sector_index == depot_sector_count - 1:
+                end = len(customer_list)
+            else:
+                end = bisect.bisect_right(cumulative_demand_list, total_demand * cumulative_capacity / total_capacity)
+            partition_list.append(Partition(depot, sector_vehicle_list, customer_list[start:end]))
+            start = end
+    return partition_list
+
+
+def split_into_partitions(solution, mode, sector_count):
+    if mode == DEPOT_MODE:
+        return partition_by_depot(solution)
+    if mode == SECTOR_MODE:
+        return partition_by_sector(solution, sector_count)
+    raise ValueError(f'Unknown decomposition mode ({mode}), expected {DEPOT_MODE} or {SECTOR_MODE}.')
+
+
+def build_partition_solution(partition_dict, sparse_neighbour_count=None):
+    """Rebuilds a partition sent to a worker as a standalone problem, keeping the depot, vehicle and customer ids."""
+    location_id_sequence = itertools.count()
+    depot_id, depot_latitude, depot_longitude = partition_dict['depot']
+    depot = Depot(depot_id, Location(next(location_id_sequence), depot_latitude, depot_longitude))
+    vehicle_list = [Vehicle(vehicle_id, capacity, depot) for vehicle_id, capacity in partition_dict['vehicleList']]
+    customer_list = [Customer(customer_id, Location(next(location_id_sequence), latitude, longitude), demand,
+                              ready_time, due_time, service_duration)
+                     for customer_id, latitude, longitude, demand, ready_time, due_time, service_duration
+                     in partition_dict['customerList']]
+
+    location_list = [customer.location for customer in customer_list]
+    location_list.append(depot.location)
+    distance_calculator = EuclideanDistanceCalculator(sparse_neighbour_count=sparse_neighbour_count)
+    distance_calculator.init_distance_maps(location_list, [depot.location])
+    distance_calculator.init_nearby_maps(location_list, NEARBY_COUNT)
+
+    south_west_corner = Location(0, min(location.latitude for location in location_list),
+                                 min(location.longitude for location in location_list))
+    north_east_corner = Location(0, max(location.latitude for location in location_list),
+                                 max(location.longitude for location in location_list))
+    return VehicleRoutingSolution(f'depot {depot_id} partition', location_list, [depot], vehicle_list, customer_list,
+                                  south_west_corner, north_east_corner, HardSoftScore.ZERO)
+
+
+def solve_partition_dicts(partition_dict_list, partition_seconds, sparse_neighbour_count=None):
+    """Solves the partitions of one worker one after the other; returns the customer ids of every vehicle route."""
+    solver_factory = solver_factory_create(create_solver_config(Duration.ofSeconds(partition_seconds)))
+    route_map = dict()
+    for partition_dict in partition_dict_list:
+        solution = build_partition_solution(partition_dict, sparse_neighbour_count)
+        build_sweep_routes(solution)
+        best_solution = solver_factory.buildSolver().solve(solution)
+        for vehicle in best_solution.vehicle_list:
+            route_map[vehicle.id] = [customer.id for customer in vehicle.customer_list]
+    return route_map
+
+
+def run_worker(partition_list, partition_seconds, sparse_neighbour_count=None):
+    # Every worker is a separate process with its own JVM; the routes come back through a file,
+    # since the solver logs to standard output
+    with tempfile.TemporaryDirectory(prefix='optapy-vehicle-routing-partition-') as directory:
+        input_path = os.path.join(directory, 'input.json')
+        output_path = os.path.join(directory, 'output.json')
+        with open(input_path, 'w') as input_file:
+            json.dump({
+                'partitionList': [partition.to_dict() for partition in partition_list],
+                'partitionSeconds': partition_seconds,
+                'sparseNeighbourCount': sparse_neighbour_count,
+            }, input_file)
+        subprocess.run([sys.executable, os.path.abspath(__file__), input_path, output_path], check=True)
+        with open(output_path) as output_file:
+            return {int(vehicle_id): customer_id_list
+                    for vehicle_id, customer_id_list in json.load(output_file).items()}
+
+
+def solve_partitions(solution, mode, worker_count, partition_seconds, sparse_neighbour_count=None):
+    """
+    Solves the partitions of the solution in at most worker_count worker processes, running concurrently.
+    Returns the customer ids of every vehicle route; the solution itself is left untouched.
+    """
+    partition_list = [partition for partition in split_into_partitions(solution, mode, worker_count)
+                      if partition.customer_list]
+    worker_partition_lists = [partition_list[worker_index::worker_count]
+                              for worker_index in range(min(worker_count, len(partition_list)))]
+    route_map = dict()
+    if not worker_partition_lists:
+        return route_map
+    with ThreadPoolExecutor(len(worker_partition_lists)) as executor:
+        for worker_route_map in executor.map(
+                lambda worker_partition_list: run_worker(worker_partition_list, partition_seconds,
+                                                         sparse_neighbour_count),
+                worker_partition_lists):
+            route_map.update(worker_route_map)
+    return route_map
+
+
+def apply_routes(solution, route_map):
+    """Merges the routes found for the partitions into the solution; vehicles without a route keep theirs."""
+    customer_by_id = {customer.id: customer for customer in solution.customer_list}
+    for vehicle in solution.vehicle_list:
+        if vehicle.id in route_map:
+            vehicle.set_customer_list([customer_by_id[customer_id] for customer_id in route_map[vehicle.id]])
+
+
+if __name__ == '__main__':
+    worker_input_path, worker_output_path = sys.argv[1:3]
+    with open(worker_input_path) as worker_input_file:
+        worker_input = json.load(worker_input_file)
+    worker_route_map = solve_partition_dicts(worker_input['partitionList'], worker_input['partitionSeconds'],
+                                             worker_input['sparseNeighbourCount'])
+    with open(worker_output_path, 'w') as worker_output_file:
+        json.dump(worker_route_map, worker_output_file)
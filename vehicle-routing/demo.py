@@ -1,4 +1,6 @@
-from random import Random
+import itertools
+import numpy as np
+from instance_sampling import sample_coordinates, sample_demands, UNIFORM_DISTRIBUTION
 
 class DemoDataBuilder:
     def __init__(self, Location, Depot, Customer, Vehicle, VehicleRoutingSolution, calculator):
@@ -16,6 +18,9 @@ class DemoDataBuilder:
         self.Vehicle = Vehicle
         self.VehicleRoutingSolution = VehicleRoutingSolution
         self.distance_calculator = calculator
+        self.seed = 0
+        self.distribution = UNIFORM_DISTRIBUTION
+        self.cluster_count = 8
 
     @staticmethod
     def builder(Location, Depot, Customer, Vehicle, VehicleRoutingSolution, calculator):
@@ -53,6 +58,18 @@ class DemoDataBuilder:
         self.vehicleCapacity = vehicleCapacity
         return self
 
+    def set_seed(self, seed):
+        self.seed = seed
+        return self
+
+    def set_distribution(self, distribution):
+        self.distribution = distribution
+        return self
+
+    def set_cluster_count(self, cluster_count):
+        self.cluster_count = cluster_count
+        return self
+
     def build(self):
         if self.minDemand < 1:
             raise ValueError("minDemand (" + self.minDemand + ") must be greater than zero.")
@@ -80,46 +97,24 @@ class DemoDataBuilder:
 
         name = "demo"
 
-        random = Random(0)
-        id_sequence = [0]
-
-        def generate_id():
-            out = id_sequence[0]
-            id_sequence[0] = out + 1
-            return str(out)
-
-        generate_latitude = lambda: random.uniform(self.southWestCorner.latitude, self.northEastCorner.latitude)
-        generate_longitude = lambda: random.uniform(self.southWestCorner.longitude, self.northEastCorner.longitude)
-
-        generate_demand = lambda: random.randint(self.minDemand, self.maxDemand)
-
-        depot_list = []
-        random_depot = lambda: random.choice(depot_list)
-
-        generate_depot = lambda: self.Depot(
-            generate_id(),
-            self.Location(generate_latitude(), generate_longitude()))
-
-        for i in range(self.depotCount):
-            depot_list.append(generate_depot())
-
-        generate_vehicle = lambda: self.Vehicle(
-            generate_id(),
-            self.vehicleCapacity,
-            random_depot())
-
-        vehicle_list = []
-        for i in range(self.vehicleCount):
-            vehicle_list.append(generate_vehicle())
-
-        generate_customer = lambda: self.Customer(
-            generate_id(),
-            self.Location(generate_latitude(), generate_longitude()),
-            generate_demand())
-
-        customer_list = []
-        for i in range(self.customerCount):
-            customer_list.append(generate_customer())
+        # Coordinates and demands are sampled as whole arrays; only the domain objects are created one by one
+        random = np.random.default_rng(self.seed)
+        id_sequence = map(str, itertools.count())
+        depot_latitudes, depot_longitudes = sample_coordinates(random, self.depotCount, self.southWestCorner,
+                                                               self.northEastCorner)
+        depot_list = [self.Depot(next(id_sequence), self.Location(latitude, longitude))
+                      for latitude, longitude in zip(depot_latitudes.tolist(), depot_longitudes.tolist())]
+
+        vehicle_depots = random.integers(0, self.depotCount, self.vehicleCount)
+        vehicle_list = [self.Vehicle(next(id_sequence), self.vehicleCapacity, depot_list[depot_index])
+                        for depot_index in vehicle_depots.tolist()]
+
+        latitudes, longitudes = sample_coordinates(random, self.customerCount, self.southWestCorner,
+                                                   self.northEastCorner, self.distribution, self.cluster_count)
+        demands = sample_demands(random, self.customerCount, self.minDemand, self.maxDemand)
+        customer_list = [self.Customer(next(id_sequence), self.Location(latitude, longitude), demand)
+                         for latitude, longitude, demand in zip(latitudes.tolist(), longitudes.tolist(),
+                                                                demands.tolist())]
 
         location_list = []
         for customer in customer_list:
@@ -0,0 +1,263 @@
+"""
+Real-time dispatch: changes to a problem while it is being solved.
+
+Every change is a function of the solution and a problem change director. While the problem is being solved, it runs
+in a problem change submitted to the solver manager, on the solver thread between two steps, so the solver keeps its
+working solution and carries on from it. Otherwise it runs with an ImmediateProblemChangeDirector, straight on the
+problem. Either way the changes are made on the Python objects of the solution, inside the director consumers, so
+the solver is told about every fact and variable it has to update.
+"""
+from domain import Location, Customer, EuclideanDistanceCalculator, NEARBY_COUNT, NO_DUE_TIME
+from optapy import problem_change
+
+
+class ImmediateProblemChangeDirector:
+    """
+    Applies the changes straight away, to a problem that is not being solved: the Python objects are the working
+    objects, so every consumer gets the object it was given.
+    """
+    def addEntity(self, entity, consumer):
+        consumer(entity)
+
+    def removeEntity(self, entity, consumer):
+        consumer(entity)
+
+    def changeVariable(self, entity, variable_name, consumer):
+        consumer(entity)
+
+    def addProblemFact(self, problem_fact, consumer):
+        consumer(problem_fact)
+
+    def removeProblemFact(self, problem_fact, consumer):
+        consumer(problem_fact)
+
+    def changeProblemProperty(self, problem_fact_or_entity, consumer):
+        consumer(problem_fact_or_entity)
+
+    def lookUpWorkingObjectOrFail(self, external_object):
+        return external_object
+
+    def updateShadowVariables(self):
+        pass
+
+
+def read_working_object(working_object):
+    """
+    The solver's copy of a location or customer added while solving has none of the fields of the Python object, and
+    the copy of a changed vehicle keeps its old route and capacity until the solver restarts; this reads them in.
+    Nothing to do without a solver.
+    """
+    if hasattr(working_object, 'readFromPythonObject'):
+        from java.util import HashSet
+        working_object.readFromPythonObject(HashSet(), getattr(working_object, '__optaplannerReferenceMap'))
+
+
+def read_working_distance_matrix(working_location, working_known_location):
+    """
+    The solver's copies of the locations share a copy of the distance matrix, whose Java array of distances holds the
+    rows and columns of added locations, until the matrix grows into a new array. This reads the current array into
+    the copy of a location the solver already knew, and gives that copy to the solver's copy of an added location,
+    which was read in with one of its own. Nothing to do without a solver.
+    """
+    if not hasattr(working_location, '$field$distance_matrix'):
+        return
+    working_distance_matrix = getattr(working_known_location, '$field$distance_matrix')
+    getattr(working_distance_matrix, '$readFieldsFromCPythonReference')()
+    setattr(working_location, '$field$distance_matrix', working_distance_matrix)
+
+
+def find_vehicle(solution, vehicle_id):
+    return next((vehicle for vehicle in solution.vehicle_list if vehicle.id == vehicle_id), None)
+
+
+def find_customer(solution, customer_id):
+    return next((customer for customer in solution.customer_list if customer.id == customer_id), None)
+
+
+def get_route_map(solution, director):
+    """
+    The customers on the route of every vehicle. While solving, only the solver's copies of the vehicles follow its
+    moves, so the routes are read from them.
+    """
+    customer_by_id = None
+    route_map = dict()
+    for vehicle in solution.vehicle_list:
+        working_vehicle = director.lookUpWorkingObjectOrFail(vehicle)
+        if working_vehicle is vehicle:
+            route_map[vehicle] = list(vehicle.customer_list)
+            continue
+        if customer_by_id is None:
+            customer_by_id = {customer.id: customer for customer in solution.customer_list}
+        route_map[vehicle] = [customer_by_id[customer.id] for customer in working_vehicle.getCustomer_list()]
+    return route_map
+
+
+def change_route(vehicle, customer_list, director):
+    def change(working_vehicle):
+        vehicle.set_customer_list(customer_list)
+        read_working_object(working_vehicle)
+    director.changeVariable(vehicle, 'customer_list', change)
+
+
+def change_pinned_count(vehicle, pinned_count, director):
+    def change(working_vehicle):
+        vehicle.set_pinned_count(pinned_count)
+        read_working_object(working_vehicle)
+    director.changeProblemProperty(vehicle, change)
+
+
+def find_cheapest_insertion(route_map, customer):
+    """
+    The vehicle and index at which visiting the customer adds the least distance, after the pinned customers of that
+    vehicle, preferring the vehicles with room left for its demand. None, None without any vehicle.
+    """
+    location = customer.location
+    best_insertion = None
+    for vehicle, route in route_map.items():
+        is_overloaded = sum(stop.demand for stop in route) + customer.demand > vehicle.capacity
+        stop_list = [vehicle.depot.location] + [stop.location for stop in route] + [vehicle.depot.location]
+        for index in range(vehicle.pinned_count, len(route) + 1):
+            previous_location = stop_list[index]
+            next_location = stop_list[index + 1]
+            added_distance = previous_location.get_distance_to(location) + location.get_distance_to(next_location) - \
+                previous_location.get_distance_to(next_location)
+            insertion = (is_overloaded, added_distance, vehicle, index)
+            if best_insertion is None or insertion[:2] < best_insertion[:2]:
+                best_insertion = insertion
+    if best_insertion is None:
+        return None, None
+    return best_insertion[2], best_insertion[3]
+
+
+def add_customer(solution, customer, director):
+    """Adds a customer (with a location of its own) and inserts it in the route where it adds the least distance."""
+    location = customer.location
+    known_location = solution.location_list[0]
+    EuclideanDistanceCalculator().add_location(location, solution.location_list, NEARBY_COUNT)
+
+    def add_location(working_location):
+        solution.location_list.append(location)
+        read_working_object(working_location)
+        read_working_distance_matrix(working_location, director.lookUpWorkingObjectOrFail(known_location))
+    director.addProblemFact(location, add_location)
+
+    def add(working_customer):
+        solution.customer_list.append(customer)
+        read_working_object(working_customer)
+    director.addProblemFact(customer, add)
+    route_map = get_route_map(solution, director)
+    vehicle, index = find_cheapest_insertion(route_map, customer)
+    if vehicle is not None:
+        route = route_map[vehicle]
+        change_route(vehicle, route[:index] + [customer] + route[index:], director)
+
+
+def remove_customer(solution, customer_id, director):
+    """Removes a customer that is not served yet; returns whether it was removed."""
+    customer = find_customer(solution, customer_id)
+    if customer is None:
+        return False
+    for vehicle, route in get_route_map(solution, director).items():
+        if customer in route:
+            if route.index(customer) < vehicle.pinned_count:
+                return False
+            change_route(vehicle, [stop for stop in route if stop is not customer], director)
+            break
+    director.removeProblemFact(customer, lambda _: solution.customer_list.remove(customer))
+    director.removeProblemFact(customer.location, lambda _: solution.location_list.remove(customer.location))
+    return True
+
+
+def pin_served_customers(solution, vehicle_id, customer_id_list, director):
+    """
+    Records the customers the vehicle has served so far, in the order it served them: they become the head of its
+    route, taken from whichever route they were planned in, and the solver no longer moves them.
+    """
+    vehicle = find_vehicle(solution, vehicle_id)
+    customer_by_id = {customer.id: customer for customer in solution.customer_list}
+    served_customer_list = [customer_by_id[customer_id] for customer_id in customer_id_list
+                            if customer_id in customer_by_id]
+    served_customer_set = set(served_customer_list)
+    route_map = get_route_map(solution, director)
+    for other_vehicle, route in route_map.items():
+        if other_vehicle is vehicle or served_customer_set.isdisjoint(route):
+            continue
+        # Customers taken from the pinned head of another route no longer count as pinned there
+        pinned_taken_count = sum(1 for customer in route[:other_vehicle.pinned_count]
+                                 if customer in served_customer_set)
+        change_route(other_vehicle, [customer for customer in route if customer not in served_customer_set], director)
+        if pinned_taken_count > 0:
+            change_pinned_count(other_vehicle, other_vehicle.pinned_count - pinned_taken_count, director)
+    change_route(vehicle, served_customer_list + [customer for customer in route_map[vehicle]
+                                                  if customer not in served_customer_set], director)
+    change_pinned_count(vehicle, len(served_customer_list), director)
+
+
+def change_vehicle_capacity(solution, vehicle_id, capacity, director):
+    vehicle = find_vehicle(solution, vehicle_id)
+
+    def change(working_vehicle):
+        vehicle.set_capacity(capacity)
+        read_working_object(working_vehicle)
+    director.changeProblemProperty(vehicle, change)
+
+
+def create_customer(customer_id, location_id, latitude, longitude, demand, ready_time=0, due_time=NO_DUE_TIME,
+                    service_duration=0):
+    return Customer(customer_id, Location(location_id, latitude, longitude), demand, ready_time, due_time,
+                    service_duration)
+
+
+# doChange gets the solver's working solution and applies the change to the Python solution it wraps; the service
+# calls apply with an ImmediateProblemChangeDirector for a problem no solver job is running for.
+
+@problem_change
+class AddCustomerProblemChange:
+    def __init__(self, customer):
+        self.customer = customer
+
+    def apply(self, solution, director):
+        add_customer(solution, self.customer, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+
+
+@problem_change
+class RemoveCustomerProblemChange:
+    def __init__(self, customer_id):
+        self.customer_id = customer_id
+        # Whether the customer was removed, once the change is applied: a served customer is not
+        self.removed = None
+
+    def apply(self, solution, director):
+        self.removed = remove_customer(solution, self.customer_id, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+
+
+@problem_change
+class PinServedCustomersProblemChange:
+    def __init__(self, vehicle_id, customer_id_list):
+        self.vehicle_id = vehicle_id
+        self.customer_id_list = customer_id_list
+
+    def apply(self, solution, director):
+        pin_served_customers(solution, self.vehicle_id, self.customer_id_list, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
+
+
+@problem_change
+class ChangeVehicleCapacityProblemChange:
+    def __init__(self, vehicle_id, capacity):
+        self.vehicle_id = vehicle_id
+        self.capacity = capacity
+
+    def apply(self, solution, director):
+        change_vehicle_capacity(solution, self.vehicle_id, self.capacity, director)
+
+    def doChange(self, working_solution, director):
+        self.apply(working_solution.get__optapy_Id(), director)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import time
+import numpy as np
+from domain import DistanceMatrix
+
+
+class DistanceMatrixCache:
+    """
+    Keeps computed distance matrices on local disk, keyed by the coordinates of the locations they were computed for.
+    Matrices are stored as .npy files and memory-mapped on load, so a repeated solve over the same depot/customer set
+    does not recompute the matrix: the memory map is the backing store of the DistanceMatrix, and only the Java array
+    the solver reads is filled from it.
+    Entries unused for longer than max_age_seconds are evicted, then the least recently used ones
+    until the cache fits in max_size_bytes.
+    """
+    FILE_SUFFIX = '.npy'
+
+    def __init__(self, directory, max_size_bytes=1 << 30, max_age_seconds=7 * 24 * 60 * 60):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, location_list, namespace=''):
+        digest = hashlib.sha256(namespace.encode())
+        digest.update(np.fromiter((location.latitude for location in location_list), dtype=np.float64,
+                                  count=len(location_list)).tobytes())
+        digest.update(np.fromiter((location.longitude for location in location_list), dtype=np.float64,
+                                  count=len(location_list)).tobytes())
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + DistanceMatrixCache.FILE_SUFFIX)
+
+    def load(self, key):
+        path = self.get_path(key)
+        try:
+            matrix = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        # The modification time records the last use, so eviction by age keeps entries that are still hit
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted meanwhile: the mapping stays valid, it just is not marked as used
+            pass
+        return DistanceMatrix(matrix)
+
+    def store(self, key, distance_matrix):
+        path = self.get_path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as temporary_file:
+            np.save(temporary_file, distance_matrix.matrix)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def get_or_calculate(self, location_list, calculate_distance_matrix, namespace=''):
+        key = self.get_key(location_list, namespace)
+        distance_matrix = self.load(key)
+        if distance_matrix is None or len(distance_matrix) != len(location_list):
+            distance_matrix = calculate_distance_matrix(location_list)
+            self.store(key, distance_matrix)
+        return distance_matrix
+
+    def evict(self):
+        now = time.time()
+        entry_list = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(DistanceMatrixCache.FILE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(path)
+            else:
+                entry_list.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entry_list)
+        entry_list.sort()
+        for _, size, path in entry_list:
+            if total_size <= self.max_size_bytes:
+                break
+            self._remove(path)
+            total_size -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
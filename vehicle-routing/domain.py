@@ -1,27 +1,56 @@
+import itertools
 import math
-from random import Random
-from optapy import problem_fact, planning_entity, planning_list_variable, planning_solution, planning_score, \
-    planning_entity_collection_property, problem_fact_collection_property, value_range_provider
+import numpy as np
+from optapy import problem_fact, planning_id, planning_entity, planning_list_variable, planning_solution, \
+    planning_score, planning_entity_collection_property, problem_fact_collection_property, value_range_provider
 from optapy.score import HardSoftScore
+from java.util.concurrent.atomic import AtomicIntegerArray
+from jpype import JArray, JInt
+from spatial_index import SpatialIndex
+from instance_sampling import sample_coordinates, sample_demands, UNIFORM_DISTRIBUTION
+
+# Number of nearest locations kept per location for nearby move selection
+NEARBY_COUNT = 20
+# Nearby distance reported for locations that are not among the nearest ones
+NOT_NEARBY_DISTANCE = 1 << 30
+# Vehicles leave their depot at time 0 and drive at this speed; times are in seconds
+DRIVING_SPEED_METERS_PER_SECOND = 10
+# Due time of a customer without time window
+NO_DUE_TIME = 1 << 30
 
 @problem_fact
 class Location:
     id: int
     latitude: float
     longitude: float
-    distance_map: dict['Location', float]
+    distance_index: int
 
-    def __init__(self, _id, latitude, longitude, distance_map=None):
+    def __init__(self, _id, latitude, longitude, distance_index=None, distance_matrix=None):
         self.id = _id
         self.latitude = latitude
         self.longitude = longitude
-        self.distance_map = distance_map
+        self.distance_index = distance_index
+        self.distance_matrix = distance_matrix
+        self.nearby_distance_map = None
 
-    def set_distance_map(self, distance_map):
-        self.distance_map = distance_map
+    @planning_id
+    def get_id(self):
+        return self.id
+
+    def set_distance_matrix(self, distance_index, distance_matrix):
+        self.distance_index = distance_index
+        self.distance_matrix = distance_matrix
+
+    def set_nearby_distance_map(self, nearby_distance_map):
+        self.nearby_distance_map = nearby_distance_map
 
     def get_distance_to(self, location):
-        return self.distance_map[location]
+        return self.distance_matrix.get_distance(self.distance_index, location.distance_index)
+
+    def get_nearby_distance(self, location):
+        if self.nearby_distance_map is None:
+            return self.get_distance_to(location)
+        return self.nearby_distance_map.get(location.distance_index, NOT_NEARBY_DISTANCE)
 
     def get_angle(self, location):
         latitude_difference = location.latitude - self.latitude
@@ -29,9 +58,10 @@ class Location:
         return math.atan2(latitude_difference, longitude_difference)
 
     def to_dict(self):
+        # Six decimal places is about 0.1 m, well below what a map can show
         return [
-            self.latitude,
-            self.longitude
+            round(self.latitude, 6),
+            round(self.longitude, 6)
         ]
 
     def __str__(self):
@@ -43,18 +73,28 @@ class Customer:
     id: int
     location: Location
     demand: int
+    ready_time: int
+    due_time: int
+    service_duration: int
 
-    def __init__(self, _id, location, demand):
+    def __init__(self, _id, location, demand, ready_time=0, due_time=NO_DUE_TIME, service_duration=0):
         self.id = _id
         self.location = location
         self.demand = demand
+        # Service can start from ready_time and should start by due_time; a vehicle arriving early waits
+        self.ready_time = ready_time
+        self.due_time = due_time
+        self.service_duration = service_duration
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'location': self.location.to_dict(),
-            'demand': self.demand
-        }
+    @planning_id
+    def get_id(self):
+        return self.id
+
+    def get_departure_time(self, arrival_time):
+        return max(arrival_time, self.ready_time) + self.service_duration
+
+    def get_lateness(self, arrival_time):
+        return max(arrival_time - self.due_time, 0)
 
     def __str__(self):
         return f'Customer {self.id}'
@@ -72,22 +112,31 @@ class Depot:
         self.id = _id
         self.location = location
 
-    def to_dict(self):
+    @planning_id
+    def get_id(self):
+        return self.id
+
+    def to_dict(self, location_index_map):
         return {
             'id': self.id,
-            'location': self.location.to_dict(),
+            'location': location_index_map[self.location.id],
         }
 
     def __str__(self):
         return f'Depot {self.id}'
 
 
+def get_driving_time(distance_meters):
+    return (distance_meters + DRIVING_SPEED_METERS_PER_SECOND - 1) // DRIVING_SPEED_METERS_PER_SECOND
+
+
 @planning_entity
 class Vehicle:
     id: int
     capacity: int
     depot: Depot
     customer_list: list[Customer]
+    pinned_count: int
 
     def __init__(self, _id, capacity, depot, customer_list=None):
         self.id = _id
@@ -97,6 +146,12 @@ class Vehicle:
             self.customer_list = []
         else:
             self.customer_list = customer_list
+        # The first pinned_count customers are already served (or on their way), so the solver keeps them in place
+        self.pinned_count = 0
+
+    @planning_id
+    def get_id(self):
+        return self.id
 
     @planning_list_variable(Customer, ['customer_range'])
     def get_customer_list(self):
@@ -105,6 +160,12 @@ class Vehicle:
     def set_customer_list(self, customer_list):
         self.customer_list = customer_list
 
+    def set_capacity(self, capacity):
+        self.capacity = capacity
+
+    def set_pinned_count(self, pinned_count):
+        self.pinned_count = pinned_count
+
     def get_route(self):
         if len(self.customer_list) == 0:
             return []
@@ -114,6 +175,23 @@ class Vehicle:
         route.append(self.depot.location)
         return route
 
+    # The route totals below walk customer_list on every call instead of being kept up to date as it changes:
+    # optapy has no listener for list variables, and a Python variable listener syncs the whole working solution
+    # with CPython on every event, which costs more than walking a route. The constraints get each total once per
+    # vehicle.
+
+    def get_total_lateness(self):
+        """The total time by which the customers of the route are served after their due time."""
+        total_lateness = 0
+        departure_time = 0
+        last_location = self.depot.location
+        for customer in self.customer_list:
+            arrival_time = departure_time + get_driving_time(last_location.get_distance_to(customer.location))
+            total_lateness += customer.get_lateness(arrival_time)
+            departure_time = customer.get_departure_time(arrival_time)
+            last_location = customer.location
+        return total_lateness
+
     def get_total_demand(self):
         total_demand = 0
         for customer in self.customer_list:
@@ -121,22 +199,22 @@ class Vehicle:
         return total_demand
 
     def get_total_distance_meters(self):
+        if len(self.customer_list) == 0:
+            return 0
         total_distance = 0
         last_location = self.depot.location
         for customer in self.customer_list:
-            total_distance += customer.location.get_distance_to(last_location)
+            total_distance += last_location.get_distance_to(customer.location)
             last_location = customer.location
-        if last_location is not self.depot.location:
-            total_distance += self.depot.location.get_distance_to(last_location)
-        return total_distance
+        return total_distance + last_location.get_distance_to(self.depot.location)
 
-    def to_dict(self):
+    def to_dict(self, depot_index_map, customer_index_map):
         return {
             'id': self.id,
             'capacity': self.capacity,
-            'depot': self.depot.to_dict(),
-            'customerList': list(map(lambda customer: customer.to_dict(), self.customer_list)),
-            'route': list(map(lambda location: location.to_dict(), self.get_route())),
+            'depot': depot_index_map[self.depot.id],
+            'customerList': [customer_index_map[customer.id] for customer in self.customer_list],
+            'pinnedCount': self.pinned_count,
             'totalDemand': self.get_total_demand(),
             'totalDistanceMeters': self.get_total_distance_meters(),
         }
@@ -145,8 +223,115 @@ class Vehicle:
         return f'Vehicle {self.id}'
 
 
+class DistanceMatrix:
+    """
+    Distances in meters between all locations of a problem. Each Location refers to its row (and column) through its
+    distance_index.
+    matrix keeps them as a numpy array, which is the memory-mapped file itself on a distance matrix cache hit. The
+    constraints are translated to Java and would call back into CPython for every lookup in it, so the solver reads
+    distances instead: a Java array filled from matrix in a single bulk copy, with room for stride rows and columns.
+    """
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.storage = matrix
+        self.stride = len(matrix)
+        self.distances = DistanceMatrix.to_java_array(matrix)
+
+    @staticmethod
+    def to_java_array(storage):
+        return AtomicIntegerArray(JArray(JInt)(np.ascontiguousarray(storage, dtype=np.int32).reshape(-1)))
+
+    def get_distance(self, from_index, to_index):
+        return self.distances.get(from_index * self.stride + to_index)
+
+    def add_location(self, location, distance_list):
+        """
+        Appends a row and a column for a new location, given its (symmetric) distance to every index, and points the
+        location at them. The Java array is shared with the solver's copies of the locations, which see the new
+        distances without being read again, until it has to grow.
+        """
+        size = len(self.matrix)
+        if size == self.stride:
+            # Grown by an eighth at a time, so locations added one by one only copy the matrix every size // 8 additions
+            stride = size + max(16, size // 8)
+            storage = np.zeros((stride, stride), dtype=np.int32)
+            storage[:size, :size] = self.matrix
+            distances = DistanceMatrix.to_java_array(storage)
+            # Swapped in together: scoring a best solution on another thread reads the stride and the distances too
+            self.storage, self.stride, self.distances = storage, stride, distances
+        matrix = self.storage[:size + 1, :size + 1]
+        matrix[size, :size] = distance_list
+        matrix[:size, size] = distance_list
+        matrix[size, size] = 0
+        self.matrix = matrix
+        distances = self.distances
+        for index, distance in enumerate(distance_list):
+            distances.set(size * self.stride + index, distance)
+            distances.set(index * self.stride + size, distance)
+        distances.set(size * self.stride + size, 0)
+        location.set_distance_matrix(size, self)
+        return size
+
+    def __len__(self):
+        return len(self.matrix)
+
+
+class SparseDistanceMatrix:
+    """
+    Distances in meters from each location to its nearest neighbours and to the hub (depot) locations only,
+    and from each hub to every location, so memory grows with n * k rather than n * n.
+    Any other distance is computed on demand by the distance calculator and kept in a bounded LRU cache.
+    """
+    def __init__(self, location_list, rows, distance_calculator, cache_size):
+        # A copy: locations keep their index after they are removed from the problem
+        self.location_list = list(location_list)
+        self.rows = rows
+        self.distance_calculator = distance_calculator
+        self.cache_size = cache_size
+        self.cache = dict()
+
+    def get_distance(self, from_index, to_index):
+        distance = self.rows[from_index].get(to_index)
+        if distance is not None:
+            return distance
+        # dicts keep insertion order: reinserting on every hit keeps the least recently used key first
+        key = (from_index, to_index)
+        distance = self.cache.pop(key, None)
+        if distance is None:
+            distance = self.distance_calculator.calculate_distance(self.location_list[from_index],
+                                                                   self.location_list[to_index])
+            if len(self.cache) >= self.cache_size:
+                del self.cache[next(iter(self.cache))]
+        self.cache[key] = distance
+        return distance
+
+    def add_location(self, location, distance_list):
+        # Other distances to a new location are computed on demand, like any that is not stored
+        self.location_list.append(location)
+        distance_index = len(self.location_list) - 1
+        self.rows.append({distance_index: 0})
+        location.set_distance_matrix(distance_index, self)
+        return distance_index
+
+    def __len__(self):
+        return len(self.location_list)
+
+
 class EuclideanDistanceCalculator:
     METERS_PER_DEGREE = 111_000
+    # Maximum number of matrix cells computed at once, to bound the size of the temporary arrays
+    BLOCK_SIZE = 1 << 22
+
+    def __init__(self, distance_matrix_cache=None, sparse_neighbour_count=None, sparse_cache_size=1 << 20):
+        self.distance_matrix_cache = distance_matrix_cache
+        # When set, only that many nearest neighbours (plus the hubs) are stored per location
+        self.sparse_neighbour_count = sparse_neighbour_count
+        self.sparse_cache_size = sparse_cache_size
+
+    @staticmethod
+    def to_meters(latitude_diff, longitude_diff):
+        return np.ceil(np.sqrt(latitude_diff * latitude_diff + longitude_diff * longitude_diff) *
+                       EuclideanDistanceCalculator.METERS_PER_DEGREE)
 
     def calculate_distance(self, start, end):
         if start == end:
@@ -156,15 +341,98 @@ class EuclideanDistanceCalculator:
         return math.ceil(math.sqrt(latitude_diff * latitude_diff + longitude_diff * longitude_diff) *
                          EuclideanDistanceCalculator.METERS_PER_DEGREE)
 
-    def init_distance_maps(self, location_list):
-        for location in location_list:
-            distance_map = dict()
-            for other_location in location_list:
-                distance_map[other_location] = self.calculate_distance(location, other_location)
-            location.set_distance_map(distance_map)
+    @staticmethod
+    def get_coordinates(location_list):
+        location_count = len(location_list)
+        latitudes = np.fromiter((location.latitude for location in location_list), dtype=np.float64,
+                                count=location_count)
+        longitudes = np.fromiter((location.longitude for location in location_list), dtype=np.float64,
+                                 count=location_count)
+        return latitudes, longitudes
+
+    def calculate_distance_matrix(self, location_list):
+        location_count = len(location_list)
+        latitudes, longitudes = EuclideanDistanceCalculator.get_coordinates(location_list)
+        # int32 is enough: two points on Earth are never more than ~40 000 km apart
+        matrix = np.empty((location_count, location_count), dtype=np.int32)
+        rows_per_block = max(1, EuclideanDistanceCalculator.BLOCK_SIZE // max(1, location_count))
+        for start in range(0, location_count, rows_per_block):
+            end = min(start + rows_per_block, location_count)
+            latitude_diff = latitudes[np.newaxis, :] - latitudes[start:end, np.newaxis]
+            longitude_diff = longitudes[np.newaxis, :] - longitudes[start:end, np.newaxis]
+            matrix[start:end] = EuclideanDistanceCalculator.to_meters(latitude_diff, longitude_diff)
+        return DistanceMatrix(matrix)
+
+    def calculate_sparse_distance_matrix(self, location_list, hub_location_list=()):
+        location_count = len(location_list)
+        latitudes, longitudes = EuclideanDistanceCalculator.get_coordinates(location_list)
+        location_to_index = {id(location): index for index, location in enumerate(location_list)}
+        hub_indices = np.array([location_to_index[id(hub)] for hub in hub_location_list], dtype=np.int64)
+        nearest_indices, _ = SpatialIndex(latitudes, longitudes).get_k_nearest(self.sparse_neighbour_count)
+
+        # Each row holds the location itself, its nearest neighbours and the hubs
+        columns = np.hstack((np.arange(location_count)[:, np.newaxis], nearest_indices,
+                             np.broadcast_to(hub_indices, (location_count, len(hub_indices)))))
+        meters = EuclideanDistanceCalculator.to_meters(latitudes[columns] - latitudes[:, np.newaxis],
+                                                       longitudes[columns] - longitudes[:, np.newaxis])
+        rows = [dict(zip(row_columns, row_meters))
+                for row_columns, row_meters in zip(columns.tolist(), meters.astype(np.int64).tolist())]
+        # Every route starts from a hub, so hub rows are kept whole
+        for hub_index in hub_indices.tolist():
+            hub_meters = EuclideanDistanceCalculator.to_meters(latitudes - latitudes[hub_index],
+                                                               longitudes - longitudes[hub_index])
+            rows[hub_index] = dict(enumerate(hub_meters.astype(np.int64).tolist()))
+        return SparseDistanceMatrix(location_list, rows, self, self.sparse_cache_size)
+
+    def init_distance_maps(self, location_list, hub_location_list=()):
+        if self.sparse_neighbour_count is not None:
+            distance_matrix = self.calculate_sparse_distance_matrix(location_list, hub_location_list)
+        elif self.distance_matrix_cache is None:
+            distance_matrix = self.calculate_distance_matrix(location_list)
+        else:
+            distance_matrix = self.distance_matrix_cache.get_or_calculate(location_list,
+                                                                          self.calculate_distance_matrix,
+                                                                          type(self).__name__)
+        for index, location in enumerate(location_list):
+            location.set_distance_matrix(index, distance_matrix)
+        return distance_matrix
+
+    def add_location(self, location, location_list, nearby_count):
+        """
+        Gives a location added to an already initialized problem its own index in the distance matrix of the
+        locations of location_list, and nearby distances, which the nearest of those locations get in return.
+        """
+        distance_matrix = location_list[0].distance_matrix
+        distance_list = [0] * len(distance_matrix)
+        location_by_index = dict()
+        for other_location in location_list:
+            distance_list[other_location.distance_index] = self.calculate_distance(other_location, location)
+            location_by_index[other_location.distance_index] = other_location
+        distance_index = distance_matrix.add_location(location, distance_list)
+
+        nearest_index_list = sorted(location_by_index, key=lambda index: distance_list[index])[:nearby_count]
+        location.set_nearby_distance_map({index: distance_list[index] for index in nearest_index_list})
+        for index in nearest_index_list:
+            nearby_distance_map = location_by_index[index].nearby_distance_map
+            if nearby_distance_map is not None:
+                nearby_distance_map[distance_index] = distance_list[index]
+        return distance_index
+
+    def init_nearby_maps(self, location_list, nearby_count):
+        spatial_index = SpatialIndex.of_locations(location_list)
+        nearest_indices, nearest_distances = spatial_index.get_k_nearest(nearby_count)
+        nearest_meters = np.ceil(nearest_distances * EuclideanDistanceCalculator.METERS_PER_DEGREE).astype(np.int64)
+        for location, indices, meters in zip(location_list, nearest_indices.tolist(), nearest_meters.tolist()):
+            location.set_nearby_distance_map(dict(zip(indices, meters)))
+        return spatial_index
 
 
 class DemoDataBuilder:
+    # Sizing of the scaled instances, after the demo: 77 customers with a demand of 1.5 on average, 6 vehicles of 25
+    CUSTOMERS_PER_VEHICLE = 13
+    # Above this many customers a full distance matrix takes close to a gigabyte
+    DENSE_MAX_CUSTOMER_COUNT = 15_000
+
     def __init__(self):
         self.southWestCorner = None
         self.northEastCorner = None
@@ -174,12 +442,35 @@ class DemoDataBuilder:
         self.minDemand = None
         self.maxDemand = None
         self.vehicleCapacity = None
+        self.nearby_count = NEARBY_COUNT
         self.distance_calculator = EuclideanDistanceCalculator()
+        self.seed = 0
+        self.distribution = UNIFORM_DISTRIBUTION
+        self.cluster_count = 8
 
     @staticmethod
     def builder():
         return DemoDataBuilder()
 
+    @staticmethod
+    def scaled(customer_count, distribution=UNIFORM_DISTRIBUTION, seed=0):
+        """
+        A builder for an instance shaped like the demo at any size, over the demo area unless the corners are set:
+        every vehicle holds about CUSTOMERS_PER_VEHICLE customers, with some capacity to spare. The depot count
+        only grows with the square root of the customer count, since every location keeps its distance to every
+        depot; large instances keep only the nearest distances otherwise.
+        """
+        vehicle_count = max(1, math.ceil(customer_count / DemoDataBuilder.CUSTOMERS_PER_VEHICLE))
+        builder = DemoDataBuilder.builder().set_min_demand(1).set_max_demand(2).set_vehicle_capacity(25) \
+            .set_customer_count(customer_count).set_vehicle_count(vehicle_count) \
+            .set_depot_count(min(vehicle_count, max(2, round(math.sqrt(customer_count) / 10)))) \
+            .set_south_west_corner(Location(0, 43.751466, 11.177210)) \
+            .set_north_east_corner(Location(0, 43.809291, 11.290195)) \
+            .set_distribution(distribution).set_seed(seed)
+        if customer_count > DemoDataBuilder.DENSE_MAX_CUSTOMER_COUNT:
+            builder.set_sparse_neighbour_count(2 * NEARBY_COUNT)
+        return builder
+
     def set_south_west_corner(self, southWestCorner):
         self.southWestCorner = southWestCorner
         return self
@@ -212,73 +503,74 @@ class DemoDataBuilder:
         self.vehicleCapacity = vehicleCapacity
         return self
 
+    def set_nearby_count(self, nearby_count):
+        self.nearby_count = nearby_count
+        return self
+
+    def set_distance_matrix_cache(self, distance_matrix_cache):
+        self.distance_calculator.distance_matrix_cache = distance_matrix_cache
+        return self
+
+    def set_sparse_neighbour_count(self, sparse_neighbour_count):
+        self.distance_calculator.sparse_neighbour_count = sparse_neighbour_count
+        return self
+
+    def set_seed(self, seed):
+        self.seed = seed
+        return self
+
+    def set_distribution(self, distribution):
+        self.distribution = distribution
+        return self
+
+    def set_cluster_count(self, cluster_count):
+        self.cluster_count = cluster_count
+        return self
+
     def build(self):
         if self.minDemand < 1:
-            raise ValueError("minDemand (" + self.minDemand + ") must be greater than zero.")
+            raise ValueError(f"minDemand ({self.minDemand}) must be greater than zero.")
         if self.maxDemand < 1:
-            raise ValueError("maxDemand (" + self.maxDemand + ") must be greater than zero.")
+            raise ValueError(f"maxDemand ({self.maxDemand}) must be greater than zero.")
         if self.minDemand >= self.maxDemand:
-            raise ValueError("maxDemand (" + self.maxDemand + ") must be greater than minDemand ("
-                             + self.minDemand + ").")
+            raise ValueError(f"maxDemand ({self.maxDemand}) must be greater than minDemand ({self.minDemand}).")
         if self.vehicleCapacity < 1:
-            raise ValueError("Number of vehicleCapacity (" + self.vehicleCapacity + ") must be greater than zero.")
+            raise ValueError(f"Number of vehicleCapacity ({self.vehicleCapacity}) must be greater than zero.")
         if self.customerCount < 1:
-            raise ValueError("Number of customerCount (" + self.customerCount + ") must be greater than zero.")
+            raise ValueError(f"Number of customerCount ({self.customerCount}) must be greater than zero.")
         if self.vehicleCount < 1:
-            raise ValueError("Number of vehicleCount (" + self.vehicleCount + ") must be greater than zero.")
+            raise ValueError(f"Number of vehicleCount ({self.vehicleCount}) must be greater than zero.")
         if self.depotCount < 1:
-            raise ValueError("Number of depotCount (" + self.depotCount + ") must be greater than zero.")
+            raise ValueError(f"Number of depotCount ({self.depotCount}) must be greater than zero.")
 
         if self.northEastCorner.latitude <= self.southWestCorner.latitude:
-            raise ValueError("northEastCorner.getLatitude (" + self.northEastCorner.latitude
-               + ") must be greater than southWestCorner.getLatitude(" +  self.southWestCorner.latitude + ").")
+            raise ValueError(f"northEastCorner.getLatitude ({self.northEastCorner.latitude}) must be greater than "
+                             f"southWestCorner.getLatitude({self.southWestCorner.latitude}).")
 
         if self.northEastCorner.longitude <= self.southWestCorner.longitude:
-            raise ValueError("northEastCorner.getLongitude (" + self.northEastCorner.longitude
-               + ") must be greater than southWestCorner.getLongitude(" +  self.southWestCorner.longitude + ").")
+            raise ValueError(f"northEastCorner.getLongitude ({self.northEastCorner.longitude}) must be greater than "
+                             f"southWestCorner.getLongitude({self.southWestCorner.longitude}).")
 
         name = "demo"
 
-        random = Random(0)
-        id_sequence = [0]
-
-        def generate_id():
-            out = id_sequence[0]
-            id_sequence[0] = out + 1
-            return out
-
-        generate_latitude = lambda: random.uniform(self.southWestCorner.latitude, self.northEastCorner.latitude)
-        generate_longitude = lambda: random.uniform(self.southWestCorner.longitude, self.northEastCorner.longitude)
-
-        generate_demand = lambda: random.randint(self.minDemand, self.maxDemand)
-
-        depot_list = []
-        random_depot = lambda: random.choice(depot_list)
-
-        generate_depot = lambda: Depot(
-            generate_id(),
-            Location(generate_id(), generate_latitude(), generate_longitude()))
-
-        for i in range(self.depotCount):
-            depot_list.append(generate_depot())
-
-        generate_vehicle = lambda: Vehicle(
-            generate_id(),
-            self.vehicleCapacity,
-            random_depot())
-
-        vehicle_list = []
-        for i in range(self.vehicleCount):
-            vehicle_list.append(generate_vehicle())
-
-        generate_customer = lambda: Customer(
-            generate_id(),
-            Location(generate_id(), generate_latitude(), generate_longitude()),
-            generate_demand())
-
-        customer_list = []
-        for i in range(self.customerCount):
-            customer_list.append(generate_customer())
+        # Coordinates and demands are sampled as whole arrays; only the domain objects are created one by one
+        random = np.random.default_rng(self.seed)
+        id_sequence = itertools.count()
+        depot_latitudes, depot_longitudes = sample_coordinates(random, self.depotCount, self.southWestCorner,
+                                                               self.northEastCorner)
+        depot_list = [Depot(next(id_sequence), Location(next(id_sequence), latitude, longitude))
+                      for latitude, longitude in zip(depot_latitudes.tolist(), depot_longitudes.tolist())]
+
+        vehicle_depots = random.integers(0, self.depotCount, self.vehicleCount)
+        vehicle_list = [Vehicle(next(id_sequence), self.vehicleCapacity, depot_list[depot_index])
+                        for depot_index in vehicle_depots.tolist()]
+
+        latitudes, longitudes = sample_coordinates(random, self.customerCount, self.southWestCorner,
+                                                   self.northEastCorner, self.distribution, self.cluster_count)
+        demands = sample_demands(random, self.customerCount, self.minDemand, self.maxDemand)
+        customer_list = [Customer(next(id_sequence), Location(next(id_sequence), latitude, longitude), demand)
+                         for latitude, longitude, demand in zip(latitudes.tolist(), longitudes.tolist(),
+                                                                demands.tolist())]
 
         location_list = []
         for customer in customer_list:
@@ -286,7 +578,8 @@ class DemoDataBuilder:
         for depot in depot_list:
             location_list.append(depot.location)
 
-        self.distance_calculator.init_distance_maps(location_list)
+        self.distance_calculator.init_distance_maps(location_list, [depot.location for depot in depot_list])
+        self.distance_calculator.init_nearby_maps(location_list, self.nearby_count)
 
         return VehicleRoutingSolution(name, location_list,
                                       depot_list, vehicle_list, customer_list, self.southWestCorner,
@@ -307,11 +600,12 @@ class VehicleRoutingSolution:
         self.score = score
 
     @staticmethod
-    def empty():
+    def empty(distance_matrix_cache=None):
         problem = DemoDataBuilder.builder().set_min_demand(1).set_max_demand(2).set_vehicle_capacity(25) \
                                  .set_customer_count(77).set_vehicle_count(6).set_depot_count(2) \
                                  .set_south_west_corner(Location(0, 43.751466, 11.177210)) \
-                                 .set_north_east_corner(Location(0, 43.809291, 11.290195)).build()
+                                 .set_north_east_corner(Location(0, 43.809291, 11.290195)) \
+                                 .set_distance_matrix_cache(distance_matrix_cache).build()
         problem.set_score(HardSoftScore.ZERO)
         return problem
 
@@ -347,12 +641,26 @@ class VehicleRoutingSolution:
         return -self.score.getSoftScore() if self.score is not None else 0
 
     def to_dict(self):
+        """
+        Normalized wire format: every location is sent once, in locationList, and is referred to by its index there.
+        Depots and customers are likewise referred to by their index in depotList and customerList, so a route is
+        just an array of customer indices. Customers are sent column by column, to avoid repeating keys.
+        """
+        location_index_map = {location.id: index for index, location in enumerate(self.location_list)}
+        depot_index_map = {depot.id: index for index, depot in enumerate(self.depot_list)}
+        customer_index_map = {customer.id: index for index, customer in enumerate(self.customer_list)}
         return {
             'name': self.name,
             'bounds': list(map(lambda location: location.to_dict(), self.get_bounds())),
-            'vehicleList': list(map(lambda vehicle: vehicle.to_dict(), self.vehicle_list)),
-            'depotList': list(map(lambda depot: depot.to_dict(), self.depot_list)),
-            'customerList': list(map(lambda customer: customer.to_dict(), self.customer_list)),
+            'locationList': list(map(lambda location: location.to_dict(), self.location_list)),
+            'vehicleList': list(map(lambda vehicle: vehicle.to_dict(depot_index_map, customer_index_map),
+                                    self.vehicle_list)),
+            'depotList': list(map(lambda depot: depot.to_dict(location_index_map), self.depot_list)),
+            'customerList': {
+                'id': [customer.id for customer in self.customer_list],
+                'location': [location_index_map[customer.location.id] for customer in self.customer_list],
+                'demand': [customer.demand for customer in self.customer_list],
+            },
             'score': str(self.score),
             'distanceMeters': self.get_distance_meters(),
         }
@@ -0,0 +1,53 @@
+import numpy as np
+
+UNIFORM_DISTRIBUTION = 'uniform'
+CLUSTERED_DISTRIBUTION = 'clustered'
+# Half of the customers spread uniformly, the other half in clusters
+MIXED_DISTRIBUTION = 'mixed'
+DISTRIBUTIONS = (UNIFORM_DISTRIBUTION, CLUSTERED_DISTRIBUTION, MIXED_DISTRIBUTION)
+
+# Standard deviation of a cluster, as a fraction of the width (or height) of the area
+CLUSTER_SPREAD = 0.04
+
+
+def sample_uniform(random, count, south_west_corner, north_east_corner):
+    latitudes = random.uniform(south_west_corner.latitude, north_east_corner.latitude, count)
+    longitudes = random.uniform(south_west_corner.longitude, north_east_corner.longitude, count)
+    return latitudes, longitudes
+
+
+def sample_clustered(random, count, south_west_corner, north_east_corner, cluster_count):
+    """Normally distributed around cluster_count uniformly placed centers, of random relative sizes."""
+    center_latitudes, center_longitudes = sample_uniform(random, cluster_count, south_west_corner, north_east_corner)
+    cluster_weights = random.uniform(0.5, 1.5, cluster_count)
+    clusters = random.choice(cluster_count, count, p=cluster_weights / cluster_weights.sum())
+    latitude_spread = (north_east_corner.latitude - south_west_corner.latitude) * CLUSTER_SPREAD
+    longitude_spread = (north_east_corner.longitude - south_west_corner.longitude) * CLUSTER_SPREAD
+    latitudes = np.clip(random.normal(center_latitudes[clusters], latitude_spread),
+                        south_west_corner.latitude, north_east_corner.latitude)
+    longitudes = np.clip(random.normal(center_longitudes[clusters], longitude_spread),
+                         south_west_corner.longitude, north_east_corner.longitude)
+    return latitudes, longitudes
+
+
+def sample_coordinates(random, count, south_west_corner, north_east_corner, distribution=UNIFORM_DISTRIBUTION,
+                       cluster_count=8):
+    """
+    Samples count (latitude, longitude) pairs within the corners, as two arrays, from the numpy Generator random.
+    The same generator state always gives the same coordinates.
+    """
+    if distribution == UNIFORM_DISTRIBUTION:
+        return sample_uniform(random, count, south_west_corner, north_east_corner)
+    if distribution == CLUSTERED_DISTRIBUTION:
+        return sample_clustered(random, count, south_west_corner, north_east_corner, cluster_count)
+    if distribution == MIXED_DISTRIBUTION:
+        latitudes, longitudes = sample_clustered(random, count, south_west_corner, north_east_corner, cluster_count)
+        uniform_latitudes, uniform_longitudes = sample_uniform(random, count, south_west_corner, north_east_corner)
+        is_uniform = random.random(count) < 0.5
+        return np.where(is_uniform, uniform_latitudes, latitudes), np.where(is_uniform, uniform_longitudes, longitudes)
+    raise ValueError(f'Unknown distribution ({distribution}), expected one of {", ".join(DISTRIBUTIONS)}.')
+
+
+def sample_demands(random, count, min_demand, max_demand):
+    # Both bounds included, like random.randint
+    return random.integers(min_demand, max_demand, count, endpoint=True)
@@ -1,74 +1,492 @@
-from domain import Vehicle, VehicleRoutingSolution
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from domain import VehicleRoutingSolution, NO_DUE_TIME
+from distance_cache import DistanceMatrixCache
+from construction import build_sweep_routes
+from decomposition import solve_partitions, apply_routes
+from solver_config import create_solver_config
+from checkpoint import CheckpointWriter, solution_to_checkpoint, solution_from_checkpoint
+from viewport import Viewport, SolutionView
+from dispatch import ImmediateProblemChangeDirector, AddCustomerProblemChange, RemoveCustomerProblemChange, \
+    PinServedCustomersProblemChange, ChangeVehicleCapacityProblemChange, find_customer, find_vehicle, \
+    create_customer
 from optapy import solver_manager_create, score_manager_create
-import optapy.config
 from optapy.types import Duration
 from optapy.score import HardSoftScore
-from constraints import vehicle_routing_constraints
-from flask import Flask, jsonify
-from org.optaplanner.core.api.solver import SolverStatus
+from flask import Flask, Response, request
+from java.lang import IllegalStateException
+from java.lang.management import ManagementFactory
+from org.optaplanner.core.config.solver import SolverManagerConfig
 
 app = Flask(__name__)
 
-SINGLETON_ID = 1
-solver_config = optapy.config.solver.SolverConfig()
-solver_config \
-    .withSolutionClass(VehicleRoutingSolution) \
-    .withEntityClasses(Vehicle) \
-    .withConstraintProviderClass(vehicle_routing_constraints) \
-    .withTerminationSpentLimit(Duration.ofSeconds(30))
 
-solver_manager = solver_manager_create(solver_config)
-score_manager = score_manager_create(solver_manager)
+DEFAULT_PROBLEM_ID = 1
+# Jobs beyond this many wait in a queue, so tenants share the CPU cores instead of oversubscribing them. The solver
+# manager runs no more solvers at once than its parallel solver count (half the cores), so that caps it too: a job
+# started beyond it would sit in the solver manager's own queue, counted as solving
+MAX_CONCURRENT_JOBS = min(int(os.environ.get('VRP_MAX_CONCURRENT_JOBS', os.cpu_count() or 1)),
+                          SolverManagerConfig().resolveParallelSolverCount())
+# Problems with at least this many customers are first solved as sub-problems in parallel worker processes,
+# split by nearest depot ('depot') or by angular sectors around the depots ('sector'); unset disables decomposition
+DECOMPOSITION_MODE = os.environ.get('VRP_DECOMPOSITION')
+DECOMPOSITION_MIN_CUSTOMER_COUNT = int(os.environ.get('VRP_DECOMPOSITION_MIN_CUSTOMERS', 5000))
+DECOMPOSITION_WORKER_COUNT = int(os.environ.get('VRP_DECOMPOSITION_WORKERS', os.cpu_count() or 1))
+DECOMPOSITION_SECONDS = int(os.environ.get('VRP_DECOMPOSITION_SECONDS', 20))
+# Every problem is checkpointed there at most this often, and a restarted service resumes solving from its checkpoints
+CHECKPOINT_DIRECTORY = os.environ.get('VRP_CHECKPOINT_DIRECTORY',
+                                      os.path.join(tempfile.gettempdir(), 'optapy-vehicle-routing-checkpoints'))
+CHECKPOINT_SECONDS = int(os.environ.get('VRP_CHECKPOINT_SECONDS', 10))
+
+# Building the solver manager compiles the domain and the constraints, so it is deferred to get_solver_manager,
+# which the warm-up thread calls right after startup
+solver_manager = None
+score_manager = None
+solver_manager_lock = threading.Lock()
+# Seconds spent in every startup step, reported by /vrp/ready
+startup_timing_map = dict()
+# Set once the solver manager and the default problem are built, so the first requests do not wait for them
+service_ready = threading.Event()
+# What made warming up fail, if it did, reported by /vrp/ready
+startup_error = None
 last_score = HardSoftScore.ZERO
 
-vehicle_routing_solution = VehicleRoutingSolution.empty()
+distance_matrix_cache = DistanceMatrixCache(os.path.join(tempfile.gettempdir(), 'optapy-vehicle-routing-distances'))
+# Written from the registry on a background thread, so saving a best solution never waits for the disk
+checkpoint_writer = CheckpointWriter(CHECKPOINT_DIRECTORY, lambda problem_id: get_checkpoint(problem_id),
+                                     CHECKPOINT_SECONDS)
+
+# Latest (best) solution of every problem, by problem id
+problem_registry = dict()
+# Number of solutions saved so far for every problem, so derived data can tell whether it is stale
+problem_version_map = dict()
+# Score explanation summary of every problem, with the problem version it was computed for
+score_explanation_cache = dict()
+# Serialized status of every problem, with the status key it was built for
+status_payload_cache = dict()
+# What every viewport of a problem is cut from, with the problem version it was built for
+solution_view_cache = dict()
+# Guards problem_registry and the job bookkeeping below; reentrant since finishing a job starts the next one
+job_lock = threading.RLock()
+# The solver job of every problem being solved, by problem id
+active_job_map = dict()
+waiting_problem_id_queue = deque()
+# Ids handed out to the customers (and their locations) added to every problem while it is dispatched
+id_sequence_map = dict()
+# Notified whenever the solution or the solving state of a problem changes, to wake up the event streams
+status_changed = threading.Condition(job_lock)
+# A status stream with nothing new to send writes a keep-alive comment after this many seconds; writing to a viewer
+# that has gone away fails, which ends the stream instead of leaving it waiting for the next solution
+STATUS_KEEP_ALIVE_SECONDS = 15
 
 
 class Status:
-    def __init__(self, solution, score_explanation, is_solving):
-        self.solution = solution
+    def __init__(self, solution_dict, score_explanation, is_solving, is_queued):
+        self.solution_dict = solution_dict
         self.score_explanation = score_explanation
         self.is_solving = is_solving
+        self.is_queued = is_queued
 
     def to_dict(self):
         return {
-            'solution': self.solution.to_dict(),
+            'solution': self.solution_dict,
             'scoreExplanation': self.score_explanation,
-            'isSolving': self.is_solving
+            'isSolving': self.is_solving,
+            'isQueued': self.is_queued
         }
 
 
-@app.route('/vrp/status', methods=['GET'])
-def get_solver_status():
-    global vehicle_routing_solution
-    return jsonify(Status(vehicle_routing_solution, score_manager.explainScore(vehicle_routing_solution).getSummary(),
-                   solver_manager.getSolverStatus(SINGLETON_ID) != SolverStatus.NOT_SOLVING).to_dict())
+def get_startup_seconds():
+    # Startup is measured from the start of the JVM, which the domain import does first of all
+    return ManagementFactory.getRuntimeMXBean().getUptime() / 1000
+
+
+def get_solver_manager():
+    global solver_manager, score_manager
+    with solver_manager_lock:
+        if solver_manager is None:
+            start = time.perf_counter()
+            solver_manager = solver_manager_create(create_solver_config(Duration.ofSeconds(30)))
+            score_manager = score_manager_create(solver_manager)
+            startup_timing_map['solverManagerSeconds'] = time.perf_counter() - start
+        return solver_manager
+
+
+def get_score_manager():
+    get_solver_manager()
+    return score_manager
+
+
+def warm_up():
+    global startup_error
+    try:
+        get_solver_manager()
+        start = time.perf_counter()
+        if find_by_id(DEFAULT_PROBLEM_ID) is None:
+            create_demo_problem(DEFAULT_PROBLEM_ID)
+        startup_timing_map['defaultProblemSeconds'] = time.perf_counter() - start
+        # The first score explanation builds a score director, which the first status request would otherwise wait for
+        start = time.perf_counter()
+        get_status_payload(DEFAULT_PROBLEM_ID)
+        startup_timing_map['firstStatusSeconds'] = time.perf_counter() - start
+        resume_checkpointed_jobs()
+    except Exception as exception:
+        # The service is never marked ready then, and /vrp/ready tells why instead of looking like it is still warming
+        startup_error = f'{type(exception).__name__}: {exception}'
+        print('vehicle routing service failed to start:')
+        traceback.print_exc()
+        return
+    startup_timing_map['readySeconds'] = get_startup_seconds()
+    service_ready.set()
+    print('vehicle routing service ready: ' +
+          ', '.join(f'{step} {seconds:.2f}' for step, seconds in startup_timing_map.items()))
+
+
+def resume_checkpointed_jobs():
+    # The problems that were being solved (or waiting to be) when the service stopped are solved again from their
+    # checkpoint; the others are only restored when first asked for
+    for problem_id in checkpoint_writer.get_problem_id_list():
+        checkpoint = checkpoint_writer.load(problem_id)
+        if checkpoint is not None and checkpoint['solving']:
+            with job_lock:
+                is_restored = problem_id in problem_registry
+            if not is_restored:
+                restore_checkpoint(problem_id, checkpoint)
+            solve(problem_id)
+
+
+def get_checkpoint(problem_id):
+    with job_lock:
+        return {
+            'solving': problem_id in active_job_map or problem_id in waiting_problem_id_queue,
+            'solution': solution_to_checkpoint(find_by_id(problem_id)),
+        }
+
+
+@app.route('/vrp/ready', methods=['GET'])
+def get_readiness():
+    # 503 while warming up, so a load balancer only routes to the service once it answers without delay
+    readiness = {'ready': service_ready.is_set(), 'startupSeconds': dict(startup_timing_map)}
+    if startup_error is not None:
+        readiness['error'] = startup_error
+    return readiness, 200 if service_ready.is_set() else 503
+
+
+@app.route('/vrp/<int:problem_id>', methods=['POST'])
+def create_problem(problem_id):
+    if not create_demo_problem(problem_id):
+        return {'message': f'Problem {problem_id} already exists.'}, 409
+    return dict(), 201
+
+
+def create_demo_problem(problem_id):
+    """Registers a new demo problem under problem_id, unless it already exists. Returns whether it was created."""
+    if find_by_id(problem_id) is not None:
+        return False
+    # Generating the problem builds its distance matrix, so it is done without holding the lock
+    solution = VehicleRoutingSolution.empty(distance_matrix_cache)
+    with job_lock:
+        if problem_id in problem_registry:
+            return False
+        save(problem_id, solution)
+    return True
+
+
+def problem_not_found(problem_id):
+    return {'message': f'No problem with id {problem_id}.'}, 404
+
+
+def bad_request(message):
+    return {'message': message}, 400
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+@app.route('/vrp/status', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/status', methods=['GET'])
+def get_solver_status(problem_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    # With south, west, north, east and zoom query parameters, only what that map viewport shows
+    _, payload = get_status_payload(problem_id, Viewport.from_args(request.args))
+    return Response(payload, mimetype='application/json')
+
+
+@app.route('/vrp/events', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/events', methods=['GET'])
+def stream_solver_status(problem_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    viewport = Viewport.from_args(request.args)
+
+    def generate_events():
+        last_status_key = None
+        while True:
+            with status_changed:
+                status_changed.wait_for(lambda: get_status_key(problem_id) != last_status_key,
+                                        STATUS_KEEP_ALIVE_SECONDS)
+            status_key, payload = get_status_payload(problem_id, viewport)
+            if status_key == last_status_key:
+                yield ': keep-alive\n\n'
+            else:
+                last_status_key = status_key
+                yield f'data: {payload}\n\n'
+
+    return Response(generate_events(), mimetype='text/event-stream')
+
+
+def get_status_key(problem_id):
+    with job_lock:
+        return (problem_version_map.get(problem_id, 0), problem_id in active_job_map,
+                problem_id in waiting_problem_id_queue)
+
+
+def get_status_payload(problem_id, viewport=None):
+    # The whole problem is serialized once per change, however many viewers poll or stream it;
+    # a viewport is cut from a view of the solution that is also built once per change
+    with job_lock:
+        solution = find_by_id(problem_id)
+        status_key = get_status_key(problem_id)
+    if viewport is not None:
+        solution_view = get_solution_view(problem_id, solution, status_key[0])
+        return status_key, serialize_status(problem_id, solution, status_key, solution_view.to_dict(viewport))
+    cached_status_key, payload = status_payload_cache.get(problem_id, (None, None))
+    if cached_status_key != status_key:
+        payload = serialize_status(problem_id, solution, status_key, solution.to_dict())
+        status_payload_cache[problem_id] = (status_key, payload)
+    return status_key, payload
+
+
+def serialize_status(problem_id, solution, status_key, solution_dict):
+    version, is_active, is_queued = status_key
+    return json.dumps(Status(solution_dict, get_score_explanation(problem_id, solution, version),
+                             is_active or is_queued, is_queued).to_dict(), separators=(',', ':'))
+
+
+def get_solution_view(problem_id, solution, version):
+    cached_version, solution_view = solution_view_cache.get(problem_id, (None, None))
+    if cached_version != version:
+        solution_view = SolutionView(solution)
+        solution_view_cache[problem_id] = (version, solution_view)
+    return solution_view
+
+
+def get_score_explanation(problem_id, solution, version):
+    # A change of solving state alone keeps the solution, so only explain a solution the first time it is seen
+    cached_version, summary = score_explanation_cache.get(problem_id, (None, None))
+    if cached_version != version:
+        summary = get_score_manager().explainScore(solution).getSummary()
+        score_explanation_cache[problem_id] = (version, summary)
+    return summary
 
 
 def error_handler(problem_id, exception):
     print(f'an exception occurred solving {problem_id}: {exception.getMessage()}')
     exception.printStackTrace()
+    finish_job(problem_id)
+
+
+@app.route('/vrp/solve', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/solve', methods=['POST'])
+def solve(problem_id):
+    # Built (if the warm-up has not done it yet) before taking the lock, so other requests do not wait for it
+    get_solver_manager()
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        if problem_id in active_job_map or problem_id in waiting_problem_id_queue:
+            return dict()
+        if len(active_job_map) < MAX_CONCURRENT_JOBS:
+            start_job(problem_id)
+        else:
+            waiting_problem_id_queue.append(problem_id)
+        checkpoint_writer.mark_changed(problem_id)
+        status_changed.notify_all()
+    return dict()
+
+
+@app.route('/vrp/stopSolving', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/stopSolving', methods=['POST'])
+def stop_solving(problem_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        if problem_id in waiting_problem_id_queue:
+            waiting_problem_id_queue.remove(problem_id)
+            checkpoint_writer.mark_changed(problem_id)
+            status_changed.notify_all()
+            return dict()
+    get_solver_manager().terminateEarly(problem_id)
+    return dict()
+
 
+@app.route('/vrp/customers', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers', methods=['POST'])
+def add_customer(problem_id):
+    customer_json = request.get_json()
+    if not isinstance(customer_json, dict) or not is_number(customer_json.get('latitude')) \
+            or not is_number(customer_json.get('longitude')) or not isinstance(customer_json.get('demand'), int) \
+            or isinstance(customer_json['demand'], bool) or customer_json['demand'] < 1 \
+            or not all(isinstance(customer_json.get(name, 0), int)
+                       for name in ('readyTime', 'dueTime', 'serviceDuration')):
+        return bad_request('A customer needs a latitude, a longitude and a positive demand; '
+                           'readyTime, dueTime and serviceDuration are whole seconds.')
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        solution = find_by_id(problem_id)
+        if problem_id not in id_sequence_map:
+            id_sequence_map[problem_id] = itertools.count(
+                max(item.id for item in itertools.chain(solution.location_list, solution.customer_list)) + 1)
+        id_sequence = id_sequence_map[problem_id]
+        customer = create_customer(next(id_sequence), next(id_sequence), customer_json['latitude'],
+                                   customer_json['longitude'], customer_json['demand'],
+                                   customer_json.get('readyTime', 0),
+                                   customer_json.get('dueTime', NO_DUE_TIME),
+                                   customer_json.get('serviceDuration', 0))
+    submit_problem_change(problem_id, AddCustomerProblemChange(customer))
+    return {'id': customer.id}
 
-@app.route('/vrp/solve', methods=['POST'])
-def solve():
-    solver_manager.solveAndListen(SINGLETON_ID, find_by_id, save, error_handler)
+
+@app.route('/vrp/customers/<int:customer_id>', methods=['DELETE'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers/<int:customer_id>', methods=['DELETE'])
+def remove_customer(problem_id, customer_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        solution = find_by_id(problem_id)
+        if find_customer(solution, customer_id) is None:
+            return {'message': f'No customer with id {customer_id}.'}, 404
+    change = RemoveCustomerProblemChange(customer_id)
+    submit_problem_change(problem_id, change)
+    if not change.removed:
+        return {'message': f'Customer {customer_id} is served already.'}, 409
+    return dict()
+
+
+@app.route('/vrp/vehicles/<int:vehicle_id>/served', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/vehicles/<int:vehicle_id>/served', methods=['POST'])
+def pin_served_customers(problem_id, vehicle_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        solution = find_by_id(problem_id)
+        if find_vehicle(solution, vehicle_id) is None:
+            return {'message': f'No vehicle with id {vehicle_id}.'}, 404
+    submit_problem_change(problem_id, PinServedCustomersProblemChange(vehicle_id, request.get_json()['customerIdList']))
     return dict()
 
 
-@app.route('/vrp/stopSolving', methods=['POST'])
-def stop_solving():
-    solver_manager.terminateEarly(SINGLETON_ID)
+@app.route('/vrp/vehicles/<int:vehicle_id>/capacity', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/vehicles/<int:vehicle_id>/capacity', methods=['POST'])
+def change_vehicle_capacity(problem_id, vehicle_id):
+    if find_by_id(problem_id) is None:
+        return problem_not_found(problem_id)
+    with job_lock:
+        solution = find_by_id(problem_id)
+        if find_vehicle(solution, vehicle_id) is None:
+            return {'message': f'No vehicle with id {vehicle_id}.'}, 404
+    submit_problem_change(problem_id, ChangeVehicleCapacityProblemChange(vehicle_id, request.get_json()['capacity']))
     return dict()
 
 
-def find_by_id(schedule_id):
-    global vehicle_routing_solution
-    if schedule_id != SINGLETON_ID:
-        raise ValueError(f'There is no schedule with id ({schedule_id})')
-    return vehicle_routing_solution
+def submit_problem_change(problem_id, change):
+    """
+    Gives a problem being solved the change between two solver steps, so the solver keeps its working solution,
+    and changes a queued or idle one straight away. Returns once the change is in the saved solution.
+    """
+    with job_lock:
+        solver_job = active_job_map.get(problem_id)
+        if solver_job is None:
+            solution = find_by_id(problem_id)
+            change.apply(solution, ImmediateProblemChangeDirector())
+            save(problem_id, solution)
+            return
+    try:
+        # Without the lock, which saving the best solution with the change takes
+        solver_job.addProblemChange(change).get()
+    except IllegalStateException:
+        # The job ended before it got to the change (which cancels it): the change goes to the final solution once
+        # that is saved, or to the next job of the problem
+        with status_changed:
+            status_changed.wait_for(lambda: active_job_map.get(problem_id) is not solver_job)
+        submit_problem_change(problem_id, change)
+
+
+def start_job(problem_id):
+    # Only called with job_lock held, once solve has built the solver manager
+    active_job_map[problem_id] = solver_manager.solveAndListen(
+        problem_id, find_warm_started_by_id, lambda solution: save(problem_id, solution),
+        final_best_solution_consumer=lambda solution: finish_job(problem_id, solution),
+        exception_handler=error_handler)
+
+
+def finish_job(problem_id, solution=None):
+    with job_lock:
+        if solution is not None:
+            save(problem_id, solution)
+        active_job_map.pop(problem_id, None)
+        checkpoint_writer.mark_changed(problem_id)
+        while waiting_problem_id_queue and len(active_job_map) < MAX_CONCURRENT_JOBS:
+            start_job(waiting_problem_id_queue.popleft())
+        status_changed.notify_all()
+
+
+def find_by_id(problem_id):
+    # None for a problem that was neither created (by create_problem) nor checkpointed. Restoring a checkpoint rebuilds
+    # its distance matrix, which is done without holding job_lock, so requests call this before they take the lock
+    with job_lock:
+        solution = problem_registry.get(problem_id)
+    if solution is not None:
+        return solution
+    checkpoint = checkpoint_writer.load(problem_id)
+    if checkpoint is None:
+        return None
+    return restore_checkpoint(problem_id, checkpoint)
+
+
+def restore_checkpoint(problem_id, checkpoint):
+    solution = solution_from_checkpoint(checkpoint['solution'], distance_matrix_cache)
+    with job_lock:
+        # Whoever restored (or created) the problem first wins, so every request sees the same solution
+        return problem_registry.setdefault(problem_id, solution)
+
+
+def find_warm_started_by_id(problem_id):
+    # A problem without any route starts from sweep routes, so local search starts from a feasible solution
+    # instead of spending the first seconds in the construction heuristic.
+    # A large one is first solved as sub-problems in parallel, and the solve that follows polishes the merged routes.
+    with job_lock:
+        solution = find_by_id(problem_id)
+        if any(vehicle.customer_list for vehicle in solution.vehicle_list):
+            return solution
+        if DECOMPOSITION_MODE is None or len(solution.customer_list) < DECOMPOSITION_MIN_CUSTOMER_COUNT:
+            build_sweep_routes(solution)
+            save(problem_id, solution)
+            return solution
+    # The workers take a while, so the problem stays readable meanwhile; only merging their routes needs the lock
+    route_map = solve_partitions(solution, DECOMPOSITION_MODE, DECOMPOSITION_WORKER_COUNT, DECOMPOSITION_SECONDS)
+    with job_lock:
+        apply_routes(solution, route_map)
+        save(problem_id, solution)
+    return solution
+
+
+def save(problem_id, solution):
+    with job_lock:
+        problem_registry[problem_id] = solution
+        problem_version_map[problem_id] = problem_version_map.get(problem_id, 0) + 1
+        checkpoint_writer.mark_changed(problem_id)
+        status_changed.notify_all()
 
 
-def save(solution):
-    global vehicle_routing_solution
-    vehicle_routing_solution = solution
+startup_timing_map['importSeconds'] = get_startup_seconds()
+threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
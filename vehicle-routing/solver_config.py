@@ -0,0 +1,95 @@
+from domain import Vehicle, VehicleRoutingSolution, NEARBY_COUNT
+from constraints import vehicle_routing_constraints
+from optapy.jpype_type_conversions import PythonSupplier
+import optapy.config
+from java.util import ArrayList
+from java.util.function import Supplier
+from jpype import JObject
+from jpyinterpreter.python_to_java_bytecode_translator import translate_python_bytecode_to_java_bytecode
+from org.optaplanner.core.config.constructionheuristic import ConstructionHeuristicPhaseConfig
+from org.optaplanner.core.config.heuristic.selector.common.nearby import NearbySelectionConfig, \
+    NearbySelectionDistributionType
+from org.optaplanner.core.config.heuristic.selector.list import DestinationSelectorConfig
+from org.optaplanner.core.config.heuristic.selector.move.composite import UnionMoveSelectorConfig
+from org.optaplanner.core.config.heuristic.selector.move.generic.list import ListChangeMoveSelectorConfig, \
+    ListSwapMoveSelectorConfig
+from org.optaplanner.core.config.heuristic.selector.value import ValueSelectorConfig
+from org.optaplanner.core.config.localsearch import LocalSearchPhaseConfig
+from org.optaplanner.core.impl.heuristic.selector.common.decorator import SelectionFilter
+from org.optaplanner.core.impl.heuristic.selector.common.nearby import NearbyDistanceMeter
+from org.optaplanner.optapy import PythonWrapperGenerator
+
+
+def get_nearby_distance(origin, destination):
+    # The destination is either a customer to insert after, or a vehicle whose route the origin would start
+    if isinstance(destination, Vehicle):
+        return float(origin.location.get_nearby_distance(destination.depot.location))
+    return float(origin.location.get_nearby_distance(destination.location))
+
+
+# The meter is translated to Java bytecode, so building the nearby distance matrix never calls back into CPython.
+# OptaPlanner instantiates the meter class itself, hence the wrapper class with a no-arg constructor.
+nearby_distance_meter = translate_python_bytecode_to_java_bytecode(get_nearby_distance, NearbyDistanceMeter)
+nearby_distance_meter_class = PythonWrapperGenerator.defineWrapperClass(
+    'org.optaplanner.optapy.quickstarts.vrp.NearbyDistanceMeter', NearbyDistanceMeter,
+    JObject(PythonSupplier(lambda: nearby_distance_meter), Supplier))
+
+
+def is_list_change_movable(score_director, move):
+    return move.getSourceIndex() >= move.getSourceEntity().pinned_count and \
+        move.getDestinationIndex() >= move.getDestinationEntity().pinned_count
+
+
+def is_list_swap_movable(score_director, move):
+    return move.getLeftIndex() >= move.getLeftEntity().pinned_count and \
+        move.getRightIndex() >= move.getRightEntity().pinned_count
+
+
+def define_translated_class(name, java_interface, function):
+    # Like the meter, the pinning filters run for every selected move, so they are translated as well
+    translated_function = translate_python_bytecode_to_java_bytecode(function, java_interface)
+    return PythonWrapperGenerator.defineWrapperClass(name, java_interface,
+                                                     JObject(PythonSupplier(lambda: translated_function), Supplier))
+
+
+# The solver never moves the pinned (already served) head of a route: OptaPlanner cannot pin part of a list
+# variable itself, so the moves that would take a customer out of it, or put one into it, are filtered out
+list_change_filter_class = define_translated_class('org.optaplanner.optapy.quickstarts.vrp.ListChangeFilter',
+                                                   SelectionFilter, is_list_change_movable)
+list_swap_filter_class = define_translated_class('org.optaplanner.optapy.quickstarts.vrp.ListSwapFilter',
+                                                 SelectionFilter, is_list_swap_movable)
+
+
+def nearby_selection(origin_selector_id):
+    """Restricts a selector to the NEARBY_COUNT customers (or depots) closest to the mimicked origin customer."""
+    return NearbySelectionConfig() \
+        .withOriginValueSelectorConfig(ValueSelectorConfig().withMimicSelectorRef(origin_selector_id)) \
+        .withNearbyDistanceMeterClass(nearby_distance_meter_class) \
+        .withNearbySelectionDistributionType(NearbySelectionDistributionType.BLOCK_DISTRIBUTION) \
+        .withBlockDistributionSizeMaximum(NEARBY_COUNT)
+
+
+move_selector_list = ArrayList()
+move_selector_list.add(ListChangeMoveSelectorConfig()
+                       .withFilterClass(list_change_filter_class)
+                       .withValueSelectorConfig(ValueSelectorConfig().withId('changedCustomer'))
+                       .withDestinationSelectorConfig(
+                           DestinationSelectorConfig().withNearbySelectionConfig(nearby_selection('changedCustomer'))))
+move_selector_list.add(ListSwapMoveSelectorConfig()
+                       .withFilterClass(list_swap_filter_class)
+                       .withValueSelectorConfig(ValueSelectorConfig().withId('swappedCustomer'))
+                       .withSecondaryValueSelectorConfig(
+                           ValueSelectorConfig().withNearbySelectionConfig(nearby_selection('swappedCustomer'))))
+
+
+def create_solver_config(spent_limit):
+    """Solver configuration shared by the web service and the decomposition workers."""
+    solver_config = optapy.config.solver.SolverConfig()
+    solver_config \
+        .withSolutionClass(VehicleRoutingSolution) \
+        .withEntityClasses(Vehicle) \
+        .withConstraintProviderClass(vehicle_routing_constraints) \
+        .withTerminationSpentLimit(spent_limit) \
+        .withPhases(ConstructionHeuristicPhaseConfig(),
+                    LocalSearchPhaseConfig().withMoveSelectorConfig(UnionMoveSelectorConfig(move_selector_list)))
+    return solver_config
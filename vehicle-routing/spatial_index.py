@@ -0,0 +1,78 @@
+import math
+import numpy as np
+
+
+class SpatialIndex:
+    """
+    Uniform grid over latitude/longitude that answers k-nearest-neighbour queries without comparing every pair
+    of points. Points sharing a cell are resolved together against the surrounding ring of cells, which is widened
+    until every point's k-th neighbour is closer than anything outside the ring could be.
+    """
+    POINTS_PER_CELL = 8
+
+    def __init__(self, latitudes, longitudes):
+        self.coordinates = np.column_stack((np.asarray(latitudes, dtype=np.float64),
+                                            np.asarray(longitudes, dtype=np.float64)))
+        point_count = len(self.coordinates)
+        self.origin = self.coordinates.min(axis=0) if point_count else np.zeros(2)
+        span = self.coordinates.max(axis=0) - self.origin if point_count else np.zeros(2)
+        area = max(span[0], 1e-9) * max(span[1], 1e-9)
+        self.cell_size = max(math.sqrt(area * SpatialIndex.POINTS_PER_CELL / max(point_count, 1)), 1e-9)
+        self.row_count, self.column_count = (np.floor(span / self.cell_size).astype(np.int64) + 1)
+
+        cells = np.floor((self.coordinates - self.origin) / self.cell_size).astype(np.int64)
+        self.cell_keys = cells[:, 0] * self.column_count + cells[:, 1]
+        self.order = np.argsort(self.cell_keys, kind='stable')
+        self.cell_starts = np.searchsorted(self.cell_keys[self.order],
+                                           np.arange(self.row_count * self.column_count + 1))
+
+    @staticmethod
+    def of_locations(location_list):
+        return SpatialIndex([location.latitude for location in location_list],
+                            [location.longitude for location in location_list])
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def _get_ring_points(self, row, column, radius):
+        first_column = max(column - radius, 0)
+        last_column = min(column + radius, self.column_count - 1)
+        slices = []
+        for ring_row in range(max(row - radius, 0), min(row + radius, self.row_count - 1) + 1):
+            key = ring_row * self.column_count
+            slices.append(self.order[self.cell_starts[key + first_column]:self.cell_starts[key + last_column + 1]])
+        return np.concatenate(slices)
+
+    def get_k_nearest(self, k):
+        """
+        Returns (indices, distances): for every point, its min(k, n - 1) nearest other points ordered by
+        increasing distance, with distances in degrees.
+        """
+        point_count = len(self)
+        k = min(k, point_count - 1)
+        nearest_indices = np.empty((point_count, max(k, 0)), dtype=np.int64)
+        nearest_distances = np.empty((point_count, max(k, 0)), dtype=np.float64)
+        if k <= 0:
+            return nearest_indices, nearest_distances
+
+        max_radius = max(self.row_count, self.column_count)
+        for key in np.unique(self.cell_keys):
+            members = self.order[self.cell_starts[key]:self.cell_starts[key + 1]]
+            row, column = divmod(int(key), self.column_count)
+            radius = 1
+            while True:
+                candidates = self._get_ring_points(row, column, radius)
+                if len(candidates) > k:
+                    deltas = self.coordinates[members, np.newaxis, :] - self.coordinates[np.newaxis, candidates, :]
+                    distances = np.sqrt(np.einsum('ijk,ijk->ij', deltas, deltas))
+                    distances[members[:, np.newaxis] == candidates[np.newaxis, :]] = np.inf
+                    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                    nearest_distance = np.take_along_axis(distances, nearest, axis=1)
+                    # Anything outside the ring is at least radius cells away from every member of the cell
+                    if radius >= max_radius or nearest_distance.max() <= radius * self.cell_size:
+                        ranking = np.argsort(nearest_distance, axis=1, kind='stable')
+                        nearest_indices[members] = candidates[np.take_along_axis(nearest, ranking, axis=1)]
+                        nearest_distances[members] = np.take_along_axis(nearest_distance, ranking, axis=1)
+                        break
+                radius += 1
+        return nearest_indices, nearest_distances
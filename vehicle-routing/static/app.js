@@ -16,8 +16,10 @@ const colors = [
     'slateblue',
     'tomato',
 ];
-let autoRefreshCount = 0;
-let autoRefreshIntervalId = null;
+let statusEventSource = null;
+
+// Each problem id is solved as a separate job; pick one with ?problemId=<id>
+const problemId = new URLSearchParams(window.location.search).get('problemId') ?? 1;
 
 let initialized = false;
 const depotByIdMap = new Map();
@@ -25,6 +27,7 @@ const customerByIdMap = new Map();
 
 const solveButton = $('#solveButton');
 const stopSolvingButton = $('#stopSolvingButton');
+const createProblemButton = $('#createProblemButton');
 const vehiclesTable = $('#vehicles');
 const depotsTable = $('#depots');
 
@@ -51,42 +54,89 @@ const fetchHeaders = {
 
 const formatDistance = (distanceInMeters) => `${Math.floor(distanceInMeters / 1000)}km ${distanceInMeters % 1000}m`;
 
-const getStatus = () => {
-    fetch('/vrp/status', fetchHeaders)
+// Set once the server is known to have the problem; until then there is no status to listen to
+let problemExists = false;
+
+const getViewport = () => {
+    const bounds = map.getBounds();
+    return new URLSearchParams({
+        south: bounds.getSouth(),
+        west: bounds.getWest(),
+        north: bounds.getNorth(),
+        east: bounds.getEast(),
+        zoom: map.getZoom(),
+    });
+};
+
+// The server pushes the status whenever a new best solution arrives or solving starts or stops.
+// It only sends what the map shows, so the stream is reopened whenever the map moves.
+const listenToStatus = () => {
+    if (!problemExists) {
+        return;
+    }
+    if (statusEventSource !== null) {
+        statusEventSource.close();
+    }
+    statusEventSource = new EventSource(`/vrp/${problemId}/events?${getViewport()}`);
+    statusEventSource.onmessage = (event) => showProblem(JSON.parse(event.data));
+};
+
+const showProblemFound = () => {
+    problemExists = true;
+    createProblemButton.hide();
+    updateSolvingStatus(false);
+    listenToStatus();
+};
+
+// A problem id the server does not know (a mistyped one, say) is only created when the user asks for it
+const loadProblem = () => {
+    fetch(`/vrp/${problemId}/status?${getViewport()}`, fetchHeaders)
             .then((response) => {
-                if (!response.ok) {
-                    return handleErrorResponse('Get status failed', response);
+                if (response.status === 404) {
+                    showError(`There is no problem with id ${problemId}.`, 'Create it to solve a new demo problem.');
+                    solveButton.hide();
+                    stopSolvingButton.hide();
+                    createProblemButton.show();
+                } else if (!response.ok) {
+                    return handleErrorResponse('Loading the problem failed', response);
                 } else {
-                    return response.json().then((data) => showProblem(data));
+                    showProblemFound();
                 }
             })
             .catch((error) => handleClientError('Failed to process response', error));
 };
 
+const createProblem = () => {
+    fetch(`/vrp/${problemId}`, { ...fetchHeaders, method: 'POST' })
+            .then((response) => {
+                // 409 when the problem already exists
+                if (!response.ok && response.status !== 409) {
+                    return handleErrorResponse('Creating the problem failed', response);
+                }
+                showProblemFound();
+            })
+            .catch((error) => handleClientError('Failed to process response', error));
+};
+
 const solve = () => {
-    fetch('/vrp/solve', { ...fetchHeaders, method: 'POST' })
+    fetch(`/vrp/${problemId}/solve`, { ...fetchHeaders, method: 'POST' })
             .then((response) => {
                 if (!response.ok) {
                     return handleErrorResponse('Start solving failed', response);
                 } else {
                     updateSolvingStatus(true);
-                    autoRefreshCount = 300;
-                    if (autoRefreshIntervalId == null) {
-                        autoRefreshIntervalId = setInterval(autoRefresh, 500);
-                    }
                 }
             })
             .catch((error) => handleClientError('Failed to process response', error));
 };
 
 const stopSolving = () => {
-    fetch('/vrp/stopSolving', { ...fetchHeaders, method: 'POST' })
+    fetch(`/vrp/${problemId}/stopSolving`, { ...fetchHeaders, method: 'POST' })
             .then((response) => {
                 if (!response.ok) {
                     return handleErrorResponse('Stop solving failed', response);
                 } else {
                     updateSolvingStatus(false);
-                    getStatus();
                 }
             })
             .catch((error) => handleClientError('Failed to process response', error));
@@ -141,21 +191,11 @@ const updateSolvingStatus = (solving) => {
         solveButton.hide();
         stopSolvingButton.show();
     } else {
-        autoRefreshCount = 0;
         solveButton.show();
         stopSolvingButton.hide();
     }
 };
 
-const autoRefresh = () => {
-    getStatus();
-    autoRefreshCount--;
-    if (autoRefreshCount <= 0) {
-        clearInterval(autoRefreshIntervalId);
-        autoRefreshIntervalId = null;
-    }
-};
-
 const depotPopupContent = (depot, color) => `<h5>Depot ${depot.id}</h5>
 <ul class="list-unstyled">
 <li><span style="background-color: ${color}; display: inline-block; width: 12px; height: 12px; text-align: center">
@@ -187,11 +227,27 @@ const getCustomerMarker = ({ id, location }) => {
     return marker;
 };
 
+// Markers that left the viewport are not sent anymore, so they are removed
+const removeMarkersExcept = (markerByIdMap, group, idList) => {
+    const idSet = new Set(idList);
+    markerByIdMap.forEach((marker, id) => {
+        if (!idSet.has(id)) {
+            group.removeLayer(marker);
+            markerByIdMap.delete(id);
+        }
+    });
+};
+
 const showProblem = ({ solution, scoreExplanation, isSolving }) => {
+    // Locations are sent once and referred to by index; customers are sent column by column
+    const { locationList, customerList } = solution;
+    const customerLocation = (index) => locationList[customerList.location[index]];
     if (!initialized) {
         initialized = true;
         map.fitBounds(solution.bounds);
     }
+    removeMarkersExcept(depotByIdMap, depotGroup, solution.depotList.map(({ id }) => id));
+    removeMarkersExcept(customerByIdMap, customerGroup, customerList.id);
     // Vehicles
     $('[data-toggle="tooltip-load"]').tooltip('dispose');
     vehiclesTable.children().remove();
@@ -224,7 +280,7 @@ const showProblem = ({ solution, scoreExplanation, isSolving }) => {
         const { id } = depot;
         const color = colorByDepot(depot);
         const icon = defaultIcon;
-        const marker = getDepotMarker(depot);
+        const marker = getDepotMarker({ id, location: locationList[depot.location] });
         marker.setIcon(icon);
         marker.setPopupContent(depotPopupContent(depot, color));
         depotsTable.append(`<tr>
@@ -234,12 +290,17 @@ const showProblem = ({ solution, scoreExplanation, isSolving }) => {
       </tr>`);
     });
     // Customers
-    solution.customerList.forEach((customer) => {
+    customerList.id.forEach((id, index) => {
+        const customer = { id, location: customerLocation(index), demand: customerList.demand[index] };
         getCustomerMarker(customer).setPopupContent(customerPopupContent(customer));
     });
     // Route
     routeGroup.clearLayers();
+    // Every route comes clipped to the viewport and simplified to the zoom level, as one polyline per visible part
     solution.vehicleList.forEach((vehicle) => {
+        if (vehicle.route.length === 0) {
+            return;
+        }
         L.polyline(vehicle.route, { color: colorByVehicle(vehicle) }).addTo(routeGroup);
     });
 
@@ -251,7 +312,9 @@ const showProblem = ({ solution, scoreExplanation, isSolving }) => {
 };
 
 const map = L.map('map', { doubleClickZoom: false }).setView([51.505, -0.09], 13);
-map.whenReady(getStatus);
+map.whenReady(loadProblem);
+// Fitting the map to the problem bounds, on the first status, moves it as well
+map.on('moveend', listenToStatus);
 
 L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
     maxZoom: 19,
@@ -264,6 +327,8 @@ const routeGroup = L.layerGroup().addTo(map);
 
 solveButton.click(solve);
 stopSolvingButton.click(stopSolving);
+createProblemButton.click(createProblem);
 
 updateSolvingStatus();
+createProblemButton.hide();
 $('[data-toggle="tooltip"]').tooltip();
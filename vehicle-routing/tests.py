@@ -1,6 +1,25 @@
-from domain import Location, Depot, Customer, Vehicle, VehicleRoutingSolution, EuclideanDistanceCalculator
-from constraints import vehicle_routing_constraints, total_distance, vehicle_capacity
+import gzip
+import math
+import threading
+import numpy as np
+import pytest
+from domain import Location, Depot, Customer, Vehicle, VehicleRoutingSolution, EuclideanDistanceCalculator, \
+    DemoDataBuilder, DistanceMatrix
+from constraints import vehicle_routing_constraints, total_distance, vehicle_capacity, customer_lateness
+from distance_cache import DistanceMatrixCache
+from spatial_index import SpatialIndex
+from instance_sampling import DISTRIBUTIONS
+from construction import build_sweep_routes
+from dispatch import ImmediateProblemChangeDirector, add_customer, remove_customer, pin_served_customers, \
+    create_customer, AddCustomerProblemChange, ChangeVehicleCapacityProblemChange
+from solver_config import create_solver_config
+from checkpoint import CheckpointWriter, solution_to_checkpoint, solution_from_checkpoint
+from viewport import Viewport, SolutionView, simplify_polyline, clip_polyline
+from decomposition import split_into_partitions, build_partition_solution, apply_routes, DEPOT_MODE, SECTOR_MODE
+from random import Random
 
+from optapy import solver_manager_create, score_manager_create
+from optapy.types import Duration
 from optapy.test import ConstraintVerifier, constraint_verifier_build
 
 constraint_verifier: ConstraintVerifier = constraint_verifier_build(vehicle_routing_constraints,
@@ -8,8 +27,9 @@ constraint_verifier: ConstraintVerifier = constraint_verifier_build(vehicle_rout
 location1 = Location(1, 0.0, 0.0)
 location2 = Location(2, 0.0, 4.0)
 location3 = Location(3, 3.0, 0.0)
+location4 = Location(4, 3.0, 4.0)
 
-EuclideanDistanceCalculator().init_distance_maps((location1, location2, location3))
+EuclideanDistanceCalculator().init_distance_maps((location1, location2, location3, location4))
 
 
 def test_vehicle_capacity_unpenalized():
@@ -45,3 +65,382 @@ def test_total_distance():
     constraint_verifier.verify_that(total_distance) \
         .given(vehicle_a, customer_1, customer_2) \
         .penalizes_by((4 + 5 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE)
+
+
+def test_customer_lateness():
+    vehicle_a = Vehicle(1, 100, Depot(1, location1))
+    # Legs of 4 and 5 degrees take 44 400 and 55 500 seconds to drive
+    customer_1 = Customer(2, location2, 10, ready_time=50_000, due_time=60_000, service_duration=1_000)
+    customer_2 = Customer(3, location3, 10, due_time=100_000)
+    vehicle_a.get_customer_list().extend([customer_1, customer_2])
+
+    constraint_verifier.verify_that(customer_lateness) \
+        .given(vehicle_a, customer_1, customer_2) \
+        .penalizes_by(50_000 + 1_000 + 55_500 - 100_000)
+
+
+def test_total_lateness_follows_customer_list_changes():
+    vehicle_a = Vehicle(1, 100, Depot(1, location1))
+    customer_1 = Customer(2, location2, 10, ready_time=50_000, service_duration=1_000)
+    customer_2 = Customer(3, location3, 10, due_time=60_000)
+    customer_3 = Customer(4, location4, 10, service_duration=500)
+    vehicle_a.get_customer_list().extend([customer_1, customer_2])
+    # Arrives at customer_2 at 51_000 + 55_500
+    assert vehicle_a.get_total_lateness() == 51_000 + 55_500 - 60_000
+
+    vehicle_a.get_customer_list().insert(0, customer_3)
+    # Arrives at customer_2 at 90_300 + 55_500
+    assert vehicle_a.get_total_lateness() == 90_300 + 55_500 - 60_000
+
+    vehicle_a.get_customer_list().remove(customer_1)
+    # Arrives at customer_2 at 56_000 + 44_400
+    assert vehicle_a.get_total_lateness() == 56_000 + 44_400 - 60_000
+
+
+def test_route_totals_are_computed_from_the_current_customer_list():
+    vehicle_a = Vehicle(1, 100, Depot(1, location1))
+    customer_1 = Customer(2, location2, 80)
+    customer_2 = Customer(3, location3, 40)
+    customer_3 = Customer(4, location4, 10)
+    vehicle_a.get_customer_list().extend([customer_1, customer_2])
+    assert vehicle_a.get_total_demand() == 120
+    assert vehicle_a.get_total_distance_meters() == (4 + 5 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+    vehicle_a.get_customer_list().insert(1, customer_3)
+    assert vehicle_a.get_total_demand() == 130
+    assert vehicle_a.get_total_distance_meters() == (4 + 3 + 4 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+    vehicle_a.set_customer_list([customer_2])
+    assert vehicle_a.get_total_demand() == 40
+    assert vehicle_a.get_total_distance_meters() == (3 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+    # A customer changed in place, as a problem change does
+    customer_2.demand = 50
+    assert vehicle_a.get_total_demand() == 50
+
+
+def test_distance_matrix_grows_in_place():
+    matrix = np.array([[0, 3], [3, 0]], dtype=np.int32)
+    distance_matrix = DistanceMatrix(matrix)
+    assert distance_matrix.get_distance(0, 1) == 3
+    assert isinstance(distance_matrix.get_distance(0, 1), int)
+
+    for size in range(2, 40):
+        location = Location(size, 0.0, 0.0)
+        assert distance_matrix.add_location(location, list(range(100, 100 + size))) == size
+        assert location.distance_index == size and location.distance_matrix is distance_matrix
+    assert len(distance_matrix) == 40
+    assert distance_matrix.matrix.shape == (40, 40)
+    assert distance_matrix.matrix.dtype == np.int32
+    assert distance_matrix.get_distance(1, 0) == 3
+    assert distance_matrix.get_distance(39, 5) == distance_matrix.get_distance(5, 39) == 105
+    assert distance_matrix.get_distance(39, 39) == 0
+
+
+def test_distance_matrix_cache(tmp_path):
+    cache = DistanceMatrixCache(str(tmp_path))
+    location_list = [Location(4, 0.0, 0.0), Location(5, 0.0, 4.0), Location(6, 3.0, 0.0)]
+    calculator = EuclideanDistanceCalculator(cache)
+    calculator.init_distance_maps(location_list)
+
+    cached_location_list = [Location(7, 0.0, 0.0), Location(8, 0.0, 4.0), Location(9, 3.0, 0.0)]
+    cached_matrix = cache.load(cache.get_key(cached_location_list, 'EuclideanDistanceCalculator'))
+    assert cached_matrix is not None
+    assert isinstance(cached_matrix.matrix, np.memmap)
+    assert cached_matrix.get_distance(1, 2) == 5 * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+    cache.max_size_bytes = 0
+    cache.evict()
+    assert cache.load(cache.get_key(cached_location_list, 'EuclideanDistanceCalculator')) is None
+
+
+def test_spatial_index_k_nearest():
+    random = Random(0)
+    location_list = [Location(i, random.uniform(43.75, 43.81), random.uniform(11.17, 11.29)) for i in range(300)]
+    nearest_indices, nearest_distances = SpatialIndex.of_locations(location_list).get_k_nearest(10)
+
+    for index, location in enumerate(location_list):
+        distances = sorted((math.dist((location.latitude, location.longitude), (other.latitude, other.longitude)),
+                            other_index)
+                           for other_index, other in enumerate(location_list) if other_index != index)
+        assert list(nearest_indices[index]) == [other_index for _, other_index in distances[:10]]
+        assert list(nearest_distances[index]) == pytest.approx([distance for distance, _ in distances[:10]])
+
+    calculator = EuclideanDistanceCalculator()
+    calculator.init_distance_maps(location_list)
+    calculator.init_nearby_maps(location_list, 10)
+    first, second = location_list[0], location_list[nearest_indices[0][0]]
+    assert first.get_nearby_distance(second) == first.get_distance_to(second)
+    assert first.get_nearby_distance(location_list[nearest_indices[0][-1]]) > first.get_nearby_distance(second)
+
+
+def test_sparse_distance_matrix_matches_dense():
+    random = Random(1)
+    location_list = [Location(i, random.uniform(43.75, 43.81), random.uniform(11.17, 11.29)) for i in range(60)]
+    dense_matrix = EuclideanDistanceCalculator().calculate_distance_matrix(location_list)
+    calculator = EuclideanDistanceCalculator(sparse_neighbour_count=5, sparse_cache_size=10)
+    sparse_matrix = calculator.init_distance_maps(location_list, location_list[-2:])
+
+    for from_index, location in enumerate(location_list):
+        assert len(sparse_matrix.rows[from_index]) <= (len(location_list) if from_index >= 58 else 8)
+        for to_index, other_location in enumerate(location_list):
+            assert location.get_distance_to(other_location) == dense_matrix.get_distance(from_index, to_index)
+            assert len(sparse_matrix.cache) <= 10
+
+
+@pytest.mark.parametrize('sparse_neighbour_count', [None, 5])
+def test_added_location_gets_distances(sparse_neighbour_count):
+    random = Random(2)
+    location_list = [Location(i, random.uniform(43.75, 43.81), random.uniform(11.17, 11.29)) for i in range(30)]
+    calculator = EuclideanDistanceCalculator(sparse_neighbour_count=sparse_neighbour_count)
+    calculator.init_distance_maps(location_list[:-1], location_list[:1])
+    calculator.init_nearby_maps(location_list[:-1], 5)
+    calculator.add_location(location_list[-1], location_list[:-1], 5)
+
+    dense_matrix = EuclideanDistanceCalculator().calculate_distance_matrix(location_list)
+    for from_index, location in enumerate(location_list):
+        for to_index, other_location in enumerate(location_list):
+            assert location.get_distance_to(other_location) == dense_matrix.get_distance(from_index, to_index)
+    nearest_location = min(location_list[:-1], key=lambda location: location.get_distance_to(location_list[-1]))
+    assert location_list[-1].get_nearby_distance(nearest_location) == \
+        nearest_location.get_nearby_distance(location_list[-1]) == nearest_location.get_distance_to(location_list[-1])
+
+
+def test_dispatch_changes_keep_served_customers_in_place():
+    solution = VehicleRoutingSolution.empty()
+    build_sweep_routes(solution)
+    director = ImmediateProblemChangeDirector()
+    vehicle_a, vehicle_b = solution.vehicle_list[:2]
+    served_customer_list = vehicle_a.customer_list[:2] + vehicle_b.customer_list[:1]
+    pin_served_customers(solution, vehicle_a.id, [customer.id for customer in served_customer_list], director)
+    assert vehicle_a.customer_list[:3] == served_customer_list
+    assert vehicle_a.pinned_count == 3
+    assert served_customer_list[2] not in vehicle_b.customer_list
+
+    customer = create_customer(1000, 1001, 43.78, 11.23, 1)
+    add_customer(solution, customer, director)
+    assert customer in solution.customer_list and customer.location in solution.location_list
+    assert sum(vehicle.customer_list.count(customer) for vehicle in solution.vehicle_list) == 1
+    assert vehicle_a.customer_list[:3] == served_customer_list
+    assert customer.location.get_distance_to(vehicle_a.depot.location) > 0
+
+    assert not remove_customer(solution, served_customer_list[0].id, director)
+    assert remove_customer(solution, customer.id, director)
+    assert customer not in solution.customer_list
+    assert all(customer not in vehicle.customer_list for vehicle in solution.vehicle_list)
+
+    # Served by vehicle_b after all: it is no longer pinned in the route of vehicle_a
+    pin_served_customers(solution, vehicle_b.id, [served_customer_list[1].id], director)
+    assert vehicle_b.customer_list[:1] == served_customer_list[1:2]
+    assert vehicle_a.customer_list[:2] == [served_customer_list[0], served_customer_list[2]]
+    assert vehicle_a.pinned_count == 2 and vehicle_b.pinned_count == 1
+
+
+def test_dispatch_keeps_sparse_distances_of_added_and_removed_customers():
+    solution = DemoDataBuilder.builder().set_min_demand(1).set_max_demand(2).set_vehicle_capacity(25) \
+        .set_customer_count(20).set_vehicle_count(2).set_depot_count(1) \
+        .set_south_west_corner(Location(0, 43.751466, 11.177210)) \
+        .set_north_east_corner(Location(0, 43.809291, 11.290195)).set_sparse_neighbour_count(5).build()
+    build_sweep_routes(solution)
+    director = ImmediateProblemChangeDirector()
+    removed_customer = create_customer(1000, 1001, 43.78, 11.23, 1)
+    add_customer(solution, removed_customer, director)
+    assert solution.location_list.count(removed_customer.location) == 1
+    assert remove_customer(solution, removed_customer.id, director)
+    assert removed_customer.location not in solution.location_list
+
+    customer = create_customer(1002, 1003, 43.76, 11.25, 1)
+    add_customer(solution, customer, director)
+    calculator = EuclideanDistanceCalculator()
+    for location in solution.location_list + [removed_customer.location]:
+        assert location.get_distance_to(customer.location) == calculator.calculate_distance(location, customer.location)
+        assert removed_customer.location.get_distance_to(location) == \
+            calculator.calculate_distance(removed_customer.location, location)
+
+
+def test_dispatch_changes_reach_a_running_solver():
+    solution = VehicleRoutingSolution.empty()
+    build_sweep_routes(solution)
+    vehicle = solution.vehicle_list[0]
+    # Closed at the end, so its threads do not keep the test process alive
+    with solver_manager_create(create_solver_config(Duration.ofSeconds(5))) as solver_manager:
+        score_manager = score_manager_create(solver_manager)
+        # The solver's score of every best solution, with the score calculated from scratch
+        score_pair_list = []
+        final_best_solution_list = []
+        solving_ended = threading.Event()
+
+        def final_best_solution_consumer(best_solution):
+            final_best_solution_list.append(best_solution)
+            solving_ended.set()
+        solver_job = solver_manager.solveAndListen(
+            1, lambda _: solution,
+            lambda best_solution: score_pair_list.append((best_solution.get_score().toString(),
+                                                          score_manager.updateScore(best_solution).toString())),
+            final_best_solution_consumer=final_best_solution_consumer)
+        customer = create_customer(1000, 1001, 43.78, 11.23, 1)
+        solver_job.addProblemChange(AddCustomerProblemChange(customer)).get()
+        # The first customer grows the distance matrix, the second one fits in it
+        other_customer = create_customer(1002, 1003, 43.77, 11.21, 1)
+        solver_job.addProblemChange(AddCustomerProblemChange(other_customer)).get()
+        solver_job.addProblemChange(ChangeVehicleCapacityProblemChange(vehicle.id, 1)).get()
+        assert solving_ended.wait(60)
+
+    final_solution = final_best_solution_list[0]
+    assert len(score_pair_list) >= 2
+    assert all(score == calculated_score for score, calculated_score in score_pair_list)
+    for added_customer in (customer, other_customer):
+        assert sum(stop.id == added_customer.id for route_vehicle in final_solution.vehicle_list
+                   for stop in route_vehicle.customer_list) == 1
+    assert next(route_vehicle.capacity for route_vehicle in final_solution.vehicle_list
+                if route_vehicle.id == vehicle.id) == 1
+
+
+def test_checkpoint_round_trip(tmp_path):
+    solution = VehicleRoutingSolution.empty()
+    build_sweep_routes(solution)
+    solution.vehicle_list[0].set_pinned_count(2)
+    checkpoint_writer = CheckpointWriter(str(tmp_path), lambda problem_id: solution_to_checkpoint(solution), 60)
+    checkpoint_writer.mark_changed(3)
+    checkpoint_writer.flush()
+    assert checkpoint_writer.get_problem_id_list() == [3]
+
+    restored = solution_from_checkpoint(checkpoint_writer.load(3))
+    assert solution_to_checkpoint(restored) == solution_to_checkpoint(solution)
+    assert restored.to_dict() == solution.to_dict()
+    assert restored.vehicle_list[0].pinned_count == 2
+    for vehicle, restored_vehicle in zip(solution.vehicle_list, restored.vehicle_list):
+        assert restored_vehicle.get_total_distance_meters() == vehicle.get_total_distance_meters()
+
+
+def test_checkpoint_writer_skips_corrupt_checkpoints_and_failed_writes(tmp_path):
+    def snapshot(problem_id):
+        if problem_id == 1:
+            raise ValueError('no such problem')
+        return {'solving': False}
+
+    checkpoint_writer = CheckpointWriter(str(tmp_path), snapshot, 60)
+    checkpoint_writer.mark_changed(1)
+    checkpoint_writer.mark_changed(2)
+    checkpoint_writer.flush()
+    assert checkpoint_writer.get_problem_id_list() == [2]
+
+    (tmp_path / '3.json.gz').write_bytes(b'not gzip')
+    with gzip.open(tmp_path / '4.json.gz', 'wt') as checkpoint_file:
+        checkpoint_file.write('{"solving":')
+    assert checkpoint_writer.load(2) == {'solving': False}
+    assert checkpoint_writer.load(3) is None
+    assert checkpoint_writer.load(4) is None
+
+
+def test_simplify_and_clip_polyline():
+    polyline = [(0.0, 0.0), (0.0, 1.0), (0.001, 2.0), (0.0, 3.0), (2.0, 3.0)]
+    assert simplify_polyline(polyline, 0.01) == [(0.0, 0.0), (0.0, 3.0), (2.0, 3.0)]
+    assert simplify_polyline(polyline, 0.0001) == polyline
+    assert clip_polyline(polyline, Viewport(-0.5, 0.5, 0.5, 1.5, 10)) == [[(0.0, 0.0), (0.0, 1.0), (0.001, 2.0)]]
+    assert clip_polyline(polyline, Viewport(5.0, 5.0, 6.0, 6.0, 10)) == []
+
+
+def test_viewport_only_sends_what_it_shows():
+    solution = VehicleRoutingSolution.empty()
+    build_sweep_routes(solution)
+    south_west_corner, north_east_corner = solution.get_bounds()
+    solution_view = SolutionView(solution)
+
+    everything = solution_view.to_dict(Viewport(south_west_corner.latitude, south_west_corner.longitude,
+                                                north_east_corner.latitude, north_east_corner.longitude, 19))
+    assert len(everything['customerList']['id']) == len(solution.customer_list)
+    assert len(everything['vehicleList']) == len(solution.vehicle_list)
+    assert [len(vehicle['route'][0]) for vehicle in everything['vehicleList']] == \
+        [len(vehicle.customer_list) + 2 for vehicle in solution.vehicle_list]
+
+    middle_latitude = (south_west_corner.latitude + north_east_corner.latitude) / 2
+    south_half = solution_view.to_dict(Viewport(south_west_corner.latitude, south_west_corner.longitude,
+                                                middle_latitude, north_east_corner.longitude, 10))
+    assert sorted(south_half['customerList']['id']) == sorted(
+        customer.id for customer in solution.customer_list if customer.location.latitude <= middle_latitude)
+    for vehicle in south_half['vehicleList']:
+        assert south_half['depotList'][vehicle['depot']]['id'] == \
+            next(v for v in solution.vehicle_list if v.id == vehicle['id']).depot.id
+        for part in vehicle['route']:
+            assert any(latitude <= middle_latitude for latitude, _ in part)
+    assert sum(len(part) for vehicle in south_half['vehicleList'] for part in vehicle['route']) < \
+        sum(len(vehicle.customer_list) + 2 for vehicle in solution.vehicle_list)
+
+
+def test_solution_to_dict_refers_to_locations_by_index():
+    depot = Depot(1, location1)
+    customer_1 = Customer(2, location2, 3)
+    customer_2 = Customer(3, location3, 4)
+    vehicle = Vehicle(1, 100, depot, [customer_2, customer_1])
+    solution = VehicleRoutingSolution('test', [location1, location2, location3], [depot], [vehicle],
+                                      [customer_1, customer_2], location1, location4)
+
+    solution_dict = solution.to_dict()
+    assert solution_dict['locationList'] == [[0.0, 0.0], [0.0, 4.0], [3.0, 0.0]]
+    assert solution_dict['depotList'] == [{'id': 1, 'location': 0}]
+    assert solution_dict['customerList'] == {'id': [2, 3], 'location': [1, 2], 'demand': [3, 4]}
+    assert solution_dict['vehicleList'][0]['depot'] == 0
+    assert solution_dict['vehicleList'][0]['customerList'] == [1, 0]
+    assert solution_dict['vehicleList'][0]['totalDemand'] == 7
+
+
+def test_sweep_routes_respect_capacity():
+    solution = VehicleRoutingSolution.empty()
+    assert build_sweep_routes(solution) == len(solution.customer_list)
+
+    routed_customer_list = [customer for vehicle in solution.vehicle_list for customer in vehicle.customer_list]
+    assert sorted(customer.id for customer in routed_customer_list) == \
+        sorted(customer.id for customer in solution.customer_list)
+    for vehicle in solution.vehicle_list:
+        assert vehicle.get_total_demand() <= vehicle.capacity
+
+
+@pytest.mark.parametrize('mode', [DEPOT_MODE, SECTOR_MODE])
+def test_partitions_cover_problem(mode):
+    solution = VehicleRoutingSolution.empty()
+    partition_list = split_into_partitions(solution, mode, 4)
+    assert len(partition_list) == (2 if mode == DEPOT_MODE else 4)
+
+    assert sorted(vehicle.id for partition in partition_list for vehicle in partition.vehicle_list) == \
+        sorted(vehicle.id for vehicle in solution.vehicle_list)
+    assert sorted(customer.id for partition in partition_list for customer in partition.customer_list) == \
+        sorted(customer.id for customer in solution.customer_list)
+    for partition in partition_list:
+        assert all(vehicle.depot is partition.depot for vehicle in partition.vehicle_list)
+
+
+def test_partition_routes_merge_back():
+    solution = VehicleRoutingSolution.empty()
+    route_map = dict()
+    for partition in split_into_partitions(solution, SECTOR_MODE, 4):
+        partition_solution = build_partition_solution(partition.to_dict())
+        build_sweep_routes(partition_solution)
+        route_map.update({vehicle.id: [customer.id for customer in vehicle.customer_list]
+                          for vehicle in partition_solution.vehicle_list})
+
+    apply_routes(solution, route_map)
+    for vehicle in solution.vehicle_list:
+        assert [customer.id for customer in vehicle.customer_list] == route_map[vehicle.id]
+        assert all(customer in solution.customer_list for customer in vehicle.customer_list)
+
+
+@pytest.mark.parametrize('distribution', DISTRIBUTIONS)
+def test_scaled_demo_data_is_reproducible(distribution):
+    def build(seed):
+        solution = DemoDataBuilder.scaled(1000, distribution, seed).build()
+        return [(customer.location.latitude, customer.location.longitude, customer.demand)
+                for customer in solution.customer_list], solution
+
+    customer_data, solution = build(7)
+    assert build(7)[0] == customer_data
+    assert build(8)[0] != customer_data
+
+    assert len(solution.customer_list) == 1000
+    assert sum(customer.demand for customer in solution.customer_list) <= \
+        sum(vehicle.capacity for vehicle in solution.vehicle_list)
+    south_west_corner, north_east_corner = solution.get_bounds()
+    for latitude, longitude, demand in customer_data:
+        assert south_west_corner.latitude <= latitude <= north_east_corner.latitude
+        assert south_west_corner.longitude <= longitude <= north_east_corner.longitude
+        assert 1 <= demand <= 2
@@ -0,0 +1,173 @@
+"""
+Viewport-aware status payloads for the map: only the vehicles, depots and customers a viewport shows, with the
+route geometry clipped to the viewport and simplified to what its zoom level can show.
+"""
+import math
+import numpy as np
+
+# Route points closer than this to the simplified line are dropped
+ROUTE_TOLERANCE_PIXELS = 1
+# Web map tiles are this many pixels wide, and the world is 2^zoom tiles wide
+TILE_SIZE_PIXELS = 256
+
+
+class Viewport:
+    def __init__(self, south, west, north, east, zoom):
+        self.south = south
+        self.west = west
+        self.north = north
+        self.east = east
+        self.zoom = zoom
+
+    @staticmethod
+    def from_args(args):
+        """The viewport of the south, west, north, east and zoom query parameters; None unless all of them are set."""
+        south, west, north, east = (args.get(name, type=float) for name in ('south', 'west', 'north', 'east'))
+        zoom = args.get('zoom', type=int)
+        if None in (south, west, north, east, zoom):
+            return None
+        return Viewport(south, west, north, east, zoom)
+
+    def get_tolerance(self):
+        """Size of ROUTE_TOLERANCE_PIXELS at the zoom level, in degrees."""
+        return ROUTE_TOLERANCE_PIXELS * 360 / (TILE_SIZE_PIXELS * 2 ** self.zoom)
+
+    def get_precision(self):
+        """Decimal places that tell apart neighbouring pixels at the zoom level, up to the 6 of Location.to_dict."""
+        return min(6, max(0, math.ceil(math.log10(1 / self.get_tolerance()))))
+
+    def contains(self, latitude, longitude):
+        return self.south <= latitude <= self.north and self.west <= longitude <= self.east
+
+    def intersects(self, south, west, north, east):
+        return south <= self.north and north >= self.south and west <= self.east and east >= self.west
+
+
+def get_segment_distance(point, start, end):
+    # Planar distance in degrees, which is all the simplification needs at map scale
+    start_to_end = (end[0] - start[0], end[1] - start[1])
+    length_squared = start_to_end[0] ** 2 + start_to_end[1] ** 2
+    if length_squared == 0:
+        return math.dist(point, start)
+    fraction = ((point[0] - start[0]) * start_to_end[0] + (point[1] - start[1]) * start_to_end[1]) / length_squared
+    fraction = min(1.0, max(0.0, fraction))
+    return math.dist(point, (start[0] + fraction * start_to_end[0], start[1] + fraction * start_to_end[1]))
+
+
+def simplify_polyline(point_list, tolerance):
+    """Ramer-Douglas-Peucker: the fewest points of point_list that keep the line within tolerance of every point."""
+    if len(point_list) < 3:
+        return list(point_list)
+    is_kept = [False] * len(point_list)
+    is_kept[0] = is_kept[-1] = True
+    range_stack = [(0, len(point_list) - 1)]
+    while range_stack:
+        first, last = range_stack.pop()
+        max_distance = tolerance
+        max_index = None
+        for index in range(first + 1, last):
+            distance = get_segment_distance(point_list[index], point_list[first], point_list[last])
+            if distance > max_distance:
+                max_distance = distance
+                max_index = index
+        if max_index is not None:
+            is_kept[max_index] = True
+            range_stack.append((first, max_index))
+            range_stack.append((max_index, last))
+    return [point for point, kept in zip(point_list, is_kept) if kept]
+
+
+def clip_polyline(point_list, viewport):
+    """The runs of consecutive segments of point_list whose bounding box overlaps the viewport."""
+    part_list = []
+    part = None
+    for start, end in zip(point_list, point_list[1:]):
+        if viewport.intersects(min(start[0], end[0]), min(start[1], end[1]),
+                               max(start[0], end[0]), max(start[1], end[1])):
+            if part is None:
+                part = [start]
+                part_list.append(part)
+            part.append(end)
+        else:
+            part = None
+    return part_list
+
+
+class SolutionView:
+    """
+    The customer coordinates and the route bounding boxes of a solution, computed once per solution, so that every
+    viewport only costs a vectorized filter of the customers and the work on the routes it shows.
+    """
+    def __init__(self, solution):
+        self.solution = solution
+        self.customer_coordinates = np.array([(customer.location.latitude, customer.location.longitude)
+                                              for customer in solution.customer_list], dtype=np.float64).reshape(-1, 2)
+        self.route_list = []
+        for vehicle in solution.vehicle_list:
+            depot_point = (vehicle.depot.location.latitude, vehicle.depot.location.longitude)
+            self.route_list.append([depot_point] +
+                                   [(customer.location.latitude, customer.location.longitude)
+                                    for customer in vehicle.customer_list] +
+                                   [depot_point] if vehicle.customer_list else [])
+        self.route_bounds = np.array([(*np.min(route, axis=0), *np.max(route, axis=0)) if route else (np.inf,) * 4
+                                      for route in self.route_list], dtype=np.float64).reshape(-1, 4)
+
+    def to_dict(self, viewport):
+        """
+        Like VehicleRoutingSolution.to_dict, for the vehicles whose route crosses the viewport, the customers inside
+        it and the depots of both. Instead of its customer list, every vehicle has its route as a list of polylines.
+        """
+        solution = self.solution
+        customer_latitudes = self.customer_coordinates[:, 0]
+        customer_longitudes = self.customer_coordinates[:, 1]
+        customer_list = [solution.customer_list[index] for index in np.flatnonzero(
+            (customer_latitudes >= viewport.south) & (customer_latitudes <= viewport.north) &
+            (customer_longitudes >= viewport.west) & (customer_longitudes <= viewport.east)).tolist()]
+        south, west, north, east = self.route_bounds.T
+        vehicle_index_list = np.flatnonzero((south <= viewport.north) & (north >= viewport.south) &
+                                            (west <= viewport.east) & (east >= viewport.west)).tolist()
+
+        depot_list = [depot for depot in solution.depot_list
+                      if viewport.contains(depot.location.latitude, depot.location.longitude)]
+        depot_id_set = {depot.id for depot in depot_list}
+        for vehicle_index in vehicle_index_list:
+            depot = solution.vehicle_list[vehicle_index].depot
+            if depot.id not in depot_id_set:
+                depot_id_set.add(depot.id)
+                depot_list.append(depot)
+        depot_index_map = {depot.id: index for index, depot in enumerate(depot_list)}
+        location_list = [customer.location for customer in customer_list] + [depot.location for depot in depot_list]
+        location_index_map = {location.id: index for index, location in enumerate(location_list)}
+
+        tolerance = viewport.get_tolerance()
+        precision = viewport.get_precision()
+        vehicle_dict_list = []
+        for vehicle_index in vehicle_index_list:
+            vehicle = solution.vehicle_list[vehicle_index]
+            route = [[[round(latitude, precision), round(longitude, precision)]
+                      for latitude, longitude in simplify_polyline(part, tolerance)]
+                     for part in clip_polyline(self.route_list[vehicle_index], viewport)]
+            vehicle_dict_list.append({
+                'id': vehicle.id,
+                'capacity': vehicle.capacity,
+                'depot': depot_index_map[vehicle.depot.id],
+                'route': route,
+                'customerCount': len(vehicle.customer_list),
+                'pinnedCount': vehicle.pinned_count,
+                'totalDemand': vehicle.get_total_demand(),
+                'totalDistanceMeters': vehicle.get_total_distance_meters(),
+            })
+        return {
+            'name': solution.name,
+            'bounds': list(map(lambda location: location.to_dict(), solution.get_bounds())),
+            'locationList': list(map(lambda location: location.to_dict(), location_list)),
+            'vehicleList': vehicle_dict_list,
+            'depotList': list(map(lambda depot: depot.to_dict(location_index_map), depot_list)),
+            'customerList': {
+                'id': [customer.id for customer in customer_list],
+                'location': [location_index_map[customer.location.id] for customer in customer_list],
+                'demand': [customer.demand for customer in customer_list],
+            },
+            'score': str(solution.score),
+            'distanceMeters': solution.get_distance_meters(),
+        }